@@ -1,12 +1,12 @@
 import os
+import json
+import signal
 import logging
 import asyncio
-from flask import Flask, request, abort
-from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import tornado.web
 from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, filters
-
-executor = ThreadPoolExecutor()
+from telegram.ext import Application, CommandHandler, MessageHandler, InlineQueryHandler, filters
 
 logging.basicConfig(
     level=logging.INFO,
@@ -14,62 +14,134 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
-
-@app.before_request
-def log_all_requests():
-    logger.info(f"👀 Входящий {request.method} на {request.path}")
-
 def init_telegram_app():
-    token = os.getenv("TELEGRAM_TOKEN")
-    application = Application.builder().token(token).build()
-
+    from bot.dispatch import ChatOrderedUpdateProcessor
     from bot.handlers import start, handle_text
+    from bot.bulk import handle_document
+    from bot.inline import handle_inline_query
+    from bot.jobs import status_command, cancel_command
+    from bot.persistence import SQLitePersistence
+    from bot.tracing import TracingRequest
+    from bot.config import TELEGRAM_API_URL
+
+    token = os.getenv("TELEGRAM_TOKEN")
+    builder = (
+        Application.builder()
+        .token(token)
+        .concurrent_updates(ChatOrderedUpdateProcessor())
+        .persistence(SQLitePersistence())
+        .request(TracingRequest(connection_pool_size=256))
+    )
+    if TELEGRAM_API_URL:
+        builder = builder.base_url(f"{TELEGRAM_API_URL}/bot").base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+    application = builder.build()
 
     application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("status", status_command))
+    application.add_handler(CommandHandler("cancel", cancel_command))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
+    application.add_handler(MessageHandler(
+        filters.Document.FileExtension("txt") | filters.Document.FileExtension("csv"), handle_document))
+    application.add_handler(InlineQueryHandler(handle_inline_query))
 
     logger.info("✅ Telegram application создана")
     return application
 
 telegram_app = init_telegram_app()
 
-@app.route("/", methods=["GET"])
-def health_check():
-    return "Bot is running", 200
-
-@app.route("/webhook", methods=["POST"])
-def webhook():
-    logger.info("→ Получен запрос в /webhook")
-    logger.info(f"📩 RAW body: {request.data}")
-
-    if request.headers.get("content-type") != "application/json":
-        logger.warning("Invalid content-type")
-        abort(400, "Invalid content-type")
-
-    data = request.get_json(silent=True)
-    if not data:
-        logger.warning("Empty request body")
-        abort(400, "Empty request body")
-
-    try:
-        update = Update.de_json(data, telegram_app.bot)
-
-        def handle_in_thread(update_obj):
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            try:
-                loop.run_until_complete(telegram_app.process_update(update_obj))
-            except Exception as e:
-                logger.exception(f"Ошибка в обработке update: {e}")
-
-        executor.submit(handle_in_thread, update)
-
-        return "OK", 200
-
-    except Exception as e:
-        logger.exception(f"❌ Ошибка при обработке апдейта: {e}")
-        return "Internal Server Error", 500
+def init_deduper():
+    from bot.config import IDEMPOTENCY_WINDOW, IDEMPOTENCY_DB_PATH, CLUSTER_WORKER_INDEX
+    from bot.idempotency import UpdateDeduper
+
+    path = IDEMPOTENCY_DB_PATH or None
+    if CLUSTER_WORKER_INDEX is not None and path:
+        # общий файл ведёт ingress; у воркера свой — он отсекает повтор от ingress,
+        # если тот не дождался ответа на уже принятый апдейт
+        path = str(Path(path).with_name(f"{Path(path).stem}.worker{CLUSTER_WORKER_INDEX}{Path(path).suffix}"))
+    return UpdateDeduper(IDEMPOTENCY_WINDOW, path)
+
+deduper = init_deduper()
+
+class BaseHandler(tornado.web.RequestHandler):
+    def prepare(self):
+        logger.info(f"👀 Входящий {self.request.method} на {self.request.path}")
+
+class HealthCheckHandler(BaseHandler):
+    def get(self):
+        self.write("Bot is running")
+
+class MetricsHandler(tornado.web.RequestHandler):
+    def get(self):
+        from bot.metrics import render
+
+        body, content_type = render()
+        self.set_header("Content-Type", content_type)
+        self.write(body)
+
+class TracesHandler(tornado.web.RequestHandler):
+    def get(self):
+        from bot.config import DEBUG_TOKEN
+        from bot.tracing import slowest
+
+        token = self.request.headers.get("X-Debug-Token") or self.get_query_argument("token", "")
+        if token != DEBUG_TOKEN:
+            raise tornado.web.HTTPError(403)
+        limit = int(self.get_query_argument("limit", "20"))
+        min_duration = float(self.get_query_argument("min", "0"))
+        self.set_header("Content-Type", "application/json; charset=utf-8")
+        self.write(json.dumps(slowest(limit, min_duration), ensure_ascii=False))
+
+class WebhookHandler(BaseHandler):
+    async def post(self):
+        logger.info("→ Получен запрос в /webhook")
+        logger.debug(f"📩 RAW body: {self.request.body}")
+
+        if self.request.headers.get("Content-Type") != "application/json":
+            logger.warning("Invalid content-type")
+            raise tornado.web.HTTPError(400, "Invalid content-type")
+
+        try:
+            data = json.loads(self.request.body or b"null")
+        except ValueError:
+            data = None
+        if not data:
+            logger.warning("Empty request body")
+            raise tornado.web.HTTPError(400, "Empty request body")
+
+        update_id = data.get("update_id")
+        dedupe = isinstance(update_id, int)
+        if dedupe and deduper.seen(update_id):
+            logger.info(f"🔁 Повторная доставка update_id={update_id}, пропускаю")
+            return self.write("OK")
+
+        from bot.tracing import begin_trace, span
+
+        begin_trace(update_id)
+        try:
+            # апдейт обработает update fetcher telegram_app на этом же loop
+            with span("webhook"):
+                update = Update.de_json(data, telegram_app.bot)
+                await telegram_app.update_queue.put(update)
+            if dedupe:
+                deduper.mark(update_id)
+        except Exception as e:
+            logger.exception(f"❌ Ошибка при обработке апдейта: {e}")
+            raise tornado.web.HTTPError(500, "Internal Server Error")
+
+        self.write("OK")
+
+def make_web_app():
+    from bot.config import DEBUG_TOKEN
+
+    routes = [
+        (r"/", HealthCheckHandler),
+        (r"/metrics", MetricsHandler),
+        (r"/webhook", WebhookHandler),
+    ]
+    # в трейсах update_id, chat_id и тайминги: без DEBUG_TOKEN эндпоинта нет вовсе
+    if DEBUG_TOKEN:
+        routes.append((r"/debug/traces", TracesHandler))
+    return tornado.web.Application(routes)
 
 async def setup_bot():
     try:
@@ -77,6 +149,18 @@ async def setup_bot():
         await telegram_app.start()
         logger.info("✅ Telegram application запущена")
 
+        from bot.gigachat import token_manager
+        from bot.bulk import resume_pending
+        from bot.jobs import durable_jobs
+        await token_manager.start()
+        resume_pending(telegram_app.bot)
+        durable_jobs.start(telegram_app.bot)
+
+        from bot.config import CLUSTER_WORKER_INDEX
+        if CLUSTER_WORKER_INDEX is not None:
+            logger.info(f"🧩 Воркер кластера #{CLUSTER_WORKER_INDEX}: webhook ставит ingress")
+            return True
+
         domain = os.getenv("RENDER_EXTERNAL_URL")
         if not domain:
             logger.error("❌ RENDER_EXTERNAL_URL не задан!")
@@ -95,22 +179,46 @@ async def setup_bot():
         logger.exception(f"❌ Setup bot failed: {e}")
         return False
 
-if __name__ == "__main__":
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+async def shutdown_bot():
+    from bot.gigachat import close_client
+    from bot.jobs import durable_jobs
+
+    await durable_jobs.stop()
+    if telegram_app.running:
+        await telegram_app.stop()
+    await telegram_app.update_processor.join()
+    await telegram_app.shutdown()
+    await close_client()
 
+async def main():
+    server = None
     try:
-        success = loop.run_until_complete(setup_bot())
+        success = await setup_bot()
         if not success:
             logger.error("❌ Не удалось установить webhook, завершение")
-            exit(1)
+            return 1
 
+        from bot.config import CLUSTER_WORKER_INDEX
         port = int(os.environ.get("PORT", 5000))
-        logger.info(f"🚀 Запуск Flask-сервера на порту {port}")
-        app.run(host="0.0.0.0", port=port, use_reloader=False)
+        # воркер кластера слушает только локально: снаружи апдейты приходят через ingress
+        address = "127.0.0.1" if CLUSTER_WORKER_INDEX is not None else "0.0.0.0"
+        server = make_web_app().listen(port, address=address)
+        logger.info(f"🚀 Веб-сервер запущен на порту {port}")
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        await stop.wait()
+        return 0
 
     except Exception as e:
         logger.exception(f"❌ Критическая ошибка при запуске: {e}")
+        return 1
     finally:
-        loop.run_until_complete(telegram_app.stop())
-        loop.close()
+        if server is not None:
+            server.stop()
+        await shutdown_bot()
+
+if __name__ == "__main__":
+    exit(asyncio.run(main()))
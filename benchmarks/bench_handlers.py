@@ -0,0 +1,262 @@
+"""Микробенчмарки CPU-стоимости одного апдейта: ветки handle_text/start, билдеры промптов, клавиатуры.
+
+Сеть не нужна: GigaChat подменяется мгновенной заглушкой, Update/Context — лёгкими фейками.
+
+    python benchmarks/bench_handlers.py --out bench.json
+    python benchmarks/bench_handlers.py --compare bench.json --threshold 0.25
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault("TELEGRAM_TOKEN", "123:bench")
+os.environ.setdefault("AUTH_KEY", "bench")
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="bench-"))
+os.environ["CACHE_DB_PATH"] = ""
+os.environ["IDEMPOTENCY_DB_PATH"] = ""
+os.environ["STREAM_EDIT_INTERVAL"] = "0"
+
+from bot import handlers, prompts, keyboards, history  # noqa: E402
+from bot.config import MODE_OPTIONS, LANG_OPTIONS, LANG_BUTTON  # noqa: E402
+
+logging.getLogger().setLevel(os.getenv("BENCH_LOG_LEVEL", "WARNING"))
+
+STUB_ANSWER = "1. Какие цели стоят перед функцией на горизонте 3 лет?\n2. Какие метрики вы отслеживаете?"
+
+
+async def fake_call_gigachat(messages, temperature, top_p=0.9, max_tokens=120, **kwargs):
+    return STUB_ANSWER
+
+
+async def fake_call_gigachat_variants(messages, n, temperature, top_p=0.9, max_tokens=120, **kwargs):
+    return [f"Вариант заголовка {i}: {STUB_ANSWER.splitlines()[0]}" for i in range(n)]
+
+
+async def fake_stream_gigachat(messages, temperature, top_p=0.9, max_tokens=120, **kwargs):
+    for part in STUB_ANSWER.split("\n"):
+        yield part + "\n"
+
+
+def stub_gigachat():
+    # подменяем клиент во всех модулях bot.*, которые его импортировали
+    for name, module in list(sys.modules.items()):
+        if not name.startswith("bot") or module is None:
+            continue
+        if hasattr(module, "call_gigachat"):
+            module.call_gigachat = fake_call_gigachat
+        if hasattr(module, "call_gigachat_variants"):
+            module.call_gigachat_variants = fake_call_gigachat_variants
+        if hasattr(module, "stream_gigachat"):
+            module.stream_gigachat = fake_stream_gigachat
+
+
+class FakeMessage:
+    _ids = 0
+
+    def __init__(self, text=""):
+        FakeMessage._ids += 1
+        self.message_id = FakeMessage._ids
+        self.text = text
+
+    async def reply_text(self, text, **kwargs):
+        return FakeMessage(text)
+
+    async def edit_text(self, text, **kwargs):
+        self.text = text
+        return self
+
+    async def delete(self):
+        return True
+
+
+class FakeChat:
+    def __init__(self, chat_id):
+        self.id = chat_id
+
+
+class FakeUpdate:
+    def __init__(self, text, chat_id=1):
+        self.message = FakeMessage(text)
+        self.effective_message = self.message
+        self.effective_chat = FakeChat(chat_id)
+        self.effective_user = FakeChat(chat_id)
+        self.update_id = FakeMessage._ids
+
+
+class FakeContext:
+    def __init__(self, user_data):
+        self.user_data = user_data
+        self.chat_data = {}
+        self.bot_data = {}
+
+
+Q_READY = {
+    "lang": "ru", "mode": "questions", "q_state": "ready",
+    "q_session": {"position": "директор по ИТ", "company": "банк", "context": "цифровая трансформация",
+                  "history": history.from_text(STUB_ANSWER)},
+    "last_input": "директор по ИТ / банк / цифровая трансформация", "last_mode": "questions",
+    "last_result": STUB_ANSWER,
+}
+ACTION_READY = {"lang": "ru", "mode": "action", "last_input": "Рост издержек на логистику",
+                "last_mode": "action", "last_result": "Рост издержек на логистику тормозит экспансию"}
+
+# имя -> (функция, user_data до вызова, текст сообщения)
+HANDLER_CASES = {
+    "start": ("start", {}, "/start"),
+    "menu": ("handle_text", {"lang": "ru", "mode": "action"}, "Меню"),
+    "lang_button": ("handle_text", {"lang": "ru"}, LANG_BUTTON),
+    "lang_select": ("handle_text", {"lang": "ru"}, next(iter(LANG_OPTIONS))),
+    "mode_select_action": ("handle_text", {"lang": "ru"}, "Экшн-тайтлы"),
+    "mode_select_questions": ("handle_text", {"lang": "ru"}, "Вопросы"),
+    "mode_select_structure": ("handle_text", {"lang": "en"}, "Структура"),
+    "questions_await_pc": ("handle_text", {"lang": "ru", "mode": "questions", "q_state": "await_pc"},
+                           "директор по ИТ в банке"),
+    "questions_bad_pc": ("handle_text", {"lang": "ru", "mode": "questions", "q_state": "await_pc"}, "директор"),
+    "questions_await_context": ("handle_text", {"lang": "ru", "mode": "questions", "q_state": "await_context",
+                                                "q_session": {"position": "директор по ИТ", "company": "банк"}},
+                                "цифровая трансформация"),
+    "questions_more": ("handle_text", Q_READY, handlers.BTN_MORE_Q),
+    "questions_followups": ("handle_text", Q_READY, handlers.BTN_FOLLOWUPS),
+    "refine_more": ("handle_text", ACTION_READY, "Ещё варианты"),
+    "refine_shorter": ("handle_text", ACTION_READY, "Короче"),
+    "refine_unsupported": ("handle_text", ACTION_READY, "Пресс-тест"),
+    "generate_action": ("handle_text", {"lang": "ru", "mode": "action"}, "Рост издержек на логистику"),
+    "generate_structure": ("handle_text", {"lang": "ru", "mode": "structure"}, "Клиент X хочет вырасти."),
+    "generate_hypotheses": ("handle_text", {"lang": "en", "mode": "hypotheses"}, "Online education declines."),
+    "generate_frameworks": ("handle_text", {"lang": "ru", "mode": "frameworks"}, "Падает NPS."),
+}
+
+BRIEF = "Клиент — региональный ритейлер. Цель — рост выручки на 15% за два года. Аудитория — совет директоров."
+QUESTIONS = "\n".join(f"{i}. Вопрос номер {i} про цели и метрики?" for i in range(1, 16))
+
+BUILDER_CASES = {
+    "build_rewrite_messages": lambda: prompts.build_rewrite_messages("Рост издержек на логистику", "ru"),
+    "build_questions_with_context": lambda: prompts.build_questions_with_context("CFO", "банк", "M&A", "ru"),
+    "build_more_questions_messages": lambda: prompts.build_more_questions_messages("CFO", "банк", "M&A", QUESTIONS, "ru"),
+    "build_followups_messages": lambda: prompts.build_followups_messages(QUESTIONS, "ru"),
+    "build_structure_messages": lambda: prompts.build_structure_messages(BRIEF, "ru"),
+    "build_hypotheses_messages": lambda: prompts.build_hypotheses_messages(BRIEF, "en"),
+    "build_frameworks_messages": lambda: prompts.build_frameworks_messages(BRIEF, "ru"),
+    "build_refine_messages": lambda: prompts.build_refine_messages("action", "ru", BRIEF, "Черновик", "Короче"),
+    "build_press_test_messages": lambda: prompts.build_press_test_messages("structure", "ru", BRIEF, QUESTIONS),
+    "scenario_instruction": lambda: prompts.scenario_instruction("structure", "ru"),
+    "make_kb": lambda: keyboards.make_kb([list(MODE_OPTIONS)[:2], list(MODE_OPTIONS)[2:]], with_menu=True),
+    "make_refiners_kb": lambda: keyboards.make_refiners_kb("action"),
+}
+
+
+def summarize(samples_ns):
+    samples_us = sorted(s / 1000 for s in samples_ns)
+    return {
+        "n": len(samples_us),
+        "mean_us": round(statistics.fmean(samples_us), 3),
+        "median_us": round(statistics.median(samples_us), 3),
+        "p95_us": round(samples_us[int(0.95 * (len(samples_us) - 1))], 3),
+    }
+
+
+async def bench_handlers(iterations: int, only: str | None):
+    results = {}
+    for name, (func_name, user_data, text) in HANDLER_CASES.items():
+        if only and only not in name:
+            continue
+        func = getattr(handlers, func_name)
+        samples = []
+        for _ in range(iterations):
+            update, ctx = FakeUpdate(text), FakeContext(json.loads(json.dumps(user_data)))
+            t0 = time.perf_counter_ns()
+            await func(update, ctx)
+            samples.append(time.perf_counter_ns() - t0)
+        results[f"handler.{name}"] = summarize(samples)
+    return results
+
+
+def bench_builders(iterations: int, only: str | None):
+    results = {}
+    for name, fn in BUILDER_CASES.items():
+        if only and only not in name:
+            continue
+        samples = []
+        for _ in range(iterations):
+            t0 = time.perf_counter_ns()
+            fn()
+            samples.append(time.perf_counter_ns() - t0)
+        results[f"builder.{name}"] = summarize(samples)
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> bool:
+    regressed = False
+    print(f"{'benchmark':45} {'base µs':>10} {'now µs':>10} {'Δ':>8}")
+    for name, now in current["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            print(f"{name:45} {'-':>10} {now['median_us']:>10.2f} {'new':>8}")
+            continue
+        delta = (now["median_us"] - base["median_us"]) / base["median_us"] if base["median_us"] else 0.0
+        flag = " ⚠️" if delta > threshold else ""
+        regressed |= delta > threshold
+        print(f"{name:45} {base['median_us']:>10.2f} {now['median_us']:>10.2f} {delta:>+7.1%}{flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline micro-benchmarks for bot handlers and prompt builders")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=200)
+    parser.add_argument("--only", default=None, help="подстрока имени бенчмарка")
+    parser.add_argument("--out", default="", help="сохранить результаты в JSON")
+    parser.add_argument("--compare", default="", help="JSON с базовыми результатами")
+    parser.add_argument("--threshold", type=float, default=0.25, help="допустимый рост медианы")
+    args = parser.parse_args()
+
+    stub_gigachat()
+    asyncio.run(bench_handlers(args.warmup, args.only))
+    bench_builders(args.warmup, args.only)
+
+    results = asyncio.run(bench_handlers(args.iterations, args.only))
+    results.update(bench_builders(args.iterations, args.only))
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "iterations": args.iterations,
+        },
+        "results": results,
+    }
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        sys.exit(1 if compare(report, baseline, args.threshold) else 0)
+
+    for name, r in results.items():
+        print(f"{name:45} median {r['median_us']:>9.2f} µs   p95 {r['p95_us']:>9.2f} µs")
+
+
+if __name__ == "__main__":
+    main()
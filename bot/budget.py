@@ -0,0 +1,100 @@
+import re, math
+from collections import deque, defaultdict
+from dataclasses import dataclass
+
+from bot.config import logger
+from bot import metrics
+
+_CYRILLIC = re.compile(r"[А-Яа-яЁё]")
+_LATIN = re.compile(r"[A-Za-z]")
+_OTHER = re.compile(r"[^\sА-Яа-яЁёA-Za-z]")
+
+
+def estimate_tokens(text: str) -> int:
+    # грубая оценка под токенизатор GigaChat: ~3 символа кириллицы и ~4 латиницы на токен,
+    # цифры и пунктуация дробятся мельче
+    if not text:
+        return 0
+    cyr = len(_CYRILLIC.findall(text))
+    lat = len(_LATIN.findall(text))
+    other = len(_OTHER.findall(text))
+    return math.ceil(cyr / 3.0 + lat / 4.0 + other / 2.0)
+
+
+def estimate_messages_tokens(messages: list) -> int:
+    return sum(estimate_tokens(str(m.get("content", ""))) + 4 for m in messages)
+
+
+@dataclass(frozen=True)
+class BudgetPolicy:
+    default: int        # пока мало наблюдений — прежнее фиксированное значение
+    floor: int
+    ceiling: int
+    input_ratio: float  # минимум относительно размера пользовательского ввода
+    headroom: float = 1.3
+
+
+# input_ratio > 0 там, где длина ответа растёт с длиной брифа: подробное описание задачи даёт больше слайдов,
+# драйверов и обоснований. Короткий ввод упирается в floor, так что ratio работает только на длинных брифах
+POLICIES = {
+    "action":         BudgetPolicy(default=120, floor=60,  ceiling=160,  input_ratio=0.0),
+    "refine":         BudgetPolicy(default=240, floor=80,  ceiling=300,  input_ratio=0.0),
+    "variants":       BudgetPolicy(default=80,  floor=48,  ceiling=128,  input_ratio=0.0),
+    "questions":      BudgetPolicy(default=700, floor=350, ceiling=900,  input_ratio=0.0),
+    "more_questions": BudgetPolicy(default=500, floor=220, ceiling=650,  input_ratio=0.0),
+    "followups":      BudgetPolicy(default=700, floor=250, ceiling=1200, input_ratio=1.6),
+    "structure":      BudgetPolicy(default=800, floor=450, ceiling=1100, input_ratio=2.0),
+    "hypotheses":     BudgetPolicy(default=500, floor=300, ceiling=800,  input_ratio=1.5),
+    "frameworks":     BudgetPolicy(default=500, floor=250, ceiling=700,  input_ratio=1.5),
+    "press_test":     BudgetPolicy(default=600, floor=300, ceiling=900,  input_ratio=0.0),
+}
+
+MIN_SAMPLES = 20
+WINDOW = 200
+STEP = 32  # округляем бюджет, чтобы ключ кэша не «плыл» от каждого наблюдения
+
+
+class TokenBudgets:
+    def __init__(self, policies: dict = POLICIES):
+        self.policies = policies
+        self.outputs = defaultdict(lambda: deque(maxlen=WINDOW))
+        self.boost = defaultdict(lambda: 1.0)
+        self.truncated = defaultdict(int)
+        self.completed = defaultdict(int)
+
+    def _observed_p90(self, mode: str):
+        samples = self.outputs[mode]
+        if len(samples) < MIN_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[int(0.9 * (len(ordered) - 1))]
+
+    def max_tokens(self, mode: str, messages: list | None = None) -> int:
+        policy = self.policies[mode]
+        p90 = self._observed_p90(mode)
+        budget = policy.default if p90 is None else p90 * policy.headroom
+        if messages and policy.input_ratio:
+            user_tokens = sum(estimate_tokens(str(m["content"])) for m in messages if m["role"] == "user")
+            budget = max(budget, user_tokens * policy.input_ratio)
+        budget *= self.boost[mode]
+        budget = min(max(budget, policy.floor), policy.ceiling)
+        return min(int(math.ceil(budget / STEP) * STEP), policy.ceiling)
+
+    def observe(self, mode: str | None, completion_tokens: int, finish_reason: str | None, budget: int):
+        if mode not in self.policies:
+            return
+        self.completed[mode] += 1
+        if finish_reason == "length":
+            # обрезанный ответ не говорит о реальной длине — только поднимаем бюджет
+            self.truncated[mode] += 1
+            metrics.TRUNCATED.labels(mode).inc()
+            self.boost[mode] = min(self.boost[mode] * 1.25, 2.0)
+            logger.info(f"✂️ Ответ обрезан по max_tokens={budget} (mode={mode}, "
+                        f"обрезано {self.truncated[mode]}/{self.completed[mode]})")
+            return
+        self.outputs[mode].append(completion_tokens)
+        self.boost[mode] = max(1.0, self.boost[mode] * 0.97)
+
+
+budgets = TokenBudgets()
+metrics.track_budgets(budgets)
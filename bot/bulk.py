@@ -0,0 +1,255 @@
+import io, csv, sys, json, time, asyncio, hashlib, argparse, contextvars
+from pathlib import Path
+
+from telegram import Update, InputFile
+from telegram.error import TelegramError
+from telegram.ext import ContextTypes
+
+from bot.config import (
+    logger, CACHE_MODES, BULK_DIR, BULK_CONCURRENCY, BULK_MAX_LINES, BULK_MAX_BYTES, BULK_PROGRESS_INTERVAL,
+)
+from bot.budget import budgets
+from bot.gigachat import call_gigachat
+from bot.metrics import label_update
+from bot.scenarios import SCENARIOS
+from bot.sharding import owns
+
+HEADER_CELLS = {"phrase", "text", "input", "фраза", "текст", "тезис", "исходник"}
+
+_running = {}  # chat_id -> Task: одна пакетная задача на чат
+
+BULK_DIR.mkdir(parents=True, exist_ok=True)
+
+
+def parse_phrases(data: bytes, filename: str) -> list:
+    # .txt — фраза на строку; .csv — первая колонка, заголовок таблицы пропускаем
+    text = data.decode("utf-8-sig", errors="replace")
+    if not filename.lower().endswith(".csv"):
+        return [line.strip() for line in text.splitlines() if line.strip()]
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    rows = [row[0].strip() for row in csv.reader(io.StringIO(text), dialect) if row and row[0].strip()]
+    if rows and rows[0].lower() in HEADER_CELLS:
+        rows = rows[1:]
+    return rows
+
+
+def job_id(chat_id, phrases: list, lang: str) -> str:
+    # чат входит в ключ: одинаковый файл из двух чатов — две разные задачи со своими чекпоинтами
+    return hashlib.sha256("\n".join([str(chat_id), lang, *phrases]).encode("utf-8")).hexdigest()[:16]
+
+
+class BulkJob:
+    # прогресс — JSONL-чекпоинт, строка на готовый заголовок: после падения досчитываем только остальное
+    def __init__(self, phrases: list, lang: str, checkpoint: Path):
+        self.phrases = phrases
+        self.lang = lang
+        self.checkpoint = Path(checkpoint)
+        self.results = {}  # номер строки -> заголовок
+        self.failed = {}   # номер строки -> ошибка последней попытки
+        self._load()
+
+    def _load(self):
+        if not self.checkpoint.exists():
+            return
+        with open(self.checkpoint, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # строка, недописанная в момент падения
+                self.results[record["i"]] = record["title"]
+
+    @property
+    def total(self) -> int:
+        return len(self.phrases)
+
+    @property
+    def done(self) -> int:
+        return len(self.results)
+
+    async def _rewrite(self, phrase: str) -> str:
+        scenario = SCENARIOS["action"]
+        msgs = scenario.builder(phrase, self.lang)
+        return await call_gigachat(msgs, scenario.temperature, top_p=scenario.top_p,
+                                   max_tokens=budgets.max_tokens("action", msgs),
+                                   cache=CACHE_MODES["action"], mode="bulk")
+
+    async def run(self, concurrency: int = BULK_CONCURRENCY, on_progress=None):
+        # общий итератор на всех воркеров: параллелизм ограничен concurrency, а дальше — лимитером GigaChat
+        pending = iter([i for i in range(self.total) if i not in self.results])
+        self.failed.clear()
+        with open(self.checkpoint, "a", encoding="utf-8") as out:
+            async def worker():
+                for i in pending:
+                    try:
+                        title = await self._rewrite(self.phrases[i])
+                    except Exception as e:
+                        self.failed[i] = repr(e)
+                        logger.warning(f"⚠️ Пакет: строка {i + 1} не обработана: {e!r}")
+                        continue
+                    self.results[i] = title
+                    out.write(json.dumps({"i": i, "title": title}, ensure_ascii=False) + "\n")
+                    out.flush()
+                    if on_progress is not None:
+                        await on_progress(self)
+
+            await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+
+    def results_csv(self) -> bytes:
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(["phrase", "title", "error"])
+        for i, phrase in enumerate(self.phrases):
+            writer.writerow([phrase, self.results.get(i, ""), self.failed.get(i, "")])
+        return buf.getvalue().encode("utf-8-sig")  # BOM — чтобы Excel открыл кириллицу
+
+
+# --- бот: загрузка .txt/.csv в чат ---
+
+def _manifest_path(job: str) -> Path:
+    return BULK_DIR / f"{job}.json"
+
+
+def _progress_text(job: BulkJob, lang: str) -> str:
+    if lang == "ru":
+        return f"Пакетная обработка: {job.done} из {job.total}"
+    return f"Bulk processing: {job.done} of {job.total}"
+
+
+async def _run_for_chat(bot, manifest: dict):
+    chat_id, lang = manifest["chat_id"], manifest["lang"]
+    job = BulkJob(manifest["phrases"], lang, BULK_DIR / f"{manifest['job']}.jsonl")
+    next_edit = 0.0
+
+    async def on_progress(j: BulkJob):
+        nonlocal next_edit
+        now = time.monotonic()
+        if now < next_edit and j.done < j.total:
+            return
+        next_edit = now + BULK_PROGRESS_INTERVAL
+        try:
+            await bot.edit_message_text(_progress_text(j, lang), chat_id=chat_id,
+                                        message_id=manifest["progress_message_id"])
+        except TelegramError:
+            pass
+
+    started = time.monotonic()
+    try:
+        await job.run(on_progress=on_progress)
+        elapsed = time.monotonic() - started
+        logger.info(f"📦 Пакет {manifest['job']} для чата {chat_id}: {job.done}/{job.total} за {elapsed:.1f} с")
+        name = Path(manifest["filename"]).stem + ".titles.csv"
+        caption = (f"Готово: {job.done} из {job.total}" if lang == "ru" else f"Done: {job.done} of {job.total}")
+        if job.failed:
+            caption += (f". Не удалось: {len(job.failed)} — отправьте файл ещё раз, чтобы досчитать"
+                        if lang == "ru" else f". Failed: {len(job.failed)} — send the file again to retry them")
+        await bot.send_document(chat_id, InputFile(io.BytesIO(job.results_csv()), filename=name), caption=caption)
+        _manifest_path(manifest["job"]).unlink(missing_ok=True)
+        if not job.failed:
+            job.checkpoint.unlink(missing_ok=True)
+    except Exception as e:
+        logger.exception(f"❌ Пакет {manifest['job']} для чата {chat_id} прерван: {e!r}")
+    finally:
+        _running.pop(chat_id, None)
+
+
+def _start(bot, manifest: dict):
+    # фоновая задача в чистом контексте: апдейт уже обработан, трейс и метрики его не ждут
+    task = asyncio.create_task(_run_for_chat(bot, manifest), context=contextvars.Context())
+    _running[manifest["chat_id"]] = task
+
+
+async def handle_document(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    lang = ctx.user_data.get("lang", "ru")
+    chat_id = update.effective_chat.id
+    doc = update.message.document
+    label_update("bulk", lang)
+
+    if chat_id in _running:
+        return await update.message.reply_text(
+            "Предыдущий файл ещё обрабатывается." if lang == "ru" else "The previous file is still being processed.")
+    if doc.file_size and doc.file_size > BULK_MAX_BYTES:
+        return await update.message.reply_text(
+            f"Файл больше {BULK_MAX_BYTES // 1024} КБ." if lang == "ru"
+            else f"File exceeds {BULK_MAX_BYTES // 1024} KB.")
+
+    filename = doc.file_name or "phrases.txt"
+    data = await (await doc.get_file()).download_as_bytearray()
+    phrases = parse_phrases(bytes(data), filename)
+    if not phrases:
+        return await update.message.reply_text("В файле нет фраз." if lang == "ru" else "The file has no phrases.")
+    if len(phrases) > BULK_MAX_LINES:
+        return await update.message.reply_text(
+            f"Не больше {BULK_MAX_LINES} строк в файле." if lang == "ru"
+            else f"At most {BULK_MAX_LINES} lines per file.")
+
+    job = job_id(chat_id, phrases, lang)
+    # тот же файл после сбоя или с ошибками — чекпоинт подхватится, прогресс начнётся не с нуля
+    progress = await update.message.reply_text(_progress_text(BulkJob(phrases, lang, BULK_DIR / f"{job}.jsonl"), lang))
+    manifest = {"job": job, "chat_id": chat_id, "lang": lang, "filename": filename, "phrases": phrases,
+                "progress_message_id": progress.message_id}
+    # манифест переживает рестарт: resume_pending досчитает задачу с места остановки
+    _manifest_path(job).write_text(json.dumps(manifest, ensure_ascii=False), encoding="utf-8")
+    _start(ctx.bot, manifest)
+
+
+def resume_pending(bot) -> int:
+    resumed = 0
+    for path in sorted(BULK_DIR.glob("*.json")):
+        try:
+            manifest = json.loads(path.read_text(encoding="utf-8"))
+        except ValueError:
+            continue
+        # каталог общий на кластер: каждый воркер досчитывает только свои чаты
+        if owns(manifest["chat_id"]) and manifest["chat_id"] not in _running:
+            _start(bot, manifest)
+            resumed += 1
+    if resumed:
+        logger.info(f"📦 Возобновлено пакетных задач: {resumed}")
+    return resumed
+
+
+# --- CLI: python -m bot.bulk phrases.txt --out titles.csv ---
+
+async def _cli(args) -> int:
+    from bot.gigachat import close_client
+
+    path = Path(args.input)
+    phrases = parse_phrases(path.read_bytes(), path.name)
+    out = Path(args.out or path.with_suffix(".titles.csv"))
+    # чекпоинт привязан к содержимому: другой входной файл или язык в тот же --out не подхватит чужой прогресс
+    key = job_id(path.resolve(), phrases, args.lang)
+    job = BulkJob(phrases, args.lang, out.with_name(f"{out.name}.{key}.progress.jsonl"))
+    if job.done:
+        print(f"Продолжаю с чекпоинта: готово {job.done} из {job.total}", file=sys.stderr)
+
+    async def on_progress(j: BulkJob):
+        print(f"\r{j.done}/{j.total}", end="", file=sys.stderr, flush=True)
+
+    started = time.monotonic()
+    try:
+        await job.run(args.concurrency, on_progress)
+    finally:
+        await close_client()
+    elapsed = time.monotonic() - started
+    print(f"\nГотово {job.done}/{job.total} за {elapsed:.1f} с, ошибок: {len(job.failed)}", file=sys.stderr)
+    out.write_bytes(job.results_csv())
+    if not job.failed:
+        job.checkpoint.unlink(missing_ok=True)
+    return 1 if job.failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетная генерация экшн-тайтлов из .txt/.csv")
+    parser.add_argument("input", help=".txt (фраза на строку) или .csv (фразы в первой колонке)")
+    parser.add_argument("--out", default="", help="CSV с результатами (по умолчанию <input>.titles.csv)")
+    parser.add_argument("--lang", default="ru", choices=["ru", "en"])
+    parser.add_argument("--concurrency", type=int, default=BULK_CONCURRENCY)
+    sys.exit(asyncio.run(_cli(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
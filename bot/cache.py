@@ -0,0 +1,136 @@
+import json, time, sqlite3, hashlib, asyncio, threading
+from collections import OrderedDict
+
+from bot.config import logger
+from bot import metrics
+
+
+def make_key(payload: dict) -> str:
+    norm = {
+        "model": payload.get("model"),
+        "messages": [
+            {"role": m["role"], "content": " ".join(str(m["content"]).split())}
+            for m in payload["messages"]
+        ],
+        "temperature": round(float(payload.get("temperature", 0)), 3),
+        "top_p": round(float(payload.get("top_p", 0)), 3),
+        "max_tokens": int(payload.get("max_tokens", 0)),
+    }
+    raw = json.dumps(norm, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# двухуровневый кэш ответов: LRU в памяти + SQLite на диске, оба с TTL
+class CompletionCache:
+    PRUNE_EVERY = 200
+
+    def __init__(self, path: str | None, ttl: int, memory_items: int, disk_items: int):
+        self.ttl = ttl
+        self.memory_items = memory_items
+        self.disk_items = disk_items
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+        self._mem = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS completions ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS completions_accessed ON completions(accessed_at)")
+
+    def _mem_get(self, key: str, now: float):
+        item = self._mem.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < now:
+            del self._mem[key]
+            return None
+        self._mem.move_to_end(key)
+        return value
+
+    def _mem_put(self, key: str, value: str, expires_at: float):
+        self._mem[key] = (expires_at, value)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.memory_items:
+            self._mem.popitem(last=False)
+
+    def _disk_get(self, key: str, now: float):
+        with self._lock:
+            row = self._db.execute("SELECT value, expires_at FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self._db.execute("DELETE FROM completions WHERE key = ?", (key,))
+                return None
+            self._db.execute("UPDATE completions SET accessed_at = ? WHERE key = ?", (now, key))
+            return row[0], row[1]
+
+    def _disk_put(self, key: str, value: str, expires_at: float, now: float):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO completions (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, expires_at, now),
+            )
+            self._writes += 1
+            if self._writes % self.PRUNE_EVERY == 0:
+                self._prune(now)
+
+    def _prune(self, now: float):
+        self._db.execute("DELETE FROM completions WHERE expires_at < ?", (now,))
+        (count,) = self._db.execute("SELECT COUNT(*) FROM completions").fetchone()
+        if count > self.disk_items:
+            self._db.execute(
+                "DELETE FROM completions WHERE key IN "
+                "(SELECT key FROM completions ORDER BY accessed_at LIMIT ?)",
+                (count - self.disk_items,),
+            )
+
+    async def get(self, key: str):
+        now = time.time()
+        value = self._mem_get(key, now)
+        if value is not None:
+            self.hits["memory"] += 1
+            metrics.COMPLETION_CACHE.labels("memory").inc()
+            return value
+        if self._db is not None:
+            try:
+                row = await asyncio.to_thread(self._disk_get, key, now)
+            except sqlite3.Error as e:
+                logger.warning(f"Не удалось прочитать кэш: {e!r}")
+                row = None
+            if row is not None:
+                self.hits["disk"] += 1
+                metrics.COMPLETION_CACHE.labels("disk").inc()
+                self._mem_put(key, row[0], row[1])
+                return row[0]
+        self.misses += 1
+        metrics.COMPLETION_CACHE.labels("miss").inc()
+        return None
+
+    async def set(self, key: str, value: str):
+        now = time.time()
+        expires_at = now + self.ttl
+        self._mem_put(key, value, expires_at)
+        if self._db is not None:
+            try:
+                await asyncio.to_thread(self._disk_put, key, value, expires_at, now)
+            except sqlite3.Error as e:
+                logger.warning(f"Не удалось записать ответ в кэш: {e!r}")
+
+    def stats(self) -> dict:
+        hits = self.hits["memory"] + self.hits["disk"]
+        total = hits + self.misses
+        return {
+            "hits_memory": self.hits["memory"],
+            "hits_disk": self.hits["disk"],
+            "misses": self.misses,
+            "hit_rate": round(hits / total, 3) if total else 0.0,
+            "memory_items": len(self._mem),
+        }
@@ -0,0 +1,320 @@
+import os, sys, json, time, signal, asyncio
+from pathlib import Path
+
+import httpx
+import tornado.web
+from prometheus_client import CONTENT_TYPE_LATEST
+from telegram import Bot
+
+from bot.config import (
+    logger, TELEGRAM_API_URL, IDEMPOTENCY_WINDOW, IDEMPOTENCY_DB_PATH, DEBUG_TOKEN,
+    CLUSTER_WORKERS, CLUSTER_BASE_PORT, CLUSTER_BUFFER, CLUSTER_DRAIN_TIMEOUT,
+)
+from bot.idempotency import UpdateDeduper
+from bot.sharding import ring, shard_key
+
+APP = Path(__file__).resolve().parent.parent / "app.py"
+RESTART_BACKOFF = (1, 2, 5, 10, 30)  # подряд падающий воркер перезапускаем всё реже
+STABLE_AFTER = 60.0  # проработал дольше — счётчик падений сбрасывается
+PROBE_INTERVAL = 0.5
+RETRY_DELAY = 0.5
+DELIVERY_ATTEMPTS = 3  # воркер жив, но отвечает 5xx: апдейт битый, дальше очередь чата не держим
+
+
+class Worker:
+    # процесс app.py на локальном порту и буфер апдейтов его шарда; доставка строго по одному —
+    # так сохраняется порядок апдейтов чата, а пока воркер перезапускается, апдейты ждут в буфере
+    def __init__(self, index: int, client: httpx.AsyncClient):
+        self.index = index
+        self.port = CLUSTER_BASE_PORT + index
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.queue = asyncio.Queue(CLUSTER_BUFFER)
+        self.ready = asyncio.Event()
+        self.proc = None
+        self.restarts = 0
+        self.delivered = 0
+        self.dropped = 0
+        self._client = client
+
+    async def _probe(self):
+        while True:
+            try:
+                if (await self._client.get(self.url + "/")).status_code == 200:
+                    self.ready.set()
+                    logger.info(f"🧩 Воркер #{self.index} готов (pid {self.proc.pid}, порт {self.port})")
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(PROBE_INTERVAL)
+
+    async def supervise(self):
+        failures = 0
+        while True:
+            env = {**os.environ, "CLUSTER_WORKER_INDEX": str(self.index), "PORT": str(self.port)}
+            # своя сессия: Ctrl-C или SIGTERM группе не гасит воркеры раньше, чем ingress досылает буферы
+            self.proc = await asyncio.create_subprocess_exec(sys.executable, str(APP), env=env,
+                                                             start_new_session=True)
+            started = time.monotonic()
+            probe = asyncio.create_task(self._probe())
+            try:
+                code = await self.proc.wait()
+            finally:
+                probe.cancel()
+                self.ready.clear()
+            if time.monotonic() - started > STABLE_AFTER:
+                failures = 0
+            delay = RESTART_BACKOFF[min(failures, len(RESTART_BACKOFF) - 1)]
+            failures += 1
+            self.restarts += 1
+            logger.warning(f"💥 Воркер #{self.index} завершился с кодом {code}, перезапуск через {delay} с "
+                           f"(в буфере {self.queue.qsize()})")
+            await asyncio.sleep(delay)
+
+    async def deliver(self):
+        while True:
+            body = await self.queue.get()
+            try:
+                await self._post(body)
+            finally:
+                self.queue.task_done()
+
+    async def _post(self, body: bytes):
+        # повтор после таймаута безопасен: воркер сам отсекает update_id, который уже принял
+        attempts = 0
+        while True:
+            await self.ready.wait()
+            try:
+                response = await self._client.post(self.url + "/webhook", content=body,
+                                                   headers={"Content-Type": "application/json"})
+                if response.status_code < 500:
+                    self.delivered += 1
+                    return
+                attempts += 1
+            except httpx.HTTPError:
+                pass  # воркер упал или ещё не поднялся: ждём, апдейт остаётся первым в очереди
+            if attempts >= DELIVERY_ATTEMPTS:
+                self.dropped += 1
+                logger.error(f"❌ Воркер #{self.index} не принял апдейт за {attempts} попытки, пропускаю")
+                return
+            await asyncio.sleep(RETRY_DELAY)
+
+    async def fetch(self, path: str, headers: dict | None = None):
+        if not self.ready.is_set():
+            return None
+        try:
+            response = await self._client.get(self.url + path, headers=headers)
+        except httpx.HTTPError:
+            return None
+        return response if response.status_code == 200 else None
+
+    def terminate(self):
+        if self.proc is not None and self.proc.returncode is None:
+            self.proc.terminate()
+
+    def stats(self) -> dict:
+        return {"pid": self.proc.pid if self.proc else None, "port": self.port, "ready": self.ready.is_set(),
+                "buffered": self.queue.qsize(), "delivered": self.delivered, "dropped": self.dropped,
+                "restarts": self.restarts}
+
+
+class Cluster:
+    def __init__(self, workers: int = CLUSTER_WORKERS):
+        # read-таймаут с запасом: локальный /webhook только кладёт апдейт в очередь PTB
+        self.client = httpx.AsyncClient(timeout=httpx.Timeout(10.0, connect=1.0))
+        self.workers = [Worker(i, self.client) for i in range(workers)]
+        self.deduper = UpdateDeduper(IDEMPOTENCY_WINDOW, IDEMPOTENCY_DB_PATH or None)
+        self.rejected = 0
+        self._tasks = []
+
+    def route(self, update: dict) -> Worker:
+        return self.workers[ring.node_for(shard_key(update))]
+
+    def start(self):
+        for worker in self.workers:
+            self._tasks += [asyncio.create_task(worker.supervise()), asyncio.create_task(worker.deliver())]
+
+    async def drain(self, timeout: float = CLUSTER_DRAIN_TIMEOUT):
+        # апдейты в буферах Telegram уже подтвердил: досылаем их, пока воркеры ещё живы
+        buffered = sum(w.queue.qsize() for w in self.workers)
+        if not buffered:
+            return
+        logger.info(f"⏳ Досылаю воркерам {buffered} апдейтов из буферов")
+        try:
+            await asyncio.wait_for(asyncio.gather(*(w.queue.join() for w in self.workers)), timeout)
+        except asyncio.TimeoutError:
+            lost = sum(w.queue.qsize() for w in self.workers)
+            logger.error(f"❌ За {timeout:.0f} с не досланы {lost} апдейтов, они будут потеряны")
+
+    async def stop(self):
+        await self.drain()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for worker in self.workers:
+            worker.terminate()
+        # воркеры сами допишут сессии и остановят задачи по SIGTERM
+        await asyncio.gather(*(w.proc.wait() for w in self.workers if w.proc is not None))
+        await self.client.aclose()
+
+    async def gather(self, path: str, headers: dict | None = None) -> dict:
+        responses = await asyncio.gather(*(w.fetch(path, headers) for w in self.workers))
+        return {w.index: r for w, r in zip(self.workers, responses) if r is not None}
+
+    def stats(self) -> dict:
+        return {"workers": [w.stats() for w in self.workers], "duplicates": self.deduper.duplicates,
+                "rejected": self.rejected}
+
+
+def _with_worker(sample: str, index: int) -> str:
+    name, brace, rest = sample.partition("{")
+    if brace and " " not in name:
+        return f'{name}{{worker="{index}",{rest}'
+    name, _, rest = sample.partition(" ")
+    return f'{name}{{worker="{index}"}} {rest}'
+
+
+def merge_metrics(pages: dict) -> str:
+    # экспозиции воркеров в одну: HELP/TYPE семейства один раз, у каждого сэмпла метка worker
+    families = {}  # семейство -> (строки HELP/TYPE, сэмплы всех воркеров)
+    for index, text in pages.items():
+        family = None
+        for line in text.splitlines():
+            if line.startswith(("# HELP ", "# TYPE ")):
+                family = line.split(" ", 3)[2]
+                header = families.setdefault(family, ([], []))[0]
+                if line not in header:
+                    header.append(line)
+            elif line and not line.startswith("#"):
+                families.setdefault(family, ([], []))[1].append(_with_worker(line, index))
+    return "".join("\n".join(header + samples) + "\n" for header, samples in families.values())
+
+
+class HealthCheckHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.write("Bot is running")
+
+
+class ClusterHandler(tornado.web.RequestHandler):
+    def initialize(self, cluster: Cluster):
+        self.cluster = cluster
+
+    def get(self):
+        self.set_header("Content-Type", "application/json; charset=utf-8")
+        self.write(json.dumps(self.cluster.stats(), ensure_ascii=False))
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    def initialize(self, cluster: Cluster):
+        self.cluster = cluster
+
+    async def get(self):
+        pages = await self.cluster.gather("/metrics")
+        self.set_header("Content-Type", CONTENT_TYPE_LATEST)
+        self.write(merge_metrics({i: r.text for i, r in pages.items()}))
+
+
+class TracesHandler(tornado.web.RequestHandler):
+    def initialize(self, cluster: Cluster):
+        self.cluster = cluster
+
+    async def get(self):
+        token = self.request.headers.get("X-Debug-Token") or self.get_query_argument("token", "")
+        if token != DEBUG_TOKEN:
+            raise tornado.web.HTTPError(403)
+        limit = int(self.get_query_argument("limit", "20"))
+        query = f"?limit={limit}&min={float(self.get_query_argument('min', '0'))}"
+        pages = await self.cluster.gather("/debug/traces" + query, {"X-Debug-Token": DEBUG_TOKEN})
+        traces = [{**t, "worker": i} for i, r in pages.items() for t in r.json()]
+        traces.sort(key=lambda t: t["duration_s"], reverse=True)
+        self.set_header("Content-Type", "application/json; charset=utf-8")
+        self.write(json.dumps(traces[:limit], ensure_ascii=False))
+
+
+class IngressHandler(tornado.web.RequestHandler):
+    def initialize(self, cluster: Cluster):
+        self.cluster = cluster
+
+    def post(self):
+        if self.request.headers.get("Content-Type") != "application/json":
+            raise tornado.web.HTTPError(400, "Invalid content-type")
+        try:
+            data = json.loads(self.request.body or b"null")
+        except ValueError:
+            data = None
+        if not isinstance(data, dict) or not data:
+            raise tornado.web.HTTPError(400, "Empty request body")
+
+        worker = self.cluster.route(data)
+        # буфер шарда полон — воркер давно лежит; 503 до дедупа, чтобы Telegram повторил доставку позже
+        if worker.queue.full():
+            self.cluster.rejected += 1
+            logger.warning(f"⛔ Буфер воркера #{worker.index} заполнен, апдейт отклонён")
+            raise tornado.web.HTTPError(503, "Worker unavailable")
+
+        update_id = data.get("update_id")
+        dedupe = isinstance(update_id, int)
+        if dedupe and self.cluster.deduper.seen(update_id):
+            logger.info(f"🔁 Повторная доставка update_id={update_id}, пропускаю")
+            return self.write("OK")
+        worker.queue.put_nowait(self.request.body)
+        if dedupe:
+            self.cluster.deduper.mark(update_id)
+        self.write("OK")
+
+
+def make_web_app(cluster: Cluster):
+    # /metrics и /debug/traces собираются с воркеров: снаружи кластер выглядит как один процесс
+    routes = [
+        (r"/", HealthCheckHandler),
+        (r"/cluster", ClusterHandler, {"cluster": cluster}),
+        (r"/metrics", MetricsHandler, {"cluster": cluster}),
+        (r"/webhook", IngressHandler, {"cluster": cluster}),
+    ]
+    if DEBUG_TOKEN:
+        routes.append((r"/debug/traces", TracesHandler, {"cluster": cluster}))
+    return tornado.web.Application(routes)
+
+
+async def set_webhook() -> bool:
+    domain = os.getenv("RENDER_EXTERNAL_URL")
+    if not domain:
+        logger.error("❌ RENDER_EXTERNAL_URL не задан!")
+        return False
+    kwargs = {}
+    if TELEGRAM_API_URL:
+        kwargs = {"base_url": f"{TELEGRAM_API_URL}/bot", "base_file_url": f"{TELEGRAM_API_URL}/file/bot"}
+    async with Bot(os.getenv("TELEGRAM_TOKEN"), **kwargs) as bot:
+        webhook_url = f"{domain}/webhook"
+        result = await bot.set_webhook(webhook_url)
+        logger.info(f"🔗 Webhook установлен: {webhook_url} (результат: {result})")
+    return True
+
+
+async def main() -> int:
+    cluster = Cluster()
+    server = None
+    try:
+        if not await set_webhook():
+            return 1
+        cluster.start()
+        port = int(os.environ.get("PORT", 5000))
+        server = make_web_app(cluster).listen(port, address="0.0.0.0")
+        logger.info(f"🚀 Ingress на порту {port}, воркеров: {len(cluster.workers)}")
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        await stop.wait()
+        return 0
+    except Exception as e:
+        logger.exception(f"❌ Критическая ошибка кластера: {e}")
+        return 1
+    finally:
+        if server is not None:
+            server.stop()
+        await cluster.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -25,6 +25,130 @@ VERIFY_CERT_PATH = os.getenv("VERIFY_CERT_PATH", DEFAULT_CERT)
 if not os.path.exists(VERIFY_CERT_PATH):
     print(f"⚠️ Certificate not found at {VERIFY_CERT_PATH} (set VERIFY_CERT_PATH or add cert)")
 
+# базовые адреса можно переопределить, например на локальный tools/mock_gigachat.py
+GIGACHAT_OAUTH_URL = os.getenv("GIGACHAT_OAUTH_URL", "https://ngw.devices.sberbank.ru:9443/api/v2/oauth")
+GIGACHAT_API_URL = os.getenv("GIGACHAT_API_URL", "https://gigachat.devices.sberbank.ru/api/v1").rstrip("/")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "").rstrip("/")
+
+DATA_DIR = Path(os.getenv("DATA_DIR", ROOT / "data"))
+DATA_DIR.mkdir(parents=True, exist_ok=True)
+
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", str(DATA_DIR / "cache.sqlite3"))
+CACHE_TTL = int(os.getenv("CACHE_TTL", str(7 * 24 * 3600)))
+CACHE_MEMORY_ITEMS = int(os.getenv("CACHE_MEMORY_ITEMS", "512"))
+CACHE_DISK_ITEMS = int(os.getenv("CACHE_DISK_ITEMS", "20000"))
+_CACHE_DISABLED = {m.strip() for m in os.getenv("CACHE_DISABLED_MODES", "").split(",") if m.strip()}
+# рефайнерам и «Ещё вопросы» нужны свежие варианты, поэтому кэш для них выключен: если все новые вопросы
+# отсеялись как дубли, история не меняется и тот же промпт вернул бы тот же ответ из кэша
+CACHE_MODES = {
+    mode: mode not in _CACHE_DISABLED
+    for mode in ("action", "questions", "structure", "hypotheses", "frameworks")
+}
+CACHE_MODES.update(refine=False, more_questions=False, followups=False)
+
+# устойчивость вызовов GigaChat: дедлайны по режимам, ретраи с джиттером, circuit breaker, hedging
+GIGACHAT_DEADLINES = {
+    "default": 60, "action": 20, "refine": 20, "variants": 20, "prefetch": 30, "bulk": 30, "inline": 8,
+    "press_test": 90, "questions": 75, "more_questions": 60, "followups": 90, "structure": 90, "hypotheses": 60,
+    "frameworks": 60,
+}
+GIGACHAT_DEADLINES.update({
+    mode: float(os.getenv(f"GIGACHAT_DEADLINE_{mode.upper()}", value)) for mode, value in GIGACHAT_DEADLINES.items()
+})
+RETRY_MAX_ATTEMPTS = int(os.getenv("GIGACHAT_RETRY_MAX_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = float(os.getenv("GIGACHAT_RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("GIGACHAT_RETRY_MAX_DELAY", "8"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("GIGACHAT_BREAKER_FAILURES", "5"))
+BREAKER_COOLDOWN = float(os.getenv("GIGACHAT_BREAKER_COOLDOWN", "30"))
+HEDGE_MODES = {m.strip() for m in os.getenv("GIGACHAT_HEDGE_MODES", "action,refine").split(",") if m.strip()}
+HEDGE_PERCENTILE = float(os.getenv("GIGACHAT_HEDGE_PERCENTILE", "0.9"))
+HEDGE_MIN_SAMPLES = int(os.getenv("GIGACHAT_HEDGE_MIN_SAMPLES", "20"))
+
+# несколько процессов на одной машине (python -m bot.cluster): ingress шардирует апдейты по chat_id.
+# CLUSTER_WORKER_INDEX выставляет супервизор воркеру; без него — обычный однопроцессный режим
+CLUSTER_WORKERS = int(os.getenv("CLUSTER_WORKERS", str(os.cpu_count() or 1)))
+_WORKER_INDEX = os.getenv("CLUSTER_WORKER_INDEX", "")
+CLUSTER_WORKER_INDEX = int(_WORKER_INDEX) if _WORKER_INDEX else None
+CLUSTER_BASE_PORT = int(os.getenv("CLUSTER_BASE_PORT", "5100"))
+CLUSTER_VNODES = int(os.getenv("CLUSTER_VNODES", "160"))
+CLUSTER_BUFFER = int(os.getenv("CLUSTER_BUFFER", "1000"))  # апдейтов на воркер, пока он перезапускается
+CLUSTER_DRAIN_TIMEOUT = float(os.getenv("CLUSTER_DRAIN_TIMEOUT", "30"))  # досылка буферов при остановке
+
+# лимиты тарифа GigaChat: запросов в секунду и одновременных запросов
+GIGACHAT_RPS = float(os.getenv("GIGACHAT_RPS", "10"))
+GIGACHAT_BURST = int(os.getenv("GIGACHAT_BURST", "10"))
+GIGACHAT_MAX_CONCURRENCY = int(os.getenv("GIGACHAT_MAX_CONCURRENCY", "10"))
+
+# X-Session-ID для многоходовых сценариев (вопросы, рефайнеры); 0 — выключить, например для A/B-замера
+GIGACHAT_SESSION_CACHE = os.getenv("GIGACHAT_SESSION_CACHE", "1") == "1"
+
+# история сессии вопросов: последние вопросы дословно, старые — сжатыми темами и отпечатками
+HISTORY_RECENT_TOKENS = int(os.getenv("HISTORY_RECENT_TOKENS", "900"))
+HISTORY_SUMMARY_TOKENS = int(os.getenv("HISTORY_SUMMARY_TOKENS", "250"))
+HISTORY_MAX_FINGERPRINTS = int(os.getenv("HISTORY_MAX_FINGERPRINTS", "300"))
+
+# «Ещё варианты»: N коротких генераций параллельно (или один запрос с n, если включено),
+# повторы отсеиваются по пересечению n-грамм, лимит длины заголовка — для ранжирования
+FANOUT_VARIANTS = int(os.getenv("FANOUT_VARIANTS", "4"))
+FANOUT_SHOW = int(os.getenv("FANOUT_SHOW", "3"))  # сколько вариантов видит пользователь — столько обещает промпт
+FANOUT_USE_N = os.getenv("FANOUT_USE_N", "0") == "1"
+FANOUT_DEDUPE_THRESHOLD = float(os.getenv("FANOUT_DEDUPE_THRESHOLD", "0.6"))
+TITLE_MAX_CHARS = int(os.getenv("TITLE_MAX_CHARS", "150"))
+
+# спекулятивный префетч рефайнеров экшн-тайтла (выключен по умолчанию): самые кликаемые кнопки
+# считаются в фоне сразу после ответа; PREFETCH_MAX_CALLS_PER_MINUTE — потолок лишних вызовов GigaChat
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "0") == "1"
+PREFETCH_TOP_K = int(os.getenv("PREFETCH_TOP_K", "2"))
+PREFETCH_MIN_CLICK_RATE = float(os.getenv("PREFETCH_MIN_CLICK_RATE", "0.1"))
+PREFETCH_MAX_CALLS_PER_MINUTE = int(os.getenv("PREFETCH_MAX_CALLS_PER_MINUTE", "30"))
+PREFETCH_TTL = float(os.getenv("PREFETCH_TTL", "600"))
+
+# пакетный режим экшн-тайтлов: .txt/.csv в боте или python -m bot.bulk; чекпоинты — в BULK_DIR
+BULK_DIR = Path(os.getenv("BULK_DIR", DATA_DIR / "bulk"))
+BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", str(GIGACHAT_MAX_CONCURRENCY)))
+BULK_MAX_LINES = int(os.getenv("BULK_MAX_LINES", "500"))
+BULK_MAX_BYTES = int(os.getenv("BULK_MAX_BYTES", str(1024 * 1024)))
+BULK_PROGRESS_INTERVAL = float(os.getenv("BULK_PROGRESS_INTERVAL", "3"))
+
+# долгие генерации (пресс-тест) — через очередь задач в SQLite: переживает рестарт, есть /status и /cancel
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", str(DATA_DIR / "jobs.sqlite3"))
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "4"))
+JOBS_MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "3"))
+JOBS_MAX_PER_CHAT = int(os.getenv("JOBS_MAX_PER_CHAT", "3"))
+JOBS_KEEP_DAYS = float(os.getenv("JOBS_KEEP_DAYS", "7"))
+
+# inline-режим (@bot фраза): ждём паузу в наборе, устаревшие запросы отменяем, ответы кэшируем ненадолго
+INLINE_DEBOUNCE = float(os.getenv("INLINE_DEBOUNCE", "0.6"))
+INLINE_MIN_CHARS = int(os.getenv("INLINE_MIN_CHARS", "12"))
+INLINE_CACHE_TTL = int(os.getenv("INLINE_CACHE_TTL", "300"))
+INLINE_CACHE_ITEMS = int(os.getenv("INLINE_CACHE_ITEMS", "2000"))
+INLINE_ANSWER_CACHE_TIME = int(os.getenv("INLINE_ANSWER_CACHE_TIME", "300"))  # cache_time для Telegram
+
+# диспетчер апдейтов: параллельно по чатам, по порядку внутри чата
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "64"))
+MAX_PENDING_UPDATES = int(os.getenv("MAX_PENDING_UPDATES", "512"))
+
+# сессии ctx.user_data переживают рестарт: SQLite WAL, запись пачками раз в PERSISTENCE_INTERVAL
+PERSISTENCE_DB_PATH = os.getenv("PERSISTENCE_DB_PATH", str(DATA_DIR / "sessions.sqlite3"))
+PERSISTENCE_INTERVAL = float(os.getenv("PERSISTENCE_INTERVAL", "10"))
+
+# дедупликация повторных доставок webhook (пустой IDEMPOTENCY_DB_PATH — только память)
+IDEMPOTENCY_WINDOW = int(os.getenv("IDEMPOTENCY_WINDOW", "10000"))
+IDEMPOTENCY_DB_PATH = os.getenv("IDEMPOTENCY_DB_PATH", str(DATA_DIR / "updates.sqlite3"))
+
+# стриминг: как часто редактируем сообщение в Telegram (лимит ~1 edit/с на чат)
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))
+STREAM_MIN_DELTA_CHARS = int(os.getenv("STREAM_MIN_DELTA_CHARS", "40"))
+
+# отдельный HTTP-экспортёр Prometheus для polling-режима (0 — выключен; в app.py есть /metrics)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# трейсинг апдейтов: кольцевой буфер последних трейсов, опционально OTLP/HTTP (…/v1/traces)
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "500"))
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "")
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "ai-consulting-bot")
+DEBUG_TOKEN = os.getenv("DEBUG_TOKEN", "")  # пустой — /debug/traces не публикуется
+
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
 logger = logging.getLogger("bot")
 
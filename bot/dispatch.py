@@ -0,0 +1,127 @@
+import time
+import asyncio
+import contextvars
+from collections import deque
+from telegram.error import TelegramError
+from telegram.ext import BaseUpdateProcessor
+
+from bot.config import logger, MAX_CONCURRENT_UPDATES, MAX_PENDING_UPDATES
+from bot import metrics, tracing
+
+BUSY_TEXT = ("⏳ Сейчас слишком много запросов, повторите через минуту.\n"
+             "⏳ Too many requests right now, please retry in a minute.")
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    # do_process_update только принимает апдейт: считает его в pending, отказывает сверх
+    # max_pending_updates и ставит в очередь чата. Семафор финального process_update PTB держится лишь
+    # на время приёма, поэтому апдейты, ждущие слота, видны в pending и попадают под отказ.
+    # Выполняют апдейты свои задачи: по одной на чат (строго по порядку), не больше
+    # max_concurrent_updates одновременно; ждущие в очереди чата слот не занимают
+    def __init__(self, max_concurrent_updates: int = MAX_CONCURRENT_UPDATES,
+                 max_pending_updates: int = MAX_PENDING_UPDATES):
+        super().__init__(max_concurrent_updates)
+        self.max_pending_updates = max_pending_updates
+        self.pending = 0
+        self.running = 0
+        self.shed = 0
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._chats = {}  # chat key -> deque ожидающих (update, coroutine, queued_at)
+        self._tasks = set()
+        metrics.track_processor(self)
+
+    @property
+    def queued(self) -> int:
+        return self.pending - self.running
+
+    @staticmethod
+    def chat_key(update: object):
+        if getattr(update, "inline_query", None) is not None:
+            return None  # новый inline-запрос должен обгонять и отменять прежний, а не ждать его
+        chat = getattr(update, "effective_chat", None)
+        if chat is not None:
+            return chat.id
+        user = getattr(update, "effective_user", None)
+        return ("user", user.id) if user is not None else None
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        if self.pending >= self.max_pending_updates:
+            coroutine.close()
+            self._shed(update)
+            return
+
+        self.pending += 1
+        item = (update, coroutine, time.time_ns())
+        key = self.chat_key(update)
+        if key is None:
+            self._spawn(self._run(deque([item])))
+        elif key in self._chats:
+            self._chats[key].append(item)  # выполнит задача, которая сейчас разбирает этот чат
+        else:
+            self._chats[key] = deque([item])
+            self._spawn(self._run(self._chats[key], key))
+
+    def _spawn(self, coroutine):
+        # свой контекст на задачу: трейс и метки метрик не смешиваются между апдейтами
+        task = asyncio.create_task(coroutine, context=contextvars.Context())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, waiting: deque, key=None):
+        try:
+            while waiting:
+                async with self._slots:
+                    update, coroutine, queued_at = waiting.popleft()
+                    task = asyncio.create_task(self._handle(update, coroutine, queued_at),
+                                               context=contextvars.Context())
+                    try:
+                        await task
+                    except Exception as e:
+                        logger.exception(f"❌ Апдейт чата {key} завершился ошибкой: {e!r}")
+        finally:
+            if key is not None:
+                del self._chats[key]
+            for _, rest, _ in waiting:  # остановка приложения: оставшиеся апдейты чата не выполнятся
+                rest.close()
+                self.pending -= 1
+
+    async def _handle(self, update: object, coroutine, queued_at: int):
+        labels = metrics.begin_update()
+        labels["started"] -= (time.time_ns() - queued_at) / 1e9  # задержка апдейта — с момента приёма
+        trace = tracing.resume_trace(getattr(update, "update_id", None))
+        self.running += 1
+        try:
+            tracing.record_span("dispatch.wait", queued_at)
+            with tracing.span("dispatch.handle"):
+                await coroutine
+        finally:
+            self.running -= 1
+            self.pending -= 1
+            metrics.finish_update(labels)
+            tracing.end_trace(trace)
+
+    def _shed(self, update: object):
+        self.shed += 1
+        metrics.UPDATES_SHED.inc()
+        logger.warning(f"⚠️ Очередь апдейтов заполнена ({self.pending}), апдейт отклонён")
+        message = getattr(update, "effective_message", None)
+        if message is not None:
+            self._spawn(self._reply_busy(message))
+
+    @staticmethod
+    async def _reply_busy(message):
+        try:
+            await message.reply_text(BUSY_TEXT)
+        except TelegramError as e:
+            logger.warning(f"Не удалось отправить ответ о перегрузке: {e!r}")
+
+    async def initialize(self) -> None:
+        pass
+
+    async def join(self) -> None:
+        # Application.stop ждёт только приём апдейтов: выполнение дожидаемся отдельно, до shutdown бота
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def shutdown(self) -> None:
+        await self.join()
@@ -1,30 +1,421 @@
-import time, uuid, requests
-from bot.config import AUTH_KEY, VERIFY_CERT_PATH, logger
-
-_token = {"value": None, "ts": 0, "ttl": 36000}
-
-def get_access_token() -> str:
-    now = time.time()
-    if _token["value"] and now - _token["ts"] < _token["ttl"]:
-        return _token["value"]
-    url = "https://ngw.devices.sberbank.ru:9443/api/v2/oauth"
-    headers = {
-        "Content-Type": "application/x-www-form-urlencoded",
-        "Accept": "application/json",
-        "RqUID": str(uuid.uuid4()),
-        "Authorization": f"Basic {AUTH_KEY}",
-    }
-    resp = requests.post(url, headers=headers, data="scope=GIGACHAT_API_PERS", verify=VERIFY_CERT_PATH)
-    resp.raise_for_status()
-    token = resp.json()["access_token"]
-    _token.update({"value": token, "ts": now})
-    return token
-
-def call_gigachat(messages: list, temperature: float, top_p: float = 0.9, max_tokens: int = 120) -> str:
-    token = get_access_token()
-    url = "https://gigachat.devices.sberbank.ru/api/v1/chat/completions"
+import os, ssl, json, uuid, time, asyncio, hashlib
+from contextlib import aclosing
+import httpx
+from bot.config import (
+    AUTH_KEY, VERIFY_CERT_PATH, logger, GIGACHAT_OAUTH_URL, GIGACHAT_API_URL,
+    CACHE_DB_PATH, CACHE_TTL, CACHE_MEMORY_ITEMS, CACHE_DISK_ITEMS, RETRY_MAX_ATTEMPTS, GIGACHAT_SESSION_CACHE,
+    FANOUT_USE_N,
+)
+from bot.cache import CompletionCache, make_key
+from bot.budget import budgets, estimate_tokens
+from bot.resilience import (
+    UpstreamError, DeadlineExceeded, breaker, call_with_resilience,
+    is_retryable, record_non_retryable, backoff_delay, deadline_for, request_timeout,
+)
+from bot.ratelimit import limiter, priority_for
+from bot import metrics
+from bot.tracing import span, traced, record_span
+
+OAUTH_URL = GIGACHAT_OAUTH_URL
+CHAT_URL = f"{GIGACHAT_API_URL}/chat/completions"
+
+POOL_LIMITS = httpx.Limits(
+    max_connections=int(os.getenv("GIGACHAT_MAX_CONNECTIONS", "32")),
+    max_keepalive_connections=int(os.getenv("GIGACHAT_MAX_KEEPALIVE", "16")),
+    keepalive_expiry=float(os.getenv("GIGACHAT_KEEPALIVE_EXPIRY", "60")),
+)
+
+TOKEN_REFRESH_AHEAD = float(os.getenv("GIGACHAT_TOKEN_REFRESH_AHEAD", "300"))
+TOKEN_FALLBACK_TTL = 1800  # если сервер не вернул expires_at
+# OAuth идёт под single-flight локом: зависший запрос остановил бы все вызовы GigaChat и старт бота
+OAUTH_TIMEOUT = float(os.getenv("GIGACHAT_OAUTH_TIMEOUT", "15"))
+
+_ssl_ctx = None
+_client = None
+
+completion_cache = CompletionCache(CACHE_DB_PATH, CACHE_TTL, CACHE_MEMORY_ITEMS, CACHE_DISK_ITEMS)
+
+COALESCE_MAX_WAITERS = int(os.getenv("GIGACHAT_COALESCE_MAX_WAITERS", "50"))
+_inflight = {}  # ключ запроса -> [Task/Future, число присоединившихся]
+
+
+def get_ssl_context() -> ssl.SSLContext:
+    # сертификат Минцифры грузим один раз, а не на каждый TLS-хендшейк
+    global _ssl_ctx
+    if _ssl_ctx is None:
+        cafile = VERIFY_CERT_PATH if os.path.exists(VERIFY_CERT_PATH) else None
+        _ssl_ctx = ssl.create_default_context(cafile=cafile)
+    return _ssl_ctx
+
+
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(verify=get_ssl_context(), limits=POOL_LIMITS, timeout=None)
+    return _client
+
+
+async def close_client():
+    global _client
+    await token_manager.stop()
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
+
+
+class TokenManager:
+    def __init__(self, refresh_ahead: float = TOKEN_REFRESH_AHEAD):
+        self.refresh_ahead = refresh_ahead
+        self._value = None
+        self._expires_at = 0.0
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    def _fresh(self) -> bool:
+        return bool(self._value) and time.time() < self._expires_at - 5
+
+    async def get(self) -> str:
+        if self._fresh():
+            return self._value
+        return await self.refresh()
+
+    async def refresh(self, stale: str | None = None) -> str:
+        # single-flight: пока один запрос идёт в OAuth, остальные ждут его результат
+        async with self._lock:
+            if self._fresh() and (stale is None or self._value != stale):
+                return self._value
+            headers = {
+                "Content-Type": "application/x-www-form-urlencoded",
+                "Accept": "application/json",
+                "RqUID": str(uuid.uuid4()),
+                "Authorization": f"Basic {AUTH_KEY}",
+            }
+            try:
+                # таймауты httpx — на фазу, а не на весь запрос, поэтому общий предел даёт wait_for
+                resp = await asyncio.wait_for(get_client().post(
+                    OAUTH_URL, headers=headers, content="scope=GIGACHAT_API_PERS",
+                    timeout=httpx.Timeout(OAUTH_TIMEOUT, connect=min(OAUTH_TIMEOUT, 5)),
+                ), OAUTH_TIMEOUT)
+                resp.raise_for_status()
+            except Exception:
+                metrics.OAUTH_REFRESHES.labels("error").inc()
+                raise
+            metrics.OAUTH_REFRESHES.labels("ok").inc()
+            data = resp.json()
+            expires_at = data.get("expires_at")
+            self._value = data["access_token"]
+            self._expires_at = expires_at / 1000 if expires_at else time.time() + TOKEN_FALLBACK_TTL
+            logger.info(f"🔑 GigaChat token обновлён, истекает через {int(self._expires_at - time.time())} с")
+            return self._value
+
+    async def _refresh_loop(self):
+        while True:
+            delay = max(self._expires_at - self.refresh_ahead - time.time(), 1)
+            await asyncio.sleep(delay)
+            try:
+                await self.refresh(stale=self._value)
+            except Exception as e:
+                logger.warning(f"Не удалось обновить GigaChat token заранее: {e!r}")
+                await asyncio.sleep(10)
+
+    async def start(self):
+        try:
+            await self.refresh()  # не дольше OAUTH_TIMEOUT: без токена стартуем, его добудет первый вызов
+        except Exception as e:
+            logger.warning(f"Не удалось получить GigaChat token при старте: {e!r}")
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+token_manager = TokenManager()
+
+
+@traced("gigachat.token")
+async def get_access_token() -> str:
+    return await token_manager.get()
+
+
+def session_key(*parts) -> str | None:
+    # детерминированный X-Session-ID: тот же диалог после рестарта попадает в ту же сессию GigaChat
+    if not GIGACHAT_SESSION_CACHE:
+        return None
+    digest = hashlib.sha256("\x1f".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+    return str(uuid.UUID(digest[:32]))
+
+
+def _headers(token: str, session_id: str | None, stream: bool = False) -> dict:
     headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+    if stream:
+        headers["Accept"] = "text/event-stream"
+    if session_id:
+        # GigaChat кэширует контекст сессии: общий префикс промпта не пересчитывается
+        headers["X-Session-ID"] = session_id
+    return headers
+
+
+def _log_session_usage(mode: str | None, usage: dict, started: float):
+    prompt = usage.get("prompt_tokens") or 0
+    cached = usage.get("precached_prompt_tokens") or 0
+    logger.info(f"🧷 X-Session-ID mode={mode}: prompt {prompt} ток., из кэша {cached} "
+                f"({cached / prompt if prompt else 0:.0%}), {time.monotonic() - started:.2f} с")
+
+
+async def _post_completion(token: str, payload: dict, mode: str | None = None,
+                           session_id: str | None = None) -> httpx.Response:
+    headers = _headers(token, session_id)
+    started = time.monotonic()
+    with span("gigachat.http", mode=mode or "none") as record:
+        try:
+            resp = await get_client().post(CHAT_URL, headers=headers, json=payload, timeout=request_timeout(mode))
+        except httpx.TimeoutException:
+            metrics.observe_gigachat(mode, "timeout", time.monotonic() - started, bool(session_id))
+            raise
+        except httpx.TransportError:
+            metrics.observe_gigachat(mode, "transport_error", time.monotonic() - started, bool(session_id))
+            raise
+        if record is not None:
+            record["attrs"]["status"] = resp.status_code
+    metrics.observe_gigachat(mode, resp.status_code, time.monotonic() - started, bool(session_id))
+    return resp
+
+
+def _raise_for_upstream(resp: httpx.Response):
+    # любой не-2xx — UpstreamError: повторять ли, решает is_retryable по статусу
+    if resp.is_success:
+        return
+    retry_after = resp.headers.get("Retry-After")
+    raise UpstreamError(resp.status_code, float(retry_after) if retry_after and retry_after.isdigit() else None)
+
+
+def _join_inflight(key: str):
+    entry = _inflight.get(key)
+    if entry is None or entry[1] >= COALESCE_MAX_WAITERS:
+        return None
+    entry[1] += 1
+    return entry[0]
+
+
+def _register_inflight(key: str, fut: asyncio.Future):
+    _inflight[key] = [fut, 0]
+
+    def _done(f):
+        entry = _inflight.get(key)
+        if entry is not None and entry[0] is f:
+            del _inflight[key]
+        if not f.cancelled():
+            f.exception()  # ошибку получат ожидающие, здесь лишь помечаем её прочитанной
+
+    fut.add_done_callback(_done)
+
+
+async def _request_completion(payload: dict, mode: str | None, session_id: str | None = None) -> dict:
+    token = await get_access_token()
+    async with limiter.slot(priority_for(mode)):
+        resp = await _post_completion(token, payload, mode, session_id)
+        if resp.status_code == 401:
+            # токен отозван или истёк раньше expires_at — обновляем и повторяем один раз
+            token = await token_manager.refresh(stale=token)
+            resp = await _post_completion(token, payload, mode, session_id)
+    _raise_for_upstream(resp)
+    return resp.json()
+
+
+async def _complete(payload: dict, key: str | None, mode: str | None = None, session_id: str | None = None) -> str:
+    started = time.monotonic()
+    data = await call_with_resilience(lambda: _request_completion(payload, mode, session_id), mode)
+    choice = data["choices"][0]
+    result = choice["message"]["content"].strip()
+    usage = data.get("usage") or {}
+    metrics.observe_usage(mode, usage)
+    if session_id:
+        _log_session_usage(mode, usage, started)
+    budgets.observe(mode, usage.get("completion_tokens") or estimate_tokens(result),
+                    choice.get("finish_reason"), payload["max_tokens"])
+    if key:
+        await completion_cache.set(key, result)
+    return result
+
+
+@traced("gigachat.call")
+async def call_gigachat(messages: list, temperature: float, top_p: float = 0.9, max_tokens: int = 120,
+                        cache: bool = True, mode: str | None = None, session_id: str | None = None) -> str:
     payload = {"model":"GigaChat", "messages":messages, "temperature":temperature, "top_p":top_p, "max_tokens":max_tokens}
-    resp = requests.post(url, headers=headers, json=payload, verify=VERIFY_CERT_PATH)
-    resp.raise_for_status()
-    return resp.json()["choices"][0]["message"]["content"].strip()
+    if not cache:
+        return await _complete(payload, None, mode, session_id)
+
+    key = make_key(payload)
+    cached = await completion_cache.get(key)
+    if cached is not None:
+        logger.info(f"💾 Ответ из кэша ({completion_cache.stats()})")
+        return cached
+
+    # такой же запрос уже летит — ждём его результат вместо второго похода в GigaChat
+    inflight = _join_inflight(key)
+    if inflight is not None:
+        logger.info("🔗 Присоединился к идентичному запросу в GigaChat")
+        return await asyncio.shield(inflight)
+    task = asyncio.create_task(_complete(payload, key, mode, session_id))
+    _register_inflight(key, task)
+    return await asyncio.shield(task)
+
+
+@traced("gigachat.fanout")
+async def call_gigachat_variants(messages: list, n: int, temperature: float, top_p: float = 0.9,
+                                 max_tokens: int = 120, mode: str | None = None,
+                                 session_id: str | None = None) -> list:
+    # n независимых коротких генераций: по времени ≈ один короткий вызов, а не n последовательных
+    if FANOUT_USE_N:
+        payload = {"model":"GigaChat", "messages":messages, "temperature":temperature, "top_p":top_p,
+                   "max_tokens":max_tokens, "n": n}
+        started = time.monotonic()
+        data = await call_with_resilience(lambda: _request_completion(payload, mode, session_id), mode)
+        usage = data.get("usage") or {}
+        metrics.observe_usage(mode, usage)
+        if session_id:
+            _log_session_usage(mode, usage, started)
+        results = []
+        for choice in data["choices"]:
+            result = choice["message"]["content"].strip()
+            budgets.observe(mode, estimate_tokens(result), choice.get("finish_reason"), max_tokens)
+            results.append(result)
+        return results
+
+    # без кэша и склейки одинаковых запросов, с небольшим разбросом температуры — иначе ответы совпадут
+    calls = [call_gigachat(messages, min(temperature + 0.1 * i, 1.0), top_p, max_tokens,
+                           cache=False, mode=mode, session_id=session_id) for i in range(n)]
+    results = await asyncio.gather(*calls, return_exceptions=True)
+    ok = [r for r in results if isinstance(r, str)]
+    if not ok:
+        raise next(r for r in results if isinstance(r, BaseException))
+    if len(ok) < n:
+        logger.warning(f"⚠️ Fan-out mode={mode}: {n - len(ok)} из {n} генераций завершились ошибкой")
+    return ok
+
+
+async def _stream_once(payload: dict, mode: str | None, meta: dict, session_id: str | None = None):
+    token = await get_access_token()
+    async with limiter.slot(priority_for(mode)), \
+            aclosing(_stream_request(token, payload, mode, meta, session_id)) as stream:
+        async for delta in stream:
+            yield delta
+
+
+async def _read_sse(resp: httpx.Response, meta: dict):
+    if resp.is_error:
+        await resp.aread()
+        _raise_for_upstream(resp)
+    async for line in resp.aiter_lines():
+        if not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if data == "[DONE]":
+            break
+        chunk = json.loads(data)
+        choice = chunk["choices"][0]
+        meta["finish_reason"] = choice.get("finish_reason") or meta.get("finish_reason")
+        meta["usage"] = chunk.get("usage") or meta.get("usage")
+        delta = choice.get("delta", {}).get("content")
+        if delta:
+            yield delta
+
+
+async def _stream_request(token: str, payload: dict, mode: str | None, meta: dict, session_id: str | None = None):
+    for attempt in range(2):
+        headers = _headers(token, session_id, stream=True)
+        started, started_ns, status = time.monotonic(), time.time_ns(), "transport_error"
+        try:
+            async with get_client().stream("POST", CHAT_URL, headers=headers, json=payload,
+                                           timeout=request_timeout(mode)) as resp:
+                status = resp.status_code
+                if status != 401 or attempt:
+                    async with aclosing(_read_sse(resp, meta)) as deltas:
+                        async for delta in deltas:
+                            yield delta
+                    return
+        except httpx.TimeoutException:
+            status = "timeout"
+            raise
+        finally:
+            metrics.observe_gigachat(mode, status, time.monotonic() - started, bool(session_id))
+            # спаном-контекстом не оборачиваем: между дельтами управление у потребителя
+            record_span("gigachat.http", started_ns, mode=mode or "none", status=status, stream=True)
+        # токен отозван или истёк раньше expires_at — обновляем и повторяем один раз
+        token = await token_manager.refresh(stale=token)
+
+
+async def stream_gigachat(messages: list, temperature: float, top_p: float = 0.9, max_tokens: int = 120,
+                          cache: bool = True, mode: str | None = None, session_id: str | None = None):
+    # SSE-режим GigaChat: отдаём дельты по мере генерации, целиком ответ кладём в кэш
+    payload = {"model":"GigaChat", "messages":messages, "temperature":temperature, "top_p":top_p,
+               "max_tokens":max_tokens, "stream": True}
+    key = make_key(payload) if cache else None
+    future = None
+    if key:
+        cached = await completion_cache.get(key)
+        if cached is not None:
+            logger.info(f"💾 Ответ из кэша ({completion_cache.stats()})")
+            yield cached
+            return
+        inflight = _join_inflight(key)
+        if inflight is not None:
+            logger.info("🔗 Присоединился к идентичному запросу в GigaChat")
+            yield await asyncio.shield(inflight)
+            return
+        future = asyncio.get_running_loop().create_future()
+        _register_inflight(key, future)
+
+    try:
+        parts, meta = [], {}
+        deadline = deadline_for(mode)
+        started = time.monotonic()
+        expires = started + deadline
+        attempt = 0
+        while True:
+            # повторяем только до первой дельты: начатый ответ уже у пользователя на экране
+            probe = breaker.before_call()
+            try:
+                try:
+                    async with aclosing(_stream_once(payload, mode, meta, session_id)) as stream:
+                        async for delta in stream:
+                            parts.append(delta)
+                            yield delta
+                            if time.monotonic() > expires:
+                                raise DeadlineExceeded(mode, deadline)
+                except Exception as e:
+                    if not is_retryable(e):
+                        record_non_retryable(e)
+                        raise
+                    breaker.record_failure()
+                    attempt += 1
+                    delay = backoff_delay(attempt - 1, getattr(e, "retry_after", None))
+                    if parts or attempt >= RETRY_MAX_ATTEMPTS or time.monotonic() + delay >= expires:
+                        raise
+                    logger.warning(f"↻ Повтор стрима GigaChat ({attempt}) через {delay:.2f} с: {e!r}")
+                    await asyncio.sleep(delay)
+                    continue
+                breaker.record_success()
+                break
+            finally:
+                if probe:
+                    breaker.release()  # стрим отменён или закрыт потребителем посреди пробы
+
+        result = "".join(parts).strip()
+        usage = meta.get("usage") or {}
+        metrics.observe_usage(mode, usage)
+        if session_id:
+            _log_session_usage(mode, usage, started)
+        budgets.observe(mode, usage.get("completion_tokens") or estimate_tokens(result),
+                        meta.get("finish_reason"), max_tokens)
+        if key and result:
+            await completion_cache.set(key, result)
+        if future is not None:
+            future.set_result(result)
+    except BaseException as e:
+        if future is not None and not future.done():
+            future.set_exception(e if isinstance(e, Exception) else RuntimeError("GigaChat stream aborted"))
+        raise
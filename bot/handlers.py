@@ -1,23 +1,35 @@
+import time
+
 from telegram import Update, ReplyKeyboardRemove
+from telegram.error import BadRequest, RetryAfter, TelegramError
 from telegram.ext import ContextTypes
 
 from bot.config import (
-    MODE_OPTIONS, LANG_OPTIONS, LANG_BUTTON,
-    REFINERS,
+    LANG_OPTIONS, LANG_BUTTON, CACHE_MODES, STREAM_EDIT_INTERVAL, STREAM_MIN_DELTA_CHARS, BTN_MORE, BTN_PRESS,
+    FANOUT_VARIANTS, FANOUT_SHOW,
 )
-from bot.keyboards import make_kb, make_refiners_kb
-from bot.gigachat import call_gigachat
+from bot.keyboards import make_kb
+from bot.gigachat import call_gigachat, call_gigachat_variants, stream_gigachat, session_key
+from bot.budget import budgets
+from bot.prefetch import speculator
+from bot.metrics import label_update
 from bot.prompts import (
-    build_rewrite_messages, build_structure_messages,
-    build_hypotheses_messages, build_frameworks_messages,
-    build_refine_messages,
-    build_questions_with_context, build_more_questions_messages, build_followups_messages,
-    scenario_instruction,
+    build_questions_with_context, build_more_questions_messages, build_followups_messages, build_press_test_messages,
+)
+from bot.jobs import durable_jobs, QueueFull
+from bot import history, variants
+from bot.scenarios import (
+    SCENARIOS, SCENARIO_BY_BUTTON, REFINER_BUTTONS, MENU_KB, MAIN_KB, LANG_KB, PROGRESS_TEXT, REFINING_TEXT,
 )
 
 BTN_MORE_Q = "Ещё вопросы"
 BTN_FOLLOWUPS = "Фоллоу-апы"
 
+Q_READY_KB = make_kb([[BTN_MORE_Q, BTN_FOLLOWUPS], ["Меню"]])
+Q_FOLLOWUPS_KB = make_kb([[BTN_MORE_Q], ["Меню"]])
+
+TG_MAX_LEN = 4096
+
 
 def _parse_position_company(t: str, lang: str):
     sep = " в " if lang == "ru" else " at "
@@ -35,249 +47,404 @@ def _parse_position_company(t: str, lang: str):
     return pos, comp
 
 
+async def _stream_reply(update: Update, progress, msgs: list, reply_markup, *,
+                        temperature: float, top_p: float, max_tokens: int, cache: bool, mode: str,
+                        session_id: str | None = None) -> str:
+    # редактируем сообщение-заглушку по мере генерации, но не чаще STREAM_EDIT_INTERVAL
+    text, shown = "", ""
+    next_edit = time.monotonic() + STREAM_EDIT_INTERVAL
+    async for delta in stream_gigachat(msgs, temperature, top_p, max_tokens, cache=cache, mode=mode,
+                                       session_id=session_id):
+        text += delta
+        now = time.monotonic()
+        if now < next_edit or len(text) - len(shown) < STREAM_MIN_DELTA_CHARS:
+            continue
+        next_edit = now + STREAM_EDIT_INTERVAL
+        try:
+            await progress.edit_text(text[:TG_MAX_LEN])
+            shown = text
+        except RetryAfter as e:
+            next_edit = now + e.retry_after
+        except BadRequest:
+            pass
+
+    # ReplyKeyboardMarkup нельзя повесить через edit, поэтому финал — отдельным сообщением;
+    # заглушку убираем только после него, чтобы при ошибке отправки у пользователя остался текст
+    result = text.strip()
+    await update.message.reply_text(result[:TG_MAX_LEN], reply_markup=reply_markup)
+    try:
+        await progress.delete()
+    except TelegramError:
+        pass
+    return result
+
+
+START_TEXT = {
+    "ru": (
+        "👋 Привет! Я ИИ-ассистент для стратегического консалтинга. Помогаю консультантам с повседневными задачами\n\n"
+        "Сценарии использования:\n"
+        "🔁 Экшн-тайтлы — переформулировать короткую бизнес-фразу или агрегировать несколько фраз в заголовок для слайда\n"
+        "❓ Вопросы — сгенерировать вопросы для интервью со специалистом с учетом специфики проекта\n"
+        "🧩 Структура — сформировать сторилайн для презентации по описанию задачи\n"
+        "🔍 Гипотезы — сгенерировать гипотезы, сгруппированные по драйверам, для конкретной проблемы\n"
+        "⚙️ Фреймворки — подобрать модели для анализа проблемы с описанием\n\n"
+        "Выберите режим ниже или нажмите «Язык» для смены языка."
+    ),
+    "en": (
+        "👋 Hello! I'm an AI consulting bot.\n\n"
+        "Scenarios:\n"
+        "🔁 Action titles — turn a short business phrase into a slide title\n"
+        "❓ Questions — generate strategic interview questions\n"
+        "🧩 Structure — build a storyline for presentation\n"
+        "🔍 Hypotheses — generate hypotheses grouped by drivers for specific problem\n"
+        "⚙️ Frameworks — suggest analytical models with rationale for specific problem\n\n"
+        "Choose a scenario below or click on 'Language' to change language."
+    ),
+}
+
+
 async def start(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     ctx.user_data.setdefault("lang", "ru")
     ctx.user_data.setdefault("creativity", 3)
     ctx.user_data.setdefault("mode", "action")
     lang = ctx.user_data["lang"]
 
-    if lang == "ru":
-        msg = (
-            "👋 Привет! Я ИИ-ассистент для стратегического консалтинга. Помогаю консультантам с повседневными задачами\n\n"
-            "Сценарии использования:\n"
-            "🔁 Экшн-тайтлы — переформулировать короткую бизнес-фразу или агрегировать несколько фраз в заголовок для слайда\n"
-            "❓ Вопросы — сгенерировать вопросы для интервью со специалистом с учетом специфики проекта\n"
-            "🧩 Структура — сформировать сторилайн для презентации по описанию задачи\n"
-            "🔍 Гипотезы — сгенерировать гипотезы, сгруппированные по драйверам, для конкретной проблемы\n"
-            "⚙️ Фреймворки — подобрать модели для анализа проблемы с описанием\n\n"
-            "Выберите режим ниже или нажмите «Язык» для смены языка."
-        )
-    else:
-        msg = (
-            "👋 Hello! I'm an AI consulting bot.\n\n"
-            "Scenarios:\n"
-            "🔁 Action titles — turn a short business phrase into a slide title\n"
-            "❓ Questions — generate strategic interview questions\n"
-            "🧩 Structure — build a storyline for presentation\n"
-            "🔍 Hypotheses — generate hypotheses grouped by drivers for specific problem\n"
-            "⚙️ Frameworks — suggest analytical models with rationale for specific problem\n\n"
-            "Choose a scenario below or click on 'Language' to change language."
-        )
-
-    kb = [["Экшн-тайтлы", "Вопросы"], ["Структура", "Гипотезы"], ["Фреймворки", LANG_BUTTON]]
-    await update.message.reply_text(msg, reply_markup=make_kb(kb), parse_mode="HTML")
+    await update.message.reply_text(START_TEXT.get(lang, START_TEXT["en"]), reply_markup=MAIN_KB, parse_mode="HTML")
     try:
         await update.message.delete()
     except Exception:
         pass
 
 
-async def handle_text(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
-    text = (update.message.text or "").strip()
+def _questions_session(update: Update, sess: dict) -> str:
+    # одна сессия GigaChat на интервью: должность, компания и контекст задают общий префикс промптов
+    return session_key(update.effective_chat.id, "questions", sess.get("position"), sess.get("company"),
+                       sess.get("context"))
+
+
+def _refine_session(update: Update, base: str) -> str:
+    return session_key(update.effective_chat.id, "refine", base)
+
+
+def _error_text(e: Exception, lang: str) -> str:
+    return ("Ошибка: " + str(e)) if lang == "ru" else ("Error: " + str(e))
+
+
+async def _on_menu(update: Update, ctx: ContextTypes.DEFAULT_TYPE, text: str):
+    ctx.user_data.pop("q_state", None)
+    ctx.user_data.pop("q_session", None)
+    return await start(update, ctx)
+
+
+async def _on_lang_button(update: Update, ctx: ContextTypes.DEFAULT_TYPE, text: str):
+    lang = ctx.user_data.get("lang", "ru")
+    msg = "Выберите язык / Choose language:" if lang == "ru" else "Select language:"
+    return await update.message.reply_text(msg, reply_markup=LANG_KB)
+
+
+async def _on_lang_select(update: Update, ctx: ContextTypes.DEFAULT_TYPE, text: str):
     ud = ctx.user_data
-    lang = ud.get("lang", "ru")
+    ud["lang"] = LANG_OPTIONS[text]
+    lang_name = "Русский" if ud["lang"] == "ru" else "English"
+    await update.message.reply_text(f"Язык изменен на {lang_name} / Language changed to {lang_name}")
+    return await start(update, ctx)
+
 
-    if text == "Меню":
-        ud.pop("q_state", None)
+async def _on_mode_select(update: Update, ctx: ContextTypes.DEFAULT_TYPE, text: str):
+    ud = ctx.user_data
+    scenario = SCENARIO_BY_BUTTON[text]
+    ud["mode"] = scenario.mode
+    if scenario.mode == "questions":
+        ud["q_state"] = "await_pc"
         ud.pop("q_session", None)
-        return await start(update, ctx)
-
-    if text == LANG_BUTTON:
-        kb = [list(LANG_OPTIONS.keys()), ["Меню"]]
-        msg = "Выберите язык / Choose language:" if lang == "ru" else "Select language:"
-        return await update.message.reply_text(msg, reply_markup=make_kb(kb))
-    if text in LANG_OPTIONS:
-        ud["lang"] = LANG_OPTIONS[text]
-        lang_name = "Русский" if ud["lang"] == "ru" else "English"
-        await update.message.reply_text(f"Язык изменен на {lang_name} / Language changed to {lang_name}")
-        return await start(update, ctx)
-
-    if text in MODE_OPTIONS:
-        mode = MODE_OPTIONS[text]
-        ud["mode"] = mode
-
-        if mode == "questions":
-            ud["q_state"] = "await_pc"
-            ud.pop("q_session", None)
-
-        instr = scenario_instruction(mode, lang)
-        return await update.message.reply_text(instr, reply_markup=make_kb([["Меню"]]))
-
-    if ud.get("mode") == "questions":
-        q_state = ud.get("q_state")
-
-        if q_state == "await_pc":
-            try:
-                pos, comp = _parse_position_company(text, lang)
-            except ValueError as e:
-                return await update.message.reply_text(str(e), reply_markup=make_kb([["Меню"]]))
-
-            ud["q_session"] = {"position": pos, "company": comp}
-            ud["q_state"] = "await_context"
-
-            hint = (
-                "Теперь отдельным сообщением опишите контекст интервью (свободный ввод).\n"
-                "Примеры: диагностика компании/функции, рост, снижение затрат, выход на рынок, "
-                "цифровая трансформация, M&A/интеграция и т.д."
-                if lang == "ru" else
-                "Now describe the interview context in a separate message (free text).\n"
-                "Examples: company/function diagnostics, growth, cost reduction, market entry, "
-                "digital transformation, M&A/integration, etc."
-            )
-            return await update.message.reply_text(hint, reply_markup=make_kb([["Меню"]]))
-
-        if q_state == "await_context":
-            sess = ud.get("q_session") or {}
-            pos, comp = sess.get("position"), sess.get("company")
-            if not (pos and comp):
-                ud["q_state"] = "await_pc"
-                return await update.message.reply_text(
-                    "Введите должность и компанию заново." if lang == "ru" else "Please enter position and company again.",
-                    reply_markup=make_kb([["Меню"]])
-                )
-
-            context_txt = text
-            await update.message.reply_text("Обрабатываю..." if lang == "ru" else "Processing...",
-                                            reply_markup=ReplyKeyboardRemove())
-            try:
-                msgs = build_questions_with_context(pos, comp, context_txt, lang)
-                result = call_gigachat(msgs, temperature=0.35, top_p=0.9, max_tokens=700)
-                sess.update({"context": context_txt, "questions": result})
-                ud["q_session"] = sess
-                ud["q_state"] = "ready"
-
-                ud["last_input"] = f"{pos} / {comp} / {context_txt}"
-                ud["last_mode"] = "questions"
-                ud["last_result"] = result
-
-                kb = [[BTN_MORE_Q, BTN_FOLLOWUPS], ["Меню"]]
-                return await update.message.reply_text(result, reply_markup=make_kb(kb))
-            except Exception as e:
-                return await update.message.reply_text(
-                    ("Ошибка: " + str(e)) if lang == "ru" else ("Error: " + str(e)),
-                    reply_markup=make_kb([["Меню"]])
-                )
-
-        if text == BTN_MORE_Q and ud.get("q_state") == "ready":
-            sess = ud.get("q_session")
-            if not (sess and sess.get("questions")):
-                return await update.message.reply_text(
-                    "Сначала сгенерируйте основной список вопросов." if lang == "ru"
-                    else "Please generate the main list first.",
-                    reply_markup=make_kb([["Меню"]])
-                )
-
-            pos, comp = sess["position"], sess["company"]
-            context_txt = sess.get("context")
-            prev_q = sess["questions"]
-
-            await update.message.reply_text("Добавляю вопросы..." if lang == "ru" else "Adding more questions...",
-                                            reply_markup=ReplyKeyboardRemove())
-            try:
-                msgs = build_more_questions_messages(pos, comp, context_txt, prev_q, lang)
-                more = call_gigachat(msgs, temperature=0.35, top_p=0.9, max_tokens=500)
-                sess["questions"] = prev_q + "\n\n" + more
-                ud["q_session"] = sess
-                ud["last_result"] = sess["questions"]
-
-                kb = [[BTN_MORE_Q, BTN_FOLLOWUPS], ["Меню"]]
-                return await update.message.reply_text(more, reply_markup=make_kb(kb))
-            except Exception as e:
-                return await update.message.reply_text(
-                    ("Ошибка: " + str(e)) if lang == "ru" else ("Error: " + str(e)),
-                    reply_markup=make_kb([["Меню"]])
-                )
-
-        if text == BTN_FOLLOWUPS and ud.get("q_state") == "ready":
-            sess = ud.get("q_session")
-            if not (sess and sess.get("questions")):
-                return await update.message.reply_text(
-                    "Сначала сгенерируйте вопросы." if lang == "ru"
-                    else "Please generate questions first.",
-                    reply_markup=make_kb([["Меню"]])
-                )
-
-            questions_text = sess["questions"]
-            await update.message.reply_text("Готовлю фоллоу-апы..." if lang == "ru" else "Preparing follow-ups...",
-                                            reply_markup=ReplyKeyboardRemove())
-            try:
-                msgs = build_followups_messages(questions_text, lang)
-                followups = call_gigachat(msgs, temperature=0.35, top_p=0.9, max_tokens=700)
-                kb = [[BTN_MORE_Q], ["Меню"]]
-                return await update.message.reply_text(followups, reply_markup=make_kb(kb))
-            except Exception as e:
-                return await update.message.reply_text(
-                    ("Ошибка: " + str(e)) if lang == "ru" else ("Error: " + str(e)),
-                    reply_markup=make_kb([["Меню"]])
-                )
-
-        instr = scenario_instruction("questions", lang)
-        return await update.message.reply_text(instr, reply_markup=make_kb([["Меню"]]))
-
-    if text in sum(REFINERS.values(), []):
-        base = ud.get("last_input")
-        mode0 = ud.get("last_mode")
-        draft = ud.get("last_result")
-        if not base or not mode0:
-            return await update.message.reply_text(
-                "Сначала отправьте исходный запрос." if lang == "ru" else "Send an initial request first.",
-                reply_markup=make_kb([["Меню"]])
-            )
-
-        await update.message.reply_text("Дорабатываю..." if lang == "ru" else "Refining...",
-                                        reply_markup=ReplyKeyboardRemove())
-
-        if mode0 == "action":
-            msgs = build_refine_messages(mode0, lang, base, draft, text)
-            refined = call_gigachat(msgs, temperature=0.5, top_p=0.9, max_tokens=240)
-            ud["last_result"] = refined
-            return await update.message.reply_text(refined, reply_markup=make_refiners_kb(mode0))
-        else:
-            return await update.message.reply_text(
-                "Режим не поддерживает доработку этой кнопкой." if lang == "ru"
-                else "This mode doesn't support that refinement.",
-                reply_markup=make_kb([["Меню"]])
-            )
+    lang = ud.get("lang", "ru")
+    return await update.message.reply_text(scenario.instruction.get(lang, scenario.instruction["ru"]),
+                                           reply_markup=MENU_KB)
+
+
+# кнопки навигации работают в любом режиме
+ROUTES = {"Меню": _on_menu, LANG_BUTTON: _on_lang_button}
+ROUTES.update({button: _on_lang_select for button in LANG_OPTIONS})
+ROUTES.update({button: _on_mode_select for button in SCENARIO_BY_BUTTON})
 
-    mode = ud.get("mode", "action")
 
-    if mode == "action":
-        await update.message.reply_text("Обрабатываю..." if lang == "ru" else "Processing...",
-                                        reply_markup=ReplyKeyboardRemove())
-        msgs = build_rewrite_messages(text, lang)
-        result = call_gigachat(msgs, 0.3, top_p=0.9, max_tokens=120)
+async def _questions_await_pc(update: Update, ctx: ContextTypes.DEFAULT_TYPE, text: str, lang: str):
+    ud = ctx.user_data
+    try:
+        pos, comp = _parse_position_company(text, lang)
+    except ValueError as e:
+        return await update.message.reply_text(str(e), reply_markup=MENU_KB)
+
+    ud["q_session"] = {"position": pos, "company": comp}
+    ud["q_state"] = "await_context"
+
+    hint = (
+        "Теперь отдельным сообщением опишите контекст интервью (свободный ввод).\n"
+        "Примеры: диагностика компании/функции, рост, снижение затрат, выход на рынок, "
+        "цифровая трансформация, M&A/интеграция и т.д."
+        if lang == "ru" else
+        "Now describe the interview context in a separate message (free text).\n"
+        "Examples: company/function diagnostics, growth, cost reduction, market entry, "
+        "digital transformation, M&A/integration, etc."
+    )
+    return await update.message.reply_text(hint, reply_markup=MENU_KB)
+
+
+async def _questions_await_context(update: Update, ctx: ContextTypes.DEFAULT_TYPE, text: str, lang: str):
+    ud = ctx.user_data
+    sess = ud.get("q_session") or {}
+    pos, comp = sess.get("position"), sess.get("company")
+    if not (pos and comp):
+        ud["q_state"] = "await_pc"
+        return await update.message.reply_text(
+            "Введите должность и компанию заново." if lang == "ru" else "Please enter position and company again.",
+            reply_markup=MENU_KB
+        )
 
-        ud["last_input"] = text
-        ud["last_mode"] = "action"
+    context_txt = text
+    label_update("questions", lang)
+    progress = await update.message.reply_text(PROGRESS_TEXT[lang], reply_markup=ReplyKeyboardRemove())
+    try:
+        msgs = build_questions_with_context(pos, comp, context_txt, lang)
+        result = await _stream_reply(update, progress, msgs, Q_READY_KB, temperature=0.35, top_p=0.9,
+                                     max_tokens=budgets.max_tokens("questions", msgs),
+                                     cache=CACHE_MODES["questions"], mode="questions",
+                                     session_id=_questions_session(update, {**sess, "context": context_txt}))
+        sess.update({"context": context_txt, "history": history.from_text(result)})
+        ud["q_session"] = sess
+        ud["q_state"] = "ready"
+
+        ud["last_input"] = f"{pos} / {comp} / {context_txt}"
+        ud["last_mode"] = "questions"
         ud["last_result"] = result
-        return await update.message.reply_text(result, reply_markup=make_refiners_kb("action"))
-
-    if mode == "structure":
-        await update.message.reply_text("Обрабатываю..." if lang == "ru" else "Processing...",
-                                        reply_markup=ReplyKeyboardRemove())
-        msgs = build_structure_messages(text, lang)
-        result = call_gigachat(msgs, 0.5, 0.9, 800)
-        ud.update({"last_input": text, "last_mode": "structure", "last_result": result})
-        return await update.message.reply_text(result, reply_markup=make_kb([["Меню"]]))
-
-    if mode == "hypotheses":
-        await update.message.reply_text("Обрабатываю..." if lang == "ru" else "Processing...",
-                                        reply_markup=ReplyKeyboardRemove())
-        msgs = build_hypotheses_messages(text, lang)
-        result = call_gigachat(msgs, 0.5, 0.9, 500)
-        ud.update({"last_input": text, "last_mode": "hypotheses", "last_result": result})
-        return await update.message.reply_text(result, reply_markup=make_kb([["Меню"]]))
-
-    if mode == "frameworks":
-        await update.message.reply_text("Обрабатываю..." if lang == "ru" else "Processing...",
-                                        reply_markup=ReplyKeyboardRemove())
-        msgs = build_frameworks_messages(text, lang)
-        result = call_gigachat(msgs, 0.5, 0.9, 500)
-        ud.update({"last_input": text, "last_mode": "frameworks", "last_result": result})
-        return await update.message.reply_text(result, reply_markup=make_kb([["Меню"]]))
-
-    kb = [["Экшн-тайтлы", "Вопросы"], ["Структура", "Гипотезы"], ["Фреймворки", LANG_BUTTON]]
-    return await update.message.reply_text(
-        "Выберите режим в меню" if lang == "ru" else "Choose a scenario in the menu",
-        reply_markup=make_kb(kb),
+    except Exception as e:
+        return await update.message.reply_text(_error_text(e, lang), reply_markup=MENU_KB)
+
+
+async def _questions_more(update: Update, ctx: ContextTypes.DEFAULT_TYPE, text: str, lang: str):
+    ud = ctx.user_data
+    sess = ud.get("q_session")
+    hist = history.ensure(sess) if sess else None
+    if not hist:
+        return await update.message.reply_text(
+            "Сначала сгенерируйте основной список вопросов." if lang == "ru"
+            else "Please generate the main list first.",
+            reply_markup=MENU_KB
+        )
+
+    pos, comp = sess["position"], sess["company"]
+    context_txt = sess.get("context")
+    prev_q = history.render(hist, lang)
+
+    label_update("more_questions", lang)
+    progress = await update.message.reply_text(
+        "Добавляю вопросы..." if lang == "ru" else "Adding more questions...",
+        reply_markup=ReplyKeyboardRemove()
+    )
+    try:
+        msgs = build_more_questions_messages(pos, comp, context_txt, prev_q, lang)
+        more = await _stream_reply(update, progress, msgs, Q_READY_KB, temperature=0.35, top_p=0.9,
+                                   max_tokens=budgets.max_tokens("more_questions", msgs),
+                                   cache=CACHE_MODES["more_questions"], mode="more_questions",
+                                   session_id=_questions_session(update, sess))
+        history.add_questions(hist, more)
+        ud["q_session"] = sess
+        ud["last_result"] = history.recent_text(hist)
+    except Exception as e:
+        return await update.message.reply_text(_error_text(e, lang), reply_markup=MENU_KB)
+
+
+async def _questions_followups(update: Update, ctx: ContextTypes.DEFAULT_TYPE, text: str, lang: str):
+    sess = ctx.user_data.get("q_session")
+    hist = history.ensure(sess) if sess else None
+    if not hist:
+        return await update.message.reply_text(
+            "Сначала сгенерируйте вопросы." if lang == "ru"
+            else "Please generate questions first.",
+            reply_markup=MENU_KB
+        )
+
+    questions_text = history.recent_text(hist)
+    label_update("followups", lang)
+    progress = await update.message.reply_text(
+        "Готовлю фоллоу-апы..." if lang == "ru" else "Preparing follow-ups...",
+        reply_markup=ReplyKeyboardRemove()
+    )
+    try:
+        msgs = build_followups_messages(questions_text, lang, sess.get("position"), sess.get("company"),
+                                        sess.get("context"))
+        await _stream_reply(update, progress, msgs, Q_FOLLOWUPS_KB, temperature=0.35, top_p=0.9,
+                            max_tokens=budgets.max_tokens("followups", msgs),
+                            cache=CACHE_MODES["followups"], mode="followups",
+                            session_id=_questions_session(update, sess))
+    except Exception as e:
+        return await update.message.reply_text(_error_text(e, lang), reply_markup=MENU_KB)
+
+
+QUESTION_STATES = {"await_pc": _questions_await_pc, "await_context": _questions_await_context}
+QUESTION_BUTTONS = {BTN_MORE_Q: _questions_more, BTN_FOLLOWUPS: _questions_followups}
+
+
+async def _questions_flow(update: Update, ctx: ContextTypes.DEFAULT_TYPE, text: str, lang: str):
+    q_state = ctx.user_data.get("q_state")
+    step = QUESTION_STATES.get(q_state)
+    if step is None and q_state == "ready":
+        step = QUESTION_BUTTONS.get(text)
+    if step is not None:
+        return await step(update, ctx, text, lang)
+    instr = SCENARIOS["questions"].instruction[lang]
+    return await update.message.reply_text(instr, reply_markup=MENU_KB)
+
+
+# сценарии со своим пошаговым диалогом; остальные — один запрос по scenario.builder
+FLOWS = {"questions": _questions_flow}
+
+
+async def _refine_text(update: Update, scenario, base: str, draft: str | None, button: str, lang: str,
+                       mode: str = "refine") -> str:
+    if button == BTN_MORE and scenario.variants_builder is not None and FANOUT_VARIANTS > 1:
+        return await _variants_text(update, scenario, base, draft, lang, "variants" if mode == "refine" else mode)
+    msgs = scenario.refine_builder(scenario.mode, lang, base, draft, button)
+    return await call_gigachat(msgs, temperature=scenario.refine_temperature, top_p=scenario.top_p,
+                               max_tokens=budgets.max_tokens("refine", msgs),
+                               cache=CACHE_MODES["refine"], mode=mode,
+                               session_id=_refine_session(update, base))
+
+
+async def _variants_text(update: Update, scenario, base: str, draft: str | None, lang: str, mode: str) -> str:
+    # FANOUT_VARIANTS коротких вызовов параллельно вместо одной генерации «дай 3 варианта»
+    msgs = scenario.variants_builder(lang, base, draft)
+    raw = await call_gigachat_variants(msgs, FANOUT_VARIANTS, temperature=scenario.refine_temperature,
+                                       top_p=scenario.top_p, max_tokens=budgets.max_tokens("variants", msgs),
+                                       mode=mode, session_id=_refine_session(update, base))
+    titles = variants.pick(raw, exclude=(draft,) if draft else (), limit=FANOUT_SHOW)
+    if not titles:
+        # все варианты совпали с текущим — показываем лучший из них, а не пустой ответ
+        titles = variants.pick(raw)[:1] or [draft or ""]
+    return "\n".join(f"{i}. {t}" for i, t in enumerate(titles, 1))
+
+
+def _refine_cost(scenario, button: str) -> int:
+    return FANOUT_VARIANTS if button == BTN_MORE and scenario.variants_builder is not None else 1
+
+
+def _prefetch_refiners(update: Update, scenario, base: str, draft: str, lang: str):
+    speculator.schedule(
+        update.effective_chat.id, (base, draft), scenario.refiners,
+        lambda button: _refine_text(update, scenario, base, draft, button, lang, mode="prefetch"),
+        cost=lambda button: _refine_cost(scenario, button),
     )
+
+
+async def _refine(update: Update, ctx: ContextTypes.DEFAULT_TYPE, text: str, lang: str):
+    ud = ctx.user_data
+    base = ud.get("last_input")
+    mode0 = ud.get("last_mode")
+    draft = ud.get("last_result")
+    if not base or not mode0:
+        return await update.message.reply_text(
+            "Сначала отправьте исходный запрос." if lang == "ru" else "Send an initial request first.",
+            reply_markup=MENU_KB
+        )
+
+    label_update("refine", lang)
+    scenario = SCENARIOS.get(mode0)
+    if scenario is not None and text == BTN_PRESS and text in scenario.refiners:
+        return await _enqueue_press_test(update, scenario, base, draft, lang)
+    if scenario is None or scenario.refine_builder is None or text not in scenario.refiners:
+        await update.message.reply_text(REFINING_TEXT[lang], reply_markup=ReplyKeyboardRemove())
+        return await update.message.reply_text(
+            "Режим не поддерживает доработку этой кнопкой." if lang == "ru"
+            else "This mode doesn't support that refinement.",
+            reply_markup=MENU_KB
+        )
+
+    # заготовка из префетча: готова — отвечаем сразу, ещё считается — дожидаемся её, а не начинаем заново
+    prefetched = speculator.take(update.effective_chat.id, (base, draft), text)
+    if prefetched is None or not prefetched.done():
+        await update.message.reply_text(REFINING_TEXT[lang], reply_markup=ReplyKeyboardRemove())
+    refined = await prefetched if prefetched is not None else None
+    if not refined:
+        refined = await _refine_text(update, scenario, base, draft, text, lang)
+    ud["last_result"] = refined
+    return await update.message.reply_text(refined, reply_markup=scenario.result_kb)
+
+
+async def _enqueue_press_test(update: Update, scenario, base: str, draft: str | None, lang: str):
+    # пресс-тест длинный: ставим в очередь и сразу освобождаем обработчик, ответ пришлёт воркер
+    payload = {"mode": scenario.mode, "lang": lang, "base": base, "draft": draft}
+    try:
+        job_id = await durable_jobs.enqueue(update.effective_chat.id, "press_test", payload)
+    except QueueFull:
+        return await update.message.reply_text(
+            "Уже выполняется несколько задач, дождитесь их или отмените: /cancel" if lang == "ru"
+            else "Several jobs are already running; wait for them or /cancel", reply_markup=scenario.result_kb)
+    return await update.message.reply_text(
+        f"Пресс-тест поставлен в очередь (#{job_id}). Пришлю результат, как будет готов. /status — статус, "
+        f"/cancel — отменить" if lang == "ru" else
+        f"Press test queued (#{job_id}). I'll send the result when it's ready. /status — status, /cancel — cancel",
+        reply_markup=scenario.result_kb)
+
+
+async def _run_press_test(bot, job: dict):
+    p = job["payload"]
+    scenario = SCENARIOS[p["mode"]]
+    msgs = build_press_test_messages(p["mode"], p["lang"], p["base"], p["draft"])
+    try:
+        result = await call_gigachat(msgs, scenario.temperature, top_p=scenario.top_p,
+                                     max_tokens=budgets.max_tokens("press_test", msgs),
+                                     cache=scenario.cache, mode="press_test")
+    except Exception as e:
+        await bot.send_message(job["chat_id"], _error_text(e, p["lang"]), reply_markup=scenario.result_kb)
+        raise
+    await bot.send_message(job["chat_id"], result[:TG_MAX_LEN], reply_markup=scenario.result_kb)
+
+
+durable_jobs.register("press_test", _run_press_test)
+
+
+async def _generate(update: Update, ctx: ContextTypes.DEFAULT_TYPE, scenario, text: str, lang: str):
+    ud = ctx.user_data
+    progress = await update.message.reply_text(PROGRESS_TEXT[lang], reply_markup=ReplyKeyboardRemove())
+    msgs = scenario.builder(text, lang)
+    max_tokens = budgets.max_tokens(scenario.mode, msgs)
+    if scenario.stream:
+        result = await _stream_reply(update, progress, msgs, scenario.result_kb, temperature=scenario.temperature,
+                                     top_p=scenario.top_p, max_tokens=max_tokens, cache=scenario.cache,
+                                     mode=scenario.mode)
+    else:
+        result = await call_gigachat(msgs, scenario.temperature, top_p=scenario.top_p, max_tokens=max_tokens,
+                                     cache=scenario.cache, mode=scenario.mode)
+        await update.message.reply_text(result, reply_markup=scenario.result_kb)
+    ud.update({"last_input": text, "last_mode": scenario.mode, "last_result": result})
+    if scenario.refine_builder is not None and scenario.refiners:
+        _prefetch_refiners(update, scenario, text, result, lang)
+
+
+async def handle_text(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    text = (update.message.text or "").strip()
+    ud = ctx.user_data
+    lang = ud.get("lang", "ru")
+    if text not in REFINER_BUTTONS:
+        speculator.discard(update.effective_chat.id)  # новый ввод — заготовки рефайнеров больше не нужны
+
+    route = ROUTES.get(text)
+    if route is not None:
+        return await route(update, ctx, text)
+
+    mode = ud.get("mode", "action")
+    flow = FLOWS.get(mode)
+    if flow is not None:
+        return await flow(update, ctx, text, lang)
+
+    if text in REFINER_BUTTONS:
+        return await _refine(update, ctx, text, lang)
+
+    scenario = SCENARIOS.get(mode)
+    if scenario is None or scenario.builder is None:
+        return await update.message.reply_text(
+            "Выберите режим в меню" if lang == "ru" else "Choose a scenario in the menu",
+            reply_markup=MAIN_KB,
+        )
+    label_update(mode, lang)
+    return await _generate(update, ctx, scenario, text, lang)
@@ -0,0 +1,102 @@
+import re, hashlib
+
+from bot.budget import estimate_tokens
+from bot.config import HISTORY_RECENT_TOKENS, HISTORY_SUMMARY_TOKENS, HISTORY_MAX_FINGERPRINTS
+
+# история сессии вопросов — обычный dict, чтобы жить в ctx.user_data и SQLitePersistence:
+#   recent       — последние вопросы дословно, в пределах HISTORY_RECENT_TOKENS
+#   topics       — «суть» вытесненных вопросов (первые слова), в пределах HISTORY_SUMMARY_TOKENS
+#   fingerprints — отпечатки всех вопросов сессии для отсева повторов
+#   total        — сколько вопросов сгенерировано за сессию
+
+_ITEM = re.compile(r"^\s*(?:\d{1,3}[.)]|[-•*])\s+")
+_WORD = re.compile(r"[a-zа-яё0-9]+")
+TOPIC_WORDS = 8
+
+
+def new_history() -> dict:
+    return {"recent": [], "topics": [], "fingerprints": [], "total": 0}
+
+
+def split_questions(text: str) -> list:
+    # нумерованный/маркированный список -> отдельные вопросы; строки без маркера — продолжение предыдущего
+    items = []
+    for line in (text or "").splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if _ITEM.match(line):
+            items.append(_ITEM.sub("", line))
+        elif not items:
+            if not line.endswith(":"):  # преамбулу вида «Вот вопросы:» не считаем вопросом
+                items.append(line)
+        else:
+            items[-1] += " " + line
+    return [q for q in items if q]
+
+
+def fingerprint(question: str) -> str:
+    # порядок слов и окончания не важны: «Какие метрики вы отслеживаете?» ~ «Какие метрики отслеживаете вы»
+    stems = sorted({w[:5] for w in _WORD.findall(question.lower()) if len(w) > 3 or w.isdigit()})
+    return hashlib.sha1(" ".join(stems).encode("utf-8")).hexdigest()[:12]
+
+
+def _topic(question: str) -> str:
+    words = question.split()
+    return " ".join(words[:TOPIC_WORDS]) + ("…" if len(words) > TOPIC_WORDS else "")
+
+
+def _trim(hist: dict):
+    recent_tokens = sum(estimate_tokens(q) for q in hist["recent"])
+    while len(hist["recent"]) > 1 and recent_tokens > HISTORY_RECENT_TOKENS:
+        old = hist["recent"].pop(0)
+        recent_tokens -= estimate_tokens(old)
+        hist["topics"].append(_topic(old))
+    topic_tokens = sum(estimate_tokens(t) for t in hist["topics"])
+    while hist["topics"] and topic_tokens > HISTORY_SUMMARY_TOKENS:
+        topic_tokens -= estimate_tokens(hist["topics"].pop(0))
+    del hist["fingerprints"][:-HISTORY_MAX_FINGERPRINTS]
+
+
+def add_questions(hist: dict, text: str) -> list:
+    seen = set(hist["fingerprints"])
+    added = []
+    for q in split_questions(text):
+        fp = fingerprint(q)
+        if fp in seen:
+            continue
+        seen.add(fp)
+        hist["fingerprints"].append(fp)
+        hist["recent"].append(q)
+        added.append(q)
+    hist["total"] += len(added)
+    _trim(hist)
+    return added
+
+
+def from_text(text: str) -> dict:
+    hist = new_history()
+    add_questions(hist, text)
+    return hist
+
+
+def ensure(sess: dict) -> dict | None:
+    # сессии, сохранённые до появления истории, хранили весь список строкой в "questions"
+    hist = sess.get("history")
+    if hist is None and sess.get("questions"):
+        hist = sess["history"] = from_text(sess.pop("questions"))
+    return hist
+
+
+def recent_text(hist: dict) -> str:
+    return "\n".join(f"{i}. {q}" for i, q in enumerate(hist["recent"], 1))
+
+
+def render(hist: dict, lang: str) -> str:
+    # ограниченное представление для промпта: сжатые старые темы + последние вопросы дословно
+    recent = recent_text(hist)
+    if not hist["topics"]:
+        return recent
+    if lang == "ru":
+        return f"Ранее уже обсуждались темы: {'; '.join(hist['topics'])}\n\nПоследние вопросы:\n{recent}"
+    return f"Topics already covered: {'; '.join(hist['topics'])}\n\nMost recent questions:\n{recent}"
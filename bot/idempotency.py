@@ -0,0 +1,55 @@
+import time, sqlite3
+from collections import deque
+
+from bot.config import logger
+
+
+# окно последних update_id: повторная доставка от Telegram отсекается до Update.de_json
+class UpdateDeduper:
+    PRUNE_EVERY = 1000
+
+    def __init__(self, window: int, path: str | None = None):
+        self.window = window
+        self.duplicates = 0
+        self._ring = deque(maxlen=window)
+        self._seen = set()
+        self._inserts = 0
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS seen_updates (update_id INTEGER PRIMARY KEY, seen_at REAL NOT NULL)")
+            rows = self._db.execute(
+                "SELECT update_id FROM seen_updates ORDER BY update_id DESC LIMIT ?", (window,)
+            ).fetchall()
+            for (update_id,) in reversed(rows):
+                self._remember(update_id)
+            logger.info(f"🧾 Загружено {len(rows)} update_id для дедупликации")
+
+    def _remember(self, update_id: int):
+        if len(self._ring) == self._ring.maxlen:
+            self._seen.discard(self._ring[0])
+        self._ring.append(update_id)
+        self._seen.add(update_id)
+
+    def seen(self, update_id: int) -> bool:
+        # True — апдейт уже принят раньше, повтор можно подтвердить без обработки
+        if update_id in self._seen:
+            self.duplicates += 1
+            return True
+        return False
+
+    def mark(self, update_id: int):
+        # только после того, как апдейт принят в очередь: иначе повтор после 500 отсёкся бы как дубль
+        if update_id in self._seen:
+            return
+        self._remember(update_id)
+        if self._db is not None:
+            try:
+                self._db.execute("INSERT OR IGNORE INTO seen_updates VALUES (?, ?)", (update_id, time.time()))
+                self._inserts += 1
+                if self._inserts % self.PRUNE_EVERY == 0:
+                    self._db.execute("DELETE FROM seen_updates WHERE update_id < ?", (self._ring[0],))
+            except sqlite3.Error as e:
+                logger.warning(f"Не удалось сохранить update_id {update_id}: {e!r}")
@@ -0,0 +1,100 @@
+import asyncio, hashlib
+
+from telegram import Update, InlineQueryResultArticle, InputTextMessageContent
+from telegram.error import BadRequest
+from telegram.ext import ContextTypes
+
+from bot.config import (
+    logger, INLINE_DEBOUNCE, INLINE_MIN_CHARS, INLINE_CACHE_TTL, INLINE_CACHE_ITEMS, INLINE_ANSWER_CACHE_TIME,
+)
+from bot.budget import budgets
+from bot.cache import CompletionCache
+from bot.gigachat import call_gigachat
+from bot.metrics import INLINE_QUERIES, label_update
+from bot.scenarios import SCENARIOS
+
+# только память: набор одной фразы повторяется в пределах минут, на диск это класть незачем
+inline_cache = CompletionCache(None, INLINE_CACHE_TTL, INLINE_CACHE_ITEMS, 0)
+
+_inflight = {}  # user_id -> Task генерации для последнего запроса пользователя
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.lower().split()).rstrip(" .,;:!?…")
+
+
+def _lang(update: Update, ctx: ContextTypes.DEFAULT_TYPE) -> str:
+    lang = ctx.user_data.get("lang") if ctx.user_data is not None else None
+    if lang:
+        return lang
+    code = update.inline_query.from_user.language_code or ""
+    return "en" if code.startswith("en") else "ru"
+
+
+async def _title(phrase: str, lang: str) -> str:
+    await asyncio.sleep(INLINE_DEBOUNCE)  # пользователь ещё печатает — этот запрос скорее всего устареет
+    scenario = SCENARIOS["action"]
+    msgs = scenario.builder(phrase, lang)
+    # без общего кэша и склейки: отменённый запрос должен реально освободить слот GigaChat
+    return await call_gigachat(msgs, scenario.temperature, top_p=scenario.top_p,
+                               max_tokens=budgets.max_tokens("action", msgs), cache=False, mode="inline")
+
+
+def _results(phrase: str, title: str) -> list:
+    return [InlineQueryResultArticle(
+        id=hashlib.sha1(title.encode("utf-8")).hexdigest()[:32],
+        title=title,
+        description=phrase[:100],
+        input_message_content=InputTextMessageContent(title),
+    )]
+
+
+async def _answer(query, results: list):
+    # язык заголовка — из настроек пользователя, поэтому кэш Telegram не должен делиться им с другими
+    try:
+        await query.answer(results, cache_time=INLINE_ANSWER_CACHE_TIME, is_personal=True)
+    except BadRequest as e:
+        logger.debug(f"Inline-ответ не принят (запрос устарел?): {e!r}")
+
+
+async def handle_inline_query(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    query = update.inline_query
+    phrase = query.query.strip()
+    lang = _lang(update, ctx)
+    label_update("inline", lang)
+    user_id = query.from_user.id
+
+    previous = _inflight.pop(user_id, None)
+    if previous is not None and not previous.done():
+        previous.cancel()  # набрали ещё символ — прежняя генерация никому не нужна
+
+    if len(phrase) < INLINE_MIN_CHARS:
+        INLINE_QUERIES.labels("short").inc()
+        return
+
+    key = f"{lang}:{_normalize(phrase)}"
+    cached = await inline_cache.get(key)
+    if cached is not None:
+        INLINE_QUERIES.labels("cache").inc()
+        return await _answer(query, _results(phrase, cached))
+
+    task = asyncio.create_task(_title(phrase, lang))
+    _inflight[user_id] = task
+    try:
+        title = await task
+    except asyncio.CancelledError:
+        if asyncio.current_task().cancelling():
+            raise  # отменили сам обработчик, а не устаревший запрос
+        INLINE_QUERIES.labels("superseded").inc()
+        return
+    except Exception as e:
+        INLINE_QUERIES.labels("error").inc()
+        logger.warning(f"⚠️ Inline-запрос не выполнен: {e!r}")
+        return
+    finally:
+        if _inflight.get(user_id) is task:
+            del _inflight[user_id]
+
+    await inline_cache.set(key, title)
+    INLINE_QUERIES.labels("answered").inc()
+    await _answer(query, _results(phrase, title))
@@ -0,0 +1,217 @@
+import json, time, sqlite3, asyncio, threading, contextvars
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from bot.config import (
+    logger, JOBS_DB_PATH, JOBS_WORKERS, JOBS_MAX_ATTEMPTS, JOBS_MAX_PER_CHAT, JOBS_KEEP_DAYS,
+)
+from bot.sharding import shard_index
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+ACTIVE = (QUEUED, RUNNING)
+IDLE_POLL = 5.0  # страховка: воркер заглядывает в очередь, даже если его не разбудили
+
+
+class QueueFull(Exception):
+    pass
+
+
+class DurableJobQueue:
+    # очередь долгих генераций в SQLite: обработчик апдейта ставит задачу и сразу отвечает,
+    # воркеры сами доставляют результат; после рестарта незавершённые задачи подхватываются заново
+    def __init__(self, path: str = JOBS_DB_PATH, workers: int = JOBS_WORKERS, shard: int | None = None):
+        # в кластере у каждого воркера свои задачи: их чаты, их /cancel, их восстановление после рестарта
+        self.workers = workers
+        self.shard = shard_index() if shard is None else shard
+        # запросы к SQLite идут из потоков asyncio.to_thread, соединение одно — сериализуем локом
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id INTEGER NOT NULL, kind TEXT NOT NULL, "
+            "payload TEXT NOT NULL, status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, "
+            "error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL, shard INTEGER NOT NULL DEFAULT 0)"
+        )
+        try:
+            self._db.execute("ALTER TABLE jobs ADD COLUMN shard INTEGER NOT NULL DEFAULT 0")
+        except sqlite3.OperationalError:
+            pass  # колонка уже есть
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, id)")
+        self._runners = {}  # kind -> async (bot, job) -> None
+        self._running = {}  # job id -> Task
+        self._wakeup = None
+        self._tasks = []
+        self.bot = None
+
+    def register(self, kind: str, runner):
+        self._runners[kind] = runner
+
+    def _set(self, job_id: int, status: str, error: str | None = None):
+        with self._lock:
+            self._db.execute("UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                             (status, error, time.time(), job_id))
+
+    def _insert(self, chat_id: int, kind: str, payload: dict) -> int:
+        with self._lock:
+            (active,) = self._db.execute("SELECT COUNT(*) FROM jobs WHERE chat_id = ? AND status IN (?, ?)",
+                                         (chat_id, *ACTIVE)).fetchone()
+            if active >= JOBS_MAX_PER_CHAT:
+                raise QueueFull(active)
+            now = time.time()
+            cur = self._db.execute(
+                "INSERT INTO jobs (chat_id, kind, payload, status, created_at, updated_at, shard) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (chat_id, kind, json.dumps(payload, ensure_ascii=False), QUEUED, now, now, self.shard),
+            )
+            return cur.lastrowid
+
+    async def enqueue(self, chat_id: int, kind: str, payload: dict) -> int:
+        job_id = await asyncio.to_thread(self._insert, chat_id, kind, payload)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job_id
+
+    def _claim(self):
+        with self._lock:
+            row = self._db.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, updated_at = ? "
+                "WHERE id = (SELECT id FROM jobs WHERE status = ? AND shard = ? ORDER BY id LIMIT 1) RETURNING *",
+                (RUNNING, time.time(), QUEUED, self.shard),
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        return job
+
+    def _recover(self):
+        # RUNNING после рестарта — задача прервана падением или деплоем: повторяем, пока не кончатся попытки
+        now = time.time()
+        self._db.execute("UPDATE jobs SET status = ?, error = 'too many restarts', updated_at = ? "
+                         "WHERE status = ? AND shard = ? AND attempts >= ?",
+                         (FAILED, now, RUNNING, self.shard, JOBS_MAX_ATTEMPTS))
+        resumed = self._db.execute("UPDATE jobs SET status = ?, updated_at = ? WHERE status = ? AND shard = ?",
+                                   (QUEUED, now, RUNNING, self.shard)).rowcount
+        self._db.execute("DELETE FROM jobs WHERE status NOT IN (?, ?) AND updated_at < ?",
+                         (*ACTIVE, now - JOBS_KEEP_DAYS * 86400))
+        (queued,) = self._db.execute("SELECT COUNT(*) FROM jobs WHERE status = ? AND shard = ?",
+                                     (QUEUED, self.shard)).fetchone()
+        if queued:
+            logger.info(f"🗂️ В очереди задач {queued}, из них прерваны рестартом: {resumed}")
+
+    async def _worker(self):
+        while True:
+            job = await asyncio.to_thread(self._claim)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), IDLE_POLL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            runner = self._runners.get(job["kind"])
+            if runner is None:
+                await asyncio.to_thread(self._set, job["id"], FAILED, f"unknown kind {job['kind']}")
+                continue
+            # отдельная задача в чистом контексте: /cancel отменяет её, не трогая воркер
+            task = asyncio.create_task(runner(self.bot, job), context=contextvars.Context())
+            self._running[job["id"]] = task
+            started = time.monotonic()
+            try:
+                await task
+                await asyncio.to_thread(self._set, job["id"], DONE)
+                logger.info(f"🗂️ Задача #{job['id']} ({job['kind']}) выполнена за {time.monotonic() - started:.1f} с")
+            except asyncio.CancelledError:
+                if asyncio.current_task().cancelling():
+                    raise  # останавливается сам воркер: задача остаётся RUNNING и будет подхвачена после рестарта
+                await asyncio.to_thread(self._set, job["id"], CANCELLED)
+            except Exception as e:
+                logger.exception(f"❌ Задача #{job['id']} ({job['kind']}) завершилась ошибкой: {e!r}")
+                await asyncio.to_thread(self._set, job["id"], FAILED, repr(e))
+            finally:
+                self._running.pop(job["id"], None)
+
+    def start(self, bot):
+        self.bot = bot
+        self._recover()
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _active(self, chat_id: int) -> list:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT j.id, j.kind, j.status, "
+                "(SELECT COUNT(*) FROM jobs q WHERE q.status = ? AND q.shard = j.shard AND q.id < j.id) AS ahead "
+                "FROM jobs j WHERE j.chat_id = ? AND j.status IN (?, ?) ORDER BY j.id",
+                (QUEUED, chat_id, *ACTIVE),
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    async def active(self, chat_id: int) -> list:
+        return await asyncio.to_thread(self._active, chat_id)
+
+    def _cancel_queued(self, chat_id: int, job_id: int | None) -> int:
+        with self._lock:
+            rows = self._db.execute(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE chat_id = ? AND status = ? AND (? IS NULL OR id = ?) "
+                "RETURNING id",
+                (CANCELLED, time.time(), chat_id, QUEUED, job_id, job_id),
+            ).fetchall()
+        return len(rows)
+
+    async def cancel(self, chat_id: int, job_id: int | None = None) -> int:
+        # очередные снимаем одним UPDATE по статусу: воркер мог забрать задачу, пока мы читали список
+        cancelled = await asyncio.to_thread(self._cancel_queued, chat_id, job_id)
+        for job in await self.active(chat_id):
+            if job_id is not None and job["id"] != job_id:
+                continue
+            task = self._running.get(job["id"])
+            if task is not None:
+                task.cancel()  # статус CANCELLED выставит воркер
+                cancelled += 1
+        return cancelled
+
+
+durable_jobs = DurableJobQueue()
+
+KIND_NAMES = {"press_test": {"ru": "пресс-тест", "en": "press test"}}
+
+
+def _kind_name(kind: str, lang: str) -> str:
+    return KIND_NAMES.get(kind, {}).get(lang, kind)
+
+
+async def status_command(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    lang = ctx.user_data.get("lang", "ru")
+    jobs = await durable_jobs.active(update.effective_chat.id)
+    if not jobs:
+        return await update.message.reply_text("Активных задач нет." if lang == "ru" else "No active jobs.")
+    lines = []
+    for job in jobs:
+        if job["status"] == RUNNING:
+            state = "выполняется" if lang == "ru" else "running"
+        else:
+            state = f"в очереди, перед ней {job['ahead']}" if lang == "ru" else f"queued, {job['ahead']} ahead"
+        lines.append(f"#{job['id']} {_kind_name(job['kind'], lang)}: {state}")
+    return await update.message.reply_text("\n".join(lines))
+
+
+async def cancel_command(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    lang = ctx.user_data.get("lang", "ru")
+    arg = (ctx.args or [""])[0].lstrip("#")
+    job_id = int(arg) if arg.isdigit() else None
+    cancelled = await durable_jobs.cancel(update.effective_chat.id, job_id)
+    if not cancelled:
+        return await update.message.reply_text("Нечего отменять." if lang == "ru" else "Nothing to cancel.")
+    return await update.message.reply_text(
+        f"Отменено задач: {cancelled}" if lang == "ru" else f"Cancelled jobs: {cancelled}")
@@ -0,0 +1,102 @@
+import time
+from contextvars import ContextVar
+
+from prometheus_client import (
+    Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest, start_http_server,
+)
+
+from bot.config import logger
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30, 45, 60, 90, 120)
+
+UPDATE_LATENCY = Histogram(
+    "bot_update_duration_seconds", "От получения апдейта до отправки ответа",
+    ["mode", "lang"], buckets=LATENCY_BUCKETS,
+)
+UPDATES_IN_FLIGHT = Gauge("bot_updates_in_flight", "Апдейты в обработке")
+UPDATES_QUEUED = Gauge("bot_updates_queued", "Апдейты, ждущие очереди чата или глобального слота")
+UPDATES_SHED = Counter("bot_updates_shed_total", "Апдейты, отклонённые из-за перегрузки")
+
+GIGACHAT_LATENCY = Histogram(
+    "gigachat_request_duration_seconds", "Длительность одного HTTP-запроса к GigaChat",
+    ["mode", "session"], buckets=LATENCY_BUCKETS,
+)
+GIGACHAT_REQUESTS = Counter("gigachat_requests_total", "Запросы к GigaChat по статусу ответа", ["mode", "status"])
+GIGACHAT_TOKENS = Counter("gigachat_tokens_total", "Токены из поля usage ответа GigaChat", ["mode", "kind"])
+TOKEN_BUDGET = Gauge("gigachat_max_tokens", "Текущий адаптивный max_tokens по режиму", ["mode"])
+TRUNCATED = Counter("gigachat_truncated_total", "Ответы, обрезанные по max_tokens", ["mode"])
+PREFETCH_RESULTS = Counter("bot_prefetch_total", "Спекулятивные рефайнеры: hit, miss, wasted, capped", ["outcome"])
+INLINE_QUERIES = Counter("bot_inline_queries_total", "Inline-запросы: answered, cache, superseded, short, error",
+                         ["outcome"])
+COMPLETION_CACHE = Counter("gigachat_cache_total", "Поиск ответа в кэше: memory, disk, miss", ["outcome"])
+OAUTH_REFRESHES = Counter("gigachat_oauth_refreshes_total", "Обращения за OAuth-токеном GigaChat", ["outcome"])
+RATELIMIT_WAIT = Histogram(
+    "gigachat_ratelimit_wait_seconds", "Ожидание слота лимитера GigaChat по приоритету",
+    ["priority"], buckets=(0, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60),
+)
+RATELIMIT_ACTIVE = Gauge("gigachat_ratelimit_active", "Запросы к GigaChat, занявшие слот лимитера")
+RATELIMIT_QUEUED = Gauge("gigachat_ratelimit_queued", "Запросы к GigaChat, ждущие слота лимитера")
+
+# метки текущего апдейта: диспетчер создаёт, обработчик уточняет режим и язык
+_update = ContextVar("update_metrics", default=None)
+
+
+def begin_update() -> dict:
+    labels = {"mode": "none", "lang": "none", "started": time.monotonic()}
+    _update.set(labels)
+    return labels
+
+
+def label_update(mode: str | None = None, lang: str | None = None):
+    labels = _update.get()
+    if labels is None:
+        return
+    if mode:
+        labels["mode"] = mode
+    if lang:
+        labels["lang"] = lang
+
+
+def finish_update(labels: dict):
+    UPDATE_LATENCY.labels(labels["mode"], labels["lang"]).observe(time.monotonic() - labels["started"])
+
+
+def track_processor(processor):
+    UPDATES_IN_FLIGHT.set_function(lambda: processor.running)
+    UPDATES_QUEUED.set_function(lambda: processor.queued)
+
+
+def track_budgets(budgets):
+    for mode in budgets.policies:
+        TOKEN_BUDGET.labels(mode).set_function(lambda mode=mode: budgets.max_tokens(mode))
+
+
+def track_limiter(limiter):
+    RATELIMIT_ACTIVE.set_function(lambda: limiter.active)
+    RATELIMIT_QUEUED.set_function(lambda: limiter.queued)
+
+
+def observe_gigachat(mode: str | None, status, seconds: float, session: bool = False):
+    # session — запрос шёл с X-Session-ID: сравниваем задержку с кэшем контекста и без
+    mode = mode or "none"
+    GIGACHAT_REQUESTS.labels(mode, str(status)).inc()
+    GIGACHAT_LATENCY.labels(mode, "yes" if session else "no").observe(seconds)
+
+
+def observe_usage(mode: str | None, usage: dict | None):
+    if not usage:
+        return
+    mode = mode or "none"
+    for kind in ("prompt_tokens", "completion_tokens", "precached_prompt_tokens"):
+        if usage.get(kind):
+            GIGACHAT_TOKENS.labels(mode, kind.removesuffix("_tokens")).inc(usage[kind])
+
+
+def render() -> tuple[bytes, str]:
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def start_exporter(port: int):
+    # для polling-режима: отдельный HTTP-сервер /metrics в фоновом потоке
+    start_http_server(port)
+    logger.info(f"📈 Метрики Prometheus на порту {port}")
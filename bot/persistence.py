@@ -0,0 +1,123 @@
+import json, sqlite3, asyncio
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from bot.config import logger, PERSISTENCE_DB_PATH, PERSISTENCE_INTERVAL
+
+
+class SQLitePersistence(BasePersistence):
+    # хранит только ctx.user_data: сессии грузятся лениво при первом апдейте пользователя,
+    # а изменения PTB отдаёт раз в update_interval и мы пишем их одной транзакцией
+    def __init__(self, path: str = PERSISTENCE_DB_PATH, update_interval: float = PERSISTENCE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS user_data (user_id INTEGER PRIMARY KEY, data TEXT NOT NULL)")
+        self._db_lock = asyncio.Lock()
+        self._loaded = set()
+        self._pending = {}  # user_id -> json или None (удалить)
+        self._writer = None
+
+    def _load(self, user_id: int):
+        row = self._db.execute("SELECT data FROM user_data WHERE user_id = ?", (user_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _write(self, batch: dict):
+        upserts = [(uid, data) for uid, data in batch.items() if data is not None]
+        deletes = [(uid,) for uid, data in batch.items() if data is None]
+        self._db.execute("BEGIN")
+        try:
+            if upserts:
+                self._db.executemany("INSERT OR REPLACE INTO user_data (user_id, data) VALUES (?, ?)", upserts)
+            if deletes:
+                self._db.executemany("DELETE FROM user_data WHERE user_id = ?", deletes)
+            self._db.execute("COMMIT")
+        except Exception:
+            self._db.execute("ROLLBACK")
+            raise
+
+    async def _write_pending(self):
+        # отдаём управление, чтобы собрать в пачку все update_user_data текущего прохода PTB
+        await asyncio.sleep(0)
+        async with self._db_lock:
+            batch, self._pending = self._pending, {}
+            if not batch:
+                return
+            try:
+                await asyncio.to_thread(self._write, batch)
+                logger.debug(f"💾 Сохранено сессий: {len(batch)}")
+            except sqlite3.Error as e:
+                logger.warning(f"Не удалось сохранить сессии: {e!r}")
+                for uid, data in batch.items():
+                    self._pending.setdefault(uid, data)
+
+    def _schedule_write(self):
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self._write_pending())
+
+    async def get_user_data(self) -> dict:
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        if user_id in self._loaded:
+            return
+        self._loaded.add(user_id)
+        try:
+            stored = await asyncio.to_thread(self._load, user_id)
+        except (sqlite3.Error, ValueError) as e:
+            logger.warning(f"Не удалось загрузить сессию {user_id}: {e!r}")
+            return
+        if stored:
+            for key, value in stored.items():
+                user_data.setdefault(key, value)
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        self._pending[user_id] = json.dumps(data, ensure_ascii=False, default=str)
+        self._schedule_write()
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._pending[user_id] = None
+        self._schedule_write()
+
+    async def flush(self) -> None:
+        if self._writer is not None:
+            await self._writer
+        await self._write_pending()
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        pass
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
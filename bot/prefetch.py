@@ -0,0 +1,108 @@
+import time, asyncio, contextvars
+from collections import deque, defaultdict, OrderedDict
+
+from bot.config import (
+    logger, PREFETCH_ENABLED, PREFETCH_TOP_K, PREFETCH_MIN_CLICK_RATE, PREFETCH_MAX_CALLS_PER_MINUTE, PREFETCH_TTL,
+)
+from bot.metrics import PREFETCH_RESULTS
+from bot.ratelimit import limiter
+
+PRIOR_CLICKS, PRIOR_SHOWN = 1.0, 5.0  # пока кликов мало, все кнопки считаем равновероятными
+
+
+class ClickModel:
+    # доля показов результата, после которых нажали кнопку
+    def __init__(self):
+        self.shown = 0
+        self.clicks = defaultdict(int)
+
+    def rate(self, button: str) -> float:
+        return (self.clicks.get(button, 0) + PRIOR_CLICKS) / (self.shown + PRIOR_SHOWN)
+
+    def ranked(self, buttons) -> list:
+        return sorted(buttons, key=self.rate, reverse=True)  # при равенстве — порядок клавиатуры
+
+
+class Speculator:
+    # фоновые задачи по чатам: chat_id -> (ключ результата, {кнопка: Task}, когда запущены)
+    def __init__(self, enabled: bool, top_k: int, min_rate: float, max_calls_per_minute: int, ttl: float):
+        self.enabled = enabled
+        self.top_k = top_k
+        self.min_rate = min_rate
+        self.max_calls = max_calls_per_minute
+        self.ttl = ttl
+        self.model = ClickModel()
+        self._chats = OrderedDict()
+        self._spent = deque()  # время каждого спекулятивного вызова за последнюю минуту
+
+    def _calls_left(self) -> int:
+        now = time.monotonic()
+        while self._spent and now - self._spent[0] > 60:
+            self._spent.popleft()
+        return self.max_calls - len(self._spent)
+
+    def _expire(self):
+        now = time.monotonic()
+        while self._chats:
+            chat_id, (_, _, started) = next(iter(self._chats.items()))
+            if now - started < self.ttl:
+                break
+            self.discard(chat_id)
+
+    @staticmethod
+    async def _run(factory, button):
+        # корутину создаём внутри задачи: отменённая до старта задача не оставит «never awaited»
+        try:
+            return await factory(button)
+        except Exception as e:
+            logger.debug(f"Спекулятивный рефайнер не удался: {e!r}")
+            return None
+
+    def schedule(self, chat_id, key, buttons, factory, cost=lambda button: 1):
+        # factory(button) -> корутина с готовым текстом; cost(button) — сколько вызовов GigaChat она сделает
+        self.discard(chat_id)
+        self._expire()
+        self.model.shown += 1
+        if not self.enabled or limiter.queued:
+            return  # живые запросы уже ждут лимита — не отнимаем у них слоты
+        tasks = {}
+        for button in self.model.ranked(buttons)[:self.top_k]:
+            if self.model.rate(button) < self.min_rate:
+                break
+            calls = cost(button)
+            if calls > self._calls_left():
+                PREFETCH_RESULTS.labels("capped").inc()
+                break
+            self._spent.extend([time.monotonic()] * calls)
+            # чистый контекст: фоновые вызовы не попадают в трейс и метрики исходного апдейта
+            tasks[button] = asyncio.create_task(self._run(factory, button), context=contextvars.Context())
+        if tasks:
+            self._chats[chat_id] = (key, tasks, time.monotonic())
+            logger.info(f"🔮 Префетч рефайнеров для чата {chat_id}: {', '.join(tasks)}")
+
+    def take(self, chat_id, key, button) -> asyncio.Task | None:
+        # любое нажатие меняет черновик, поэтому остальные заготовки устаревают
+        self.model.clicks[button] += 1
+        entry = self._chats.pop(chat_id, None)
+        if entry is None:
+            return None
+        entry_key, tasks, _ = entry
+        task = tasks.pop(button, None) if entry_key == key else None
+        self._drop(tasks.values())
+        PREFETCH_RESULTS.labels("hit" if task is not None else "miss").inc()
+        return task
+
+    def discard(self, chat_id):
+        entry = self._chats.pop(chat_id, None)
+        if entry is not None:
+            self._drop(entry[1].values())
+
+    @staticmethod
+    def _drop(tasks):
+        for task in tasks:
+            task.cancel()
+            PREFETCH_RESULTS.labels("wasted").inc()
+
+
+speculator = Speculator(PREFETCH_ENABLED, PREFETCH_TOP_K, PREFETCH_MIN_CLICK_RATE, PREFETCH_MAX_CALLS_PER_MINUTE,
+                        PREFETCH_TTL)
@@ -1,4 +1,7 @@
+from bot.tracing import traced
 
+
+@traced()
 def build_rewrite_messages(text: str, lang: str) -> list:
     if lang == "en":
         system = (
@@ -71,41 +74,57 @@ def _q_common_header_en(position, company, context=None):
         "avoid generic phrasing; business tone; numbered list; short follow-up hints in parentheses when helpful."
     )
 
-def build_questions_with_context(position, company, context, lang):
+_Q_BODY = {
+    "ru": "Сгенерируй 7–8 стратегических вопросов, чтобы понять цели, текущее состояние, ограничения, инициативы, риски и next steps. "
+          "Каждый вопрос — про проверяемые факты; избегай расплывчатости.",
+    "en": "Generate 7–8 strategic questions to uncover goals, current state, constraints, initiatives, risks and next steps. "
+          "Each question should target verifiable facts; avoid vagueness.",
+}
+
+_FOLLOWUPS_INSTRUCTION = {
+    "ru": "Для каждого вопроса ниже предложи 1–2 follow-up подсказки (в скобках): какие уточнения задать, какие факты/метрики запросить, "
+          "как почелленджить ответ. Формат — сохранить исходную нумерацию.",
+    "en": "For each question below, provide 1–2 follow-up hints (in parentheses): what to clarify, which facts/metrics to ask for, how to challenge. "
+          "Keep the original numbering.",
+}
+
+
+def _questions_prefix(position, company, context, lang):
+    # общий префикс всех ходов сессии вопросов: с X-Session-ID GigaChat не пересчитывает его заново
     header = _q_common_header_en(position, company, context) if lang == "en" else _q_common_header_ru(position, company, context)
-    body = (
-        "Сгенерируй 7–8 стратегических вопросов, чтобы понять цели, текущее состояние, ограничения, инициативы, риски и next steps. "
-        "Каждый вопрос — про проверяемые факты; избегай расплывчатости."
-        if lang == "ru" else
-        "Generate 7–8 strategic questions to uncover goals, current state, constraints, initiatives, risks and next steps. "
-        "Each question should target verifiable facts; avoid vagueness."
-    )
-    return [{"role": "system", "content": header}, {"role": "user", "content": body}]
+    return [{"role": "system", "content": header}, {"role": "user", "content": _Q_BODY["en" if lang == "en" else "ru"]}]
 
+@traced()
+def build_questions_with_context(position, company, context, lang):
+    return _questions_prefix(position, company, context, lang)
+
+@traced()
 def build_more_questions_messages(position, company, context, prev_questions_text, lang):
-    header = _q_common_header_en(position, company, context) if lang == "en" else _q_common_header_ru(position, company, context)
     body = (
         "Сгенерируй ещё 3–5 новых вопросов без повторов и перефразов ранее полученных. "
-        "Ориентируйся на другие аспекты/углы зрения. В ответе не цитируй старые вопросы.\n\n"
-        f"Ранее сгенерированные вопросы:\n{prev_questions_text}"
+        "Ориентируйся на другие аспекты/углы зрения. В ответе не цитируй старые вопросы."
         if lang == "ru" else
         "Generate 3–5 additional NEW questions with no duplicates or paraphrases of the previous ones. "
-        "Explore other angles. Do NOT quote previous questions verbatim.\n\n"
-        f"Previously generated questions:\n{prev_questions_text}"
+        "Explore other angles. Do NOT quote previous questions verbatim."
     )
-    return [{"role": "system", "content": header}, {"role": "user", "content": body}]
+    return _questions_prefix(position, company, context, lang) + [
+        {"role": "assistant", "content": prev_questions_text},
+        {"role": "user", "content": body},
+    ]
 
-def build_followups_messages(questions_text, lang):
-    system = (
-        "Для каждого вопроса ниже предложи 1–2 follow-up подсказки (в скобках): какие уточнения задать, какие факты/метрики запросить, "
-        "как почелленджить ответ. Формат — сохранить исходную нумерацию."
-        if lang == "ru" else
-        "For each question below, provide 1–2 follow-up hints (in parentheses): what to clarify, which facts/metrics to ask for, how to challenge. "
-        "Keep the original numbering."
-    )
+@traced()
+def build_followups_messages(questions_text, lang, position=None, company=None, context=None):
+    instruction = _FOLLOWUPS_INSTRUCTION["en" if lang == "en" else "ru"]
+    if position and company:
+        # продолжение той же сессии: вопросы уже в контексте как ответ ассистента
+        return _questions_prefix(position, company, context, lang) + [
+            {"role": "assistant", "content": questions_text},
+            {"role": "user", "content": instruction},
+        ]
     user = f"Вопросы:\n{questions_text}" if lang == "ru" else f"Questions:\n{questions_text}"
-    return [{"role": "system", "content": system}, {"role": "user", "content": user}]
+    return [{"role": "system", "content": instruction}, {"role": "user", "content": user}]
 
+@traced()
 def build_structure_messages(text, lang):
     if lang == "en":
         system = (
@@ -134,6 +153,7 @@ def build_structure_messages(text, lang):
         )
     return [{"role":"system","content":system},{"role":"user","content":text}]
 
+@traced()
 def build_hypotheses_messages(text, lang):
     if lang == "en":
         system = (
@@ -148,6 +168,7 @@ def build_hypotheses_messages(text, lang):
         )
     return [{"role":"system","content":system},{"role":"user","content":text}]
 
+@traced()
 def build_frameworks_messages(text, lang):
     if lang == "en":
         system = (
@@ -161,10 +182,16 @@ def build_frameworks_messages(text, lang):
         )
     return [{"role":"system","content":system},{"role":"user","content":text}]
 
+_REFINE_SYSTEM = {
+    "en": "You improve slide titles for executive presentations. Output MUST be a short list, no prose.",
+    "ru": "Ты улучшаешь заголовки слайдов для руководителей. Вывод — краткий список, без лишнего текста.",
+}
+
+@traced()
 def build_refine_messages(mode: str, lang: str, base_text: str, draft: str | None, command: str) -> list:
     if mode == "action":
         if lang == "en":
-            system = "You improve slide titles for executive presentations. Output MUST be a short list, no prose."
+            system = _REFINE_SYSTEM["en"]
             style = {
                 "Ещё варианты": "Produce 3 ALTERNATIVE titles. Keep one-sentence, punchy, business tone.",
                 "Короче": "Return 1 title SHORTER and sharper than the draft.",
@@ -172,12 +199,10 @@ def build_refine_messages(mode: str, lang: str, base_text: str, draft: str | Non
                 "Ближе к исходнику": "Return 1 title closer to the original wording: keep the terminology and nuances of the original input.",
                 "Больше креатива": "Suggest an alternative formulation in one line (< 140 characters), changing the angle of view, but preserving the facts and the causal link.",
             }[command]
-            user = (
-                f"Original input: {base_text}\nCurrent draft: {draft}\n{style}\n"
-                "Constraints: 1 sentence each; up to 140 chars; no fluff."
-            )
+            source = f"Original input: {base_text}"
+            user = f"{style}\nConstraints: 1 sentence each; up to 140 chars; no fluff."
         else:
-            system = "Ты улучшаешь заголовки слайдов для руководителей. Вывод — краткий список, без лишнего текста."
+            system = _REFINE_SYSTEM["ru"]
             style = {
                 "Ещё варианты": "Дай 3 АЛЬТЕРНАТИВНЫХ заголовка. Один оборот, деловой тон.",
                 "Короче": "Дай 1 заголовок КОРОЧЕ и острее текущего.",
@@ -185,13 +210,36 @@ def build_refine_messages(mode: str, lang: str, base_text: str, draft: str | Non
                 "Ближе к исходнику": "Перепиши заголовок ближе к исходной формулировке: сохрани терминологию и нюансы исходного ввода",
                 "Больше креатива": "Предложи альтернативную формулировку одной строкой (≤140 символов), меняя угол зрения, но сохраняя факты и причинно-следственную связку. Избегай клише. Без преамбул.",
             }[command]
-            user = (
-                f"Исходный ввод: {base_text}\nТекущий черновик: {draft}\n{style}\n"
-                "Ограничения: 1 предложение; до 140 символов; без воды."
-            )
-        return [{"role":"system","content":system},{"role":"user","content":user}]
+            source = f"Исходный ввод: {base_text}"
+            user = f"{style}\nОграничения: 1 предложение; до 140 символов; без воды."
+        # стабильный префикс (system + исходный ввод) переиспользуется между нажатиями в одной X-Session-ID,
+        # меняются только черновик и команда в конце
+        return [
+            {"role": "system", "content": system},
+            {"role": "user", "content": source},
+            {"role": "assistant", "content": draft or ""},
+            {"role": "user", "content": user},
+        ]
     return [{"role":"user","content": base_text}]
 
+@traced()
+def build_variant_messages(lang: str, base_text: str, draft: str | None) -> list:
+    # одна альтернатива на вызов — для параллельного fan-out «Ещё варианты»; префикс тот же, что у рефайнеров
+    if lang == "en":
+        source = f"Original input: {base_text}"
+        user = ("Produce 1 ALTERNATIVE title that differs from the draft in wording and angle. "
+                "Keep one-sentence, punchy, business tone.\nConstraints: up to 140 chars; no fluff; output only the title.")
+    else:
+        source = f"Исходный ввод: {base_text}"
+        user = ("Дай 1 АЛЬТЕРНАТИВНЫЙ заголовок, отличный от текущего по формулировке и углу зрения. "
+                "Один оборот, деловой тон.\nОграничения: до 140 символов; без воды; выведи только заголовок.")
+    return [
+        {"role": "system", "content": _REFINE_SYSTEM["en" if lang == "en" else "ru"]},
+        {"role": "user", "content": source},
+        {"role": "assistant", "content": draft or ""},
+        {"role": "user", "content": user},
+    ]
+
 def scenario_instruction(mode, lang):
     if lang == "en":
         instr = {
@@ -212,6 +260,7 @@ def scenario_instruction(mode, lang):
         }
     return instr.get(mode, "Ошибка: неизвестный сценарий." if lang == "ru" else "Error: unknown scenario.")
 
+@traced()
 def build_press_test_messages(mode: str, lang: str, user_input: str, draft: str | None):
     if lang == "en":
         user = (
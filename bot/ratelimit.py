@@ -0,0 +1,128 @@
+import math, time, heapq, asyncio, itertools
+from contextlib import asynccontextmanager
+
+from bot.config import (
+    logger, GIGACHAT_RPS, GIGACHAT_BURST, GIGACHAT_MAX_CONCURRENCY, CLUSTER_WORKERS, CLUSTER_WORKER_INDEX,
+)
+from bot.tracing import span
+from bot import metrics
+
+INTERACTIVE, NORMAL, LONG, BACKGROUND = 0, 1, 2, 3
+PRIORITY_NAMES = {INTERACTIVE: "interactive", NORMAL: "normal", LONG: "long", BACKGROUND: "background"}
+
+# короткие интерактивные вызовы не должны стоять за 800-токенными генерациями
+MODE_PRIORITY = {
+    "action": INTERACTIVE,
+    "refine": INTERACTIVE,
+    "variants": INTERACTIVE,
+    "inline": INTERACTIVE,
+    "questions": NORMAL,
+    "more_questions": NORMAL,
+    "followups": NORMAL,
+    "structure": LONG,
+    "hypotheses": LONG,
+    "frameworks": LONG,
+    "press_test": LONG,
+    "prefetch": BACKGROUND,
+    "bulk": BACKGROUND,
+}
+
+
+def priority_for(mode: str | None) -> int:
+    return MODE_PRIORITY.get(mode, NORMAL)
+
+
+class PriorityRateLimiter:
+    # token bucket по RPS + потолок одновременных запросов; ожидающие отпускаются по приоритету, затем FIFO
+    def __init__(self, rps: float, burst: int, max_concurrency: int):
+        self.rate = rps
+        self.capacity = burst
+        self.max_concurrency = max_concurrency
+        self.tokens = float(burst)
+        self.active = 0
+        self._updated = time.monotonic()
+        self._waiters = []  # (priority, seq, future)
+        self._seq = itertools.count()
+        self._timer = None
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for _, _, fut in self._waiters if not fut.done())
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _try_take(self) -> bool:
+        self._refill()
+        if self.active < self.max_concurrency and self.tokens >= 1:
+            self.tokens -= 1
+            self.active += 1
+            return True
+        return False
+
+    def _on_timer(self):
+        self._timer = None
+        self._dispatch()
+
+    def _dispatch(self):
+        while self._waiters:
+            fut = self._waiters[0][2]
+            if fut.done():
+                heapq.heappop(self._waiters)
+                continue
+            if not self._try_take():
+                break
+            heapq.heappop(self._waiters)
+            fut.set_result(None)
+        # упёрлись в RPS, а не в конкурентность — просыпаемся, когда накопится токен
+        if self._waiters and self.active < self.max_concurrency and self._timer is None:
+            delay = max((1 - self.tokens) / self.rate, 0.001)
+            self._timer = asyncio.get_running_loop().call_later(delay, self._on_timer)
+
+    def _record(self, priority: int, waited: float):
+        metrics.RATELIMIT_WAIT.labels(PRIORITY_NAMES.get(priority, str(priority))).observe(waited)
+        if waited > 1.0:
+            logger.info(f"⏱️ Ожидание лимита GigaChat {waited:.2f} с (priority={PRIORITY_NAMES.get(priority)}, "
+                        f"в очереди {self.queued}, активно {self.active})")
+
+    async def acquire(self, priority: int = NORMAL) -> float:
+        started = time.monotonic()
+        if not self._waiters and self._try_take():
+            self._record(priority, 0.0)
+            return 0.0
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        self._dispatch()
+        try:
+            with span("gigachat.ratelimit", priority=PRIORITY_NAMES.get(priority, priority)):
+                await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release()  # слот уже выдан, но ждущий ушёл
+            else:
+                fut.cancel()
+            raise
+        waited = time.monotonic() - started
+        self._record(priority, waited)
+        return waited
+
+    def release(self):
+        self.active -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, priority: int = NORMAL):
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+# лимит тарифа общий на аккаунт: в кластере каждый воркер получает свою долю
+_share = CLUSTER_WORKERS if CLUSTER_WORKER_INDEX is not None else 1
+limiter = PriorityRateLimiter(GIGACHAT_RPS / _share, max(1, math.ceil(GIGACHAT_BURST / _share)),
+                              max(1, math.ceil(GIGACHAT_MAX_CONCURRENCY / _share)))
+metrics.track_limiter(limiter)
@@ -0,0 +1,189 @@
+import time, random, asyncio
+from collections import deque
+
+import httpx
+
+from bot.config import (
+    logger, GIGACHAT_DEADLINES, RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY,
+    BREAKER_FAILURE_THRESHOLD, BREAKER_COOLDOWN, HEDGE_MODES, HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES,
+)
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class UpstreamError(Exception):
+    def __init__(self, status: int, retry_after: float | None = None):
+        super().__init__(f"GigaChat ответил {status}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(Exception):
+    def __init__(self):
+        super().__init__("GigaChat временно недоступен, попробуйте через минуту")
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self, mode: str | None, deadline: float):
+        super().__init__(f"GigaChat не ответил за {deadline:.0f} с")
+        self.mode = mode
+
+
+def is_retryable(e: BaseException) -> bool:
+    if isinstance(e, UpstreamError):
+        return e.status in RETRYABLE_STATUSES
+    return isinstance(e, httpx.TransportError)
+
+
+def record_non_retryable(e: BaseException):
+    # 4xx — GigaChat ответил, значит он жив: проба удалась, хоть сам запрос и неверный
+    if isinstance(e, UpstreamError):
+        breaker.record_success()
+
+
+def deadline_for(mode: str | None) -> float:
+    return GIGACHAT_DEADLINES.get(mode, GIGACHAT_DEADLINES["default"])
+
+
+def backoff_delay(attempt: int, retry_after: float | None = None) -> float:
+    # full jitter: равномерно в [0, min(cap, base * 2^attempt)], Retry-After — нижняя граница
+    delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+    return max(delay, retry_after or 0)
+
+
+class CircuitBreaker:
+    # closed -> (N подряд неудач) -> open -> (cooldown) -> half-open: одна пробная попытка
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, cooldown: float = BREAKER_COOLDOWN):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe = False
+
+    def before_call(self) -> bool:
+        # True — этот вызов пробный: вызывающий обязан завершить его через record_* или release
+        if self.state == "closed":
+            return False
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+            self.state = "half-open"
+            self._probe = False
+        if self.state == "half-open" and not self._probe:
+            self._probe = True
+            return True
+        raise CircuitOpenError()
+
+    def release(self):
+        # проба закончилась без вердикта (отмена, проигравший hedge): следующий вызов пробует снова
+        if self.state == "half-open":
+            self._probe = False
+
+    def record_success(self):
+        if self.state != "closed":
+            logger.info("🟢 GigaChat снова отвечает, circuit breaker закрыт")
+        self.state = "closed"
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half-open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                logger.warning(f"🔴 Circuit breaker открыт на {self.cooldown:.0f} с после {self.failures} ошибок")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self._probe = False
+
+
+class LatencyTracker:
+    def __init__(self, size: int = 200):
+        self.samples = deque(maxlen=size)
+
+    def observe(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, q: float):
+        if len(self.samples) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[int(q * (len(ordered) - 1))]
+
+
+breaker = CircuitBreaker()
+latencies = {}
+
+
+def _tracker(mode: str | None) -> LatencyTracker:
+    tracker = latencies.get(mode)
+    if tracker is None:
+        tracker = latencies[mode] = LatencyTracker()
+    return tracker
+
+
+async def _hedged(fn, mode: str | None):
+    # второй запрос уходит, только если первый дольше заданного перцентиля; побеждает первый ответ
+    delay = _tracker(mode).percentile(HEDGE_PERCENTILE) if mode in HEDGE_MODES else None
+    first = asyncio.create_task(fn())
+    if delay is None:
+        return await first
+    tasks = {first}
+    try:
+        # отмена или дедлайн вызывающего в любой точке не должны оставлять запросы в полёте
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if done:
+            return first.result()
+
+        logger.info(f"🪂 Hedged-запрос для mode={mode}: первый дольше p{int(HEDGE_PERCENTILE * 100)}={delay:.2f} с")
+        tasks.add(asyncio.create_task(fn()))
+        pending, error = tasks, None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def call_with_resilience(fn, mode: str | None = None):
+    # fn — одна попытка запроса; здесь дедлайн режима, ретраи с джиттером, breaker и hedging
+    deadline = deadline_for(mode)
+    expires = time.monotonic() + deadline
+    attempt = 0
+    while True:
+        probe = breaker.before_call()
+        try:
+            remaining = expires - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceeded(mode, deadline)
+            started = time.monotonic()
+            try:
+                result = await asyncio.wait_for(_hedged(fn, mode), remaining)
+            except asyncio.TimeoutError:
+                breaker.record_failure()
+                raise DeadlineExceeded(mode, deadline) from None
+            except Exception as e:
+                if not is_retryable(e):
+                    record_non_retryable(e)
+                    raise
+                breaker.record_failure()
+                attempt += 1
+                delay = backoff_delay(attempt - 1, getattr(e, "retry_after", None))
+                if attempt >= RETRY_MAX_ATTEMPTS or breaker.state == "open" or time.monotonic() + delay >= expires:
+                    raise
+                logger.warning(
+                    f"↻ Повтор запроса к GigaChat ({attempt}/{RETRY_MAX_ATTEMPTS - 1}) через {delay:.2f} с: {e!r}")
+                await asyncio.sleep(delay)
+                continue
+            breaker.record_success()
+            _tracker(mode).observe(time.monotonic() - started)
+            return result
+        finally:
+            if probe:
+                breaker.release()
+
+
+def request_timeout(mode: str | None) -> httpx.Timeout:
+    return httpx.Timeout(deadline_for(mode), connect=5.0)
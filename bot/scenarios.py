@@ -0,0 +1,65 @@
+from dataclasses import dataclass, field
+from typing import Callable
+
+from telegram import ReplyKeyboardMarkup
+
+from bot.config import MODE_OPTIONS, LANG_OPTIONS, LANG_BUTTON, REFINERS, CACHE_MODES
+from bot.keyboards import make_kb, make_refiners_kb
+from bot.prompts import (
+    build_rewrite_messages, build_structure_messages, build_hypotheses_messages,
+    build_frameworks_messages, build_refine_messages, build_variant_messages, scenario_instruction,
+)
+
+LANGS = ("ru", "en")
+
+# клавиатуры неизменяемые — собираем один раз, а не на каждый ответ
+MENU_KB = make_kb([["Меню"]])
+MAIN_KB = make_kb([["Экшн-тайтлы", "Вопросы"], ["Структура", "Гипотезы"], ["Фреймворки", LANG_BUTTON]])
+LANG_KB = make_kb([list(LANG_OPTIONS.keys()), ["Меню"]])
+
+PROGRESS_TEXT = {"ru": "Обрабатываю...", "en": "Processing..."}
+REFINING_TEXT = {"ru": "Дорабатываю...", "en": "Refining..."}
+
+REFINER_BUTTONS = frozenset(b for buttons in REFINERS.values() for b in buttons)
+
+
+@dataclass(frozen=True)
+class Scenario:
+    mode: str
+    builder: Callable | None      # (text, lang) -> messages; None — сценарий со своим диалогом
+    temperature: float = 0.5
+    top_p: float = 0.9
+    stream: bool = False          # длинные ответы показываем по мере генерации
+    refine_builder: Callable | None = None
+    refine_temperature: float = 0.5
+    variants_builder: Callable | None = None  # (lang, base, draft) -> messages для fan-out «Ещё варианты»
+    result_kb: ReplyKeyboardMarkup = MENU_KB
+    refiners: tuple = ()
+    instruction: dict = field(default_factory=dict)  # lang -> текст подсказки
+
+    @property
+    def cache(self) -> bool:
+        return CACHE_MODES.get(self.mode, False)
+
+
+def _scenario(mode: str, builder, **kwargs) -> Scenario:
+    return Scenario(
+        mode=mode, builder=builder,
+        refiners=tuple(REFINERS.get(mode, ())),
+        instruction={lang: scenario_instruction(mode, lang) for lang in LANGS},
+        **kwargs,
+    )
+
+
+SCENARIOS = {
+    "action": _scenario("action", build_rewrite_messages, temperature=0.3,
+                        refine_builder=build_refine_messages, variants_builder=build_variant_messages,
+                        result_kb=make_refiners_kb("action")),
+    "questions": _scenario("questions", None, temperature=0.35),
+    "structure": _scenario("structure", build_structure_messages, stream=True),
+    "hypotheses": _scenario("hypotheses", build_hypotheses_messages, stream=True),
+    "frameworks": _scenario("frameworks", build_frameworks_messages, stream=True),
+}
+
+# текст кнопки -> сценарий
+SCENARIO_BY_BUTTON = {button: SCENARIOS[mode] for button, mode in MODE_OPTIONS.items()}
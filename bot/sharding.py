@@ -0,0 +1,50 @@
+import bisect, hashlib
+
+from bot.config import CLUSTER_WORKERS, CLUSTER_WORKER_INDEX, CLUSTER_VNODES
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    # consistent hashing с виртуальными узлами: при смене числа воркеров переезжает ~1/N чатов, а не все
+    def __init__(self, nodes, vnodes: int = CLUSTER_VNODES):
+        self.nodes = list(nodes)
+        points = sorted((_hash(f"{node}#{v}"), node) for node in self.nodes for v in range(vnodes))
+        self._hashes = [h for h, _ in points]
+        self._nodes = [n for _, n in points]
+
+    def node_for(self, key) -> int:
+        i = bisect.bisect(self._hashes, _hash(str(key))) % len(self._hashes)
+        return self._nodes[i]
+
+
+def shard_key(update: dict):
+    # тот же выбор, что и у ChatOrderedUpdateProcessor.chat_key: чат, иначе пользователь.
+    # в личке chat_id == user_id, так что и очередь чата, и ctx.user_data остаются в одном процессе
+    for field in ("message", "edited_message", "channel_post", "edited_channel_post", "my_chat_member",
+                  "chat_member", "chat_join_request"):
+        chat = (update.get(field) or {}).get("chat")
+        if chat:
+            return chat["id"]
+    callback = update.get("callback_query")
+    if callback and (callback.get("message") or {}).get("chat"):
+        return callback["message"]["chat"]["id"]
+    for field in ("callback_query", "inline_query", "chosen_inline_result", "shipping_query", "pre_checkout_query"):
+        user = (update.get(field) or {}).get("from")
+        if user:
+            return user["id"]
+    return update.get("update_id", 0)
+
+
+ring = HashRing(range(CLUSTER_WORKERS))
+
+
+def owns(chat_id) -> bool:
+    # однопроцессный режим владеет всеми чатами; воркер кластера — только своим шардом
+    return CLUSTER_WORKER_INDEX is None or ring.node_for(chat_id) == CLUSTER_WORKER_INDEX
+
+
+def shard_index() -> int:
+    return CLUSTER_WORKER_INDEX or 0
@@ -0,0 +1,201 @@
+import os, time, asyncio, functools
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import httpx
+from telegram.request import HTTPXRequest
+
+from bot.config import logger, TRACE_BUFFER_SIZE, TRACE_OTLP_ENDPOINT, TRACE_SERVICE_NAME
+
+EXPORT_INTERVAL = 2.0
+MAX_OPEN_TRACES = 1000
+
+
+class Trace:
+    __slots__ = ("trace_id", "update_id", "spans", "start_ns", "end_ns")
+
+    def __init__(self, update_id):
+        self.trace_id = os.urandom(16).hex()
+        self.update_id = update_id
+        self.spans = []
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    @property
+    def duration(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+    def as_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "update_id": self.update_id,
+            "duration_s": round(self.duration, 4),
+            "spans": [
+                {"name": s["name"], "span_id": s["span_id"], "parent": s["parent"],
+                 "offset_s": round((s["start"] - self.start_ns) / 1e9, 4),
+                 "duration_s": round(((s["end"] or time.time_ns()) - s["start"]) / 1e9, 4),
+                 **({"attrs": s["attrs"]} if s["attrs"] else {}), **({"error": s["error"]} if s["error"] else {})}
+                for s in self.spans
+            ],
+        }
+
+
+_trace = ContextVar("trace", default=None)
+_parent = ContextVar("trace_parent", default=None)
+_open = OrderedDict()  # update_id -> Trace: webhook открыл, диспетчер ещё не подхватил
+finished = deque(maxlen=TRACE_BUFFER_SIZE)
+_export_queue = []
+_export_task = None
+
+
+def begin_trace(update_id) -> Trace:
+    # webhook и диспетчер живут в разных задачах — связываем их по update_id
+    trace = Trace(update_id)
+    if update_id is not None:
+        _open[update_id] = trace
+        while len(_open) > MAX_OPEN_TRACES:
+            _open.popitem(last=False)
+    return _activate(trace)
+
+
+def resume_trace(update_id) -> Trace:
+    trace = _open.pop(update_id, None) if update_id is not None else None
+    return _activate(trace or Trace(update_id))
+
+
+def _activate(trace: Trace) -> Trace:
+    _trace.set(trace)
+    _parent.set(None)
+    return trace
+
+
+def end_trace(trace: Trace):
+    trace.end_ns = time.time_ns()
+    finished.append(trace)
+    if TRACE_OTLP_ENDPOINT:
+        _export_queue.append(trace)
+        _schedule_export()
+
+
+def record_span(name: str, start_ns: int, **attrs):
+    # уже завершившийся интервал, например ожидание в очереди диспетчера
+    trace = _trace.get()
+    if trace is not None:
+        trace.spans.append({"name": name, "span_id": os.urandom(8).hex(), "parent": _parent.get(),
+                            "start": start_ns, "end": time.time_ns(), "attrs": attrs, "error": None})
+
+
+@contextmanager
+def span(name: str, **attrs):
+    trace = _trace.get()
+    if trace is None:
+        yield None
+        return
+    record = {"name": name, "span_id": os.urandom(8).hex(), "parent": _parent.get(),
+              "start": time.time_ns(), "end": None, "attrs": attrs, "error": None}
+    trace.spans.append(record)
+    token = _parent.set(record["span_id"])
+    try:
+        yield record
+    except BaseException as e:
+        record["error"] = repr(e)
+        raise
+    finally:
+        record["end"] = time.time_ns()
+        try:
+            _parent.reset(token)
+        except ValueError:
+            _parent.set(record["parent"])  # async-генератор закрыли из другого контекста
+
+
+def traced(name: str | None = None):
+    # декоратор для sync- и async-функций; без активного трейса — почти бесплатно
+    def wrap(fn):
+        label = name or fn.__name__
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                if _trace.get() is None:
+                    return await fn(*args, **kwargs)
+                with span(label):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _trace.get() is None:
+                return fn(*args, **kwargs)
+            with span(label):
+                return fn(*args, **kwargs)
+        return wrapper
+    return wrap
+
+
+def slowest(limit: int = 20, min_duration: float = 0.0) -> list:
+    traces = [t for t in finished if t.duration >= min_duration]
+    traces.sort(key=lambda t: t.duration, reverse=True)
+    return [t.as_dict() for t in traces[:limit]]
+
+
+class TracingRequest(HTTPXRequest):
+    # каждый исходящий вызов Bot API — отдельный спан текущего апдейта
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        if _trace.get() is None:
+            return await super().do_request(url, method, *args, **kwargs)
+        with span(f"telegram.{url.rsplit('/', 1)[-1]}") as record:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+            record["attrs"]["status"] = code
+            return code, payload
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_payload(traces: list) -> dict:
+    spans = []
+    for trace in traces:
+        root_id = os.urandom(8).hex()
+        spans.append({
+            "traceId": trace.trace_id, "spanId": root_id, "name": "update", "kind": 2,
+            "startTimeUnixNano": str(trace.start_ns), "endTimeUnixNano": str(trace.end_ns),
+            "attributes": [{"key": "telegram.update_id", "value": _otlp_value(trace.update_id or 0)}],
+        })
+        for s in trace.spans:
+            spans.append({
+                "traceId": trace.trace_id, "spanId": s["span_id"], "parentSpanId": s["parent"] or root_id,
+                "name": s["name"], "kind": 1,
+                "startTimeUnixNano": str(s["start"]), "endTimeUnixNano": str(s["end"] or trace.end_ns),
+                "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in s["attrs"].items()],
+                "status": {"code": 2, "message": s["error"]} if s["error"] else {},
+            })
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": TRACE_SERVICE_NAME}}]},
+        "scopeSpans": [{"scope": {"name": "bot.tracing"}, "spans": spans}],
+    }]}
+
+
+def _schedule_export():
+    global _export_task
+    if _export_task is None or _export_task.done():
+        _export_task = asyncio.get_running_loop().create_task(_export_loop())
+
+
+async def _export_loop():
+    # OTLP/HTTP JSON пачками; коллектор недоступен — трейсы остаются только в памяти
+    await asyncio.sleep(EXPORT_INTERVAL)
+    batch = _export_queue[:]
+    _export_queue.clear()
+    try:
+        async with httpx.AsyncClient(timeout=5.0) as client:
+            resp = await client.post(TRACE_OTLP_ENDPOINT, json=_otlp_payload(batch))
+            resp.raise_for_status()
+    except httpx.HTTPError as e:
+        logger.debug(f"Не удалось выгрузить {len(batch)} трейсов в OTLP: {e!r}")
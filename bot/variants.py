@@ -0,0 +1,57 @@
+import re
+
+from bot.config import FANOUT_DEDUPE_THRESHOLD, TITLE_MAX_CHARS
+
+# варианты заголовков из нескольких независимых генераций: чистим, отсеиваем почти-повторы, ранжируем
+
+_MARKER = re.compile(r"^\s*(?:\d{1,2}[.)](?!\d)|[-•*])\s*")
+_QUOTES = "\"'«»“”„`"
+_NON_WORD = re.compile(r"[^a-zа-яё0-9]+")
+NGRAM = 3
+
+
+def clean(line: str) -> str:
+    # заголовки слайдов — без нумерации, кавычек и точки в конце
+    return _MARKER.sub("", line.strip()).strip().strip(_QUOTES).strip().rstrip(".").strip()
+
+
+def candidates(raw: list) -> list:
+    # модель может вернуть список вместо одной строки — берём все строки, но не преамбулы вида «Варианты:»
+    out = []
+    for text in raw:
+        for line in (text or "").splitlines():
+            title = clean(line)
+            if title and not title.endswith(":"):
+                out.append(title)
+    return out
+
+
+def _ngrams(text: str) -> set:
+    norm = " " + _NON_WORD.sub(" ", text.lower().replace("ё", "е")).strip() + " "
+    return {norm[i:i + NGRAM] for i in range(len(norm) - NGRAM + 1)}
+
+
+def _jaccard(ga: set, gb: set) -> float:
+    if not ga or not gb:
+        return 0.0
+    return len(ga & gb) / len(ga | gb)
+
+
+def similarity(a: str, b: str) -> float:
+    return _jaccard(_ngrams(a), _ngrams(b))
+
+
+def _rank_key(title: str):
+    # сначала укладывающиеся в лимит, среди них — более короткие; вышедшие за лимит — по величине превышения
+    return max(0, len(title) - TITLE_MAX_CHARS), len(title)
+
+
+def pick(raw: list, exclude: tuple = (), limit: int | None = None) -> list:
+    kept, seen = [], [_ngrams(t) for t in exclude]
+    for title in sorted(candidates(raw), key=_rank_key):
+        grams = _ngrams(title)
+        if any(_jaccard(grams, other) >= FANOUT_DEDUPE_THRESHOLD for other in seen):
+            continue
+        kept.append(title)
+        seen.append(grams)
+    return kept[:limit] if limit else kept
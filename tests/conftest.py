@@ -0,0 +1,7 @@
+import os, sys, tempfile
+
+# bot.config требует токены и создаёт DATA_DIR при импорте
+os.environ.setdefault("TELEGRAM_TOKEN", "1:test")
+os.environ.setdefault("AUTH_KEY", "test")
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="bot-tests-"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
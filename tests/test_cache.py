@@ -0,0 +1,64 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from bot import cache as cache_module
+from bot.cache import CompletionCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache_module, "time", SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+def test_ttl_expiry(clock):
+    cache = CompletionCache(None, ttl=10, memory_items=8, disk_items=8)
+
+    async def main():
+        await cache.set("k", "v")
+        clock[0] += 9
+        assert await cache.get("k") == "v"
+        clock[0] += 2
+        assert await cache.get("k") is None
+
+    asyncio.run(main())
+    assert cache.misses == 1
+
+
+def test_memory_lru_eviction(clock):
+    cache = CompletionCache(None, ttl=10, memory_items=2, disk_items=8)
+
+    async def main():
+        await cache.set("a", "1")
+        await cache.set("b", "2")
+        assert await cache.get("a") == "1"  # a свежее b
+        await cache.set("c", "3")
+        assert await cache.get("b") is None
+        assert await cache.get("a") == "1" and await cache.get("c") == "3"
+
+    asyncio.run(main())
+
+
+def test_disk_prunes_expired_and_least_recently_used(clock, tmp_path):
+    # memory_items=0: всё читается с диска
+    cache = CompletionCache(str(tmp_path / "cache.sqlite3"), ttl=10, memory_items=0, disk_items=2)
+    cache.PRUNE_EVERY = 1
+
+    async def main():
+        await cache.set("old", "0")
+        clock[0] += 11
+        await cache.set("a", "1")  # old истёк и удалён
+        clock[0] += 1
+        await cache.set("b", "2")
+        clock[0] += 1
+        assert await cache.get("a") == "1"  # a использован позже b
+        clock[0] += 1
+        await cache.set("c", "3")  # сверх disk_items: вытесняется b
+        keys = {k for (k,) in cache._db.execute("SELECT key FROM completions")}
+        assert keys == {"a", "c"}
+        assert await cache.get("b") is None and cache.hits["disk"] == 1
+
+    asyncio.run(main())
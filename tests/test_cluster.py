@@ -0,0 +1,33 @@
+from prometheus_client.parser import text_string_to_metric_families
+
+from bot.cluster import merge_metrics
+from bot.sharding import HashRing, shard_key
+
+PAGE = """# HELP bot_updates_total Updates
+# TYPE bot_updates_total counter
+bot_updates_total{mode="action"} 3.0
+# HELP bot_in_flight In flight
+# TYPE bot_in_flight gauge
+bot_in_flight 1.0
+"""
+
+
+def test_merge_metrics_labels_samples_by_worker():
+    merged = merge_metrics({0: PAGE, 1: PAGE.replace("3.0", "5.0")})
+    families = {f.name: f for f in text_string_to_metric_families(merged)}
+    assert merged.count("# TYPE bot_updates_total") == 1
+    updates = {s.labels["worker"]: s.value for s in families["bot_updates"].samples}
+    assert updates == {"0": 3.0, "1": 5.0}
+    assert [s.labels for s in families["bot_in_flight"].samples] == [{"worker": "0"}, {"worker": "1"}]
+
+
+def test_ring_moves_few_chats_when_growing():
+    before, after = HashRing(range(4)), HashRing(range(5))
+    moved = sum(before.node_for(c) != after.node_for(c) for c in range(10000))
+    assert moved < 10000 * 0.3  # ~1/5, а не все
+
+
+def test_shard_key_prefers_chat():
+    assert shard_key({"update_id": 1, "message": {"chat": {"id": 7}, "from": {"id": 8}}}) == 7
+    assert shard_key({"update_id": 1, "inline_query": {"from": {"id": 8}}}) == 8
+    assert shard_key({"update_id": 1, "callback_query": {"from": {"id": 8}, "message": {"chat": {"id": 9}}}}) == 9
@@ -0,0 +1,79 @@
+import asyncio
+from types import SimpleNamespace
+
+from bot.dispatch import ChatOrderedUpdateProcessor
+
+
+def _update(chat_id, update_id=0):
+    return SimpleNamespace(update_id=update_id, effective_chat=SimpleNamespace(id=chat_id), effective_user=None,
+                           effective_message=None)
+
+
+def test_chat_updates_run_in_order_and_chats_in_parallel():
+    async def main():
+        processor = ChatOrderedUpdateProcessor(max_concurrent_updates=2, max_pending_updates=10)
+        log = []
+        gate = asyncio.Event()
+
+        async def work(name, wait=False):
+            log.append(f"{name}+")
+            if wait:
+                await gate.wait()
+            log.append(f"{name}-")
+
+        await processor.process_update(_update(1), work("a1", wait=True))
+        await processor.process_update(_update(1), work("a2"))
+        await processor.process_update(_update(2), work("b1"))
+        for _ in range(5):
+            await asyncio.sleep(0)
+        # a2 ждёт в очереди чата и не держит слот: b1 прошёл, хотя слотов всего два
+        assert log == ["a1+", "b1+", "b1-"]
+        assert processor.pending == 2 and processor.queued == 1
+        gate.set()
+        await processor.join()
+        assert log == ["a1+", "b1+", "b1-", "a1-", "a2+", "a2-"]
+        assert processor.pending == 0
+
+    asyncio.run(main())
+
+
+def test_sheds_over_pending_limit():
+    async def main():
+        processor = ChatOrderedUpdateProcessor(max_concurrent_updates=4, max_pending_updates=1)
+        gate = asyncio.Event()
+        ran = []
+
+        async def work(name):
+            ran.append(name)
+            await gate.wait()
+
+        await processor.process_update(_update(1), work("first"))
+        await processor.process_update(_update(2), work("second"))
+        gate.set()
+        await processor.join()
+        assert ran == ["first"] and processor.shed == 1
+
+    asyncio.run(main())
+
+
+def test_sheds_updates_waiting_for_a_slot():
+    # много разных чатов: ждущие глобального слота тоже считаются pending и попадают под отказ
+    async def main():
+        processor = ChatOrderedUpdateProcessor(max_concurrent_updates=2, max_pending_updates=3)
+        gate = asyncio.Event()
+        ran = []
+
+        async def work(chat_id):
+            ran.append(chat_id)
+            await gate.wait()
+
+        await asyncio.gather(*(processor.process_update(_update(c), work(c)) for c in range(100)))
+        for _ in range(5):
+            await asyncio.sleep(0)
+        assert processor.shed == 97
+        assert processor.pending == 3 and processor.running == 2 and processor.queued == 1
+        gate.set()
+        await processor.join()
+        assert sorted(ran) == [0, 1, 2] and processor.pending == 0
+
+    asyncio.run(main())
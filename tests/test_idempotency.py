@@ -0,0 +1,25 @@
+from bot.idempotency import UpdateDeduper
+
+
+def test_unmarked_update_is_not_a_duplicate():
+    # обработка упала до mark — повтор от Telegram должен пройти
+    deduper = UpdateDeduper(10)
+    assert not deduper.seen(1)
+    assert not deduper.seen(1)
+    deduper.mark(1)
+    assert deduper.seen(1)
+    assert deduper.duplicates == 1
+
+
+def test_marks_survive_restart(tmp_path):
+    path = str(tmp_path / "updates.sqlite3")
+    UpdateDeduper(10, path).mark(5)
+    assert UpdateDeduper(10, path).seen(5)
+
+
+def test_window_evicts_oldest():
+    deduper = UpdateDeduper(2)
+    for update_id in (1, 2, 3):
+        deduper.mark(update_id)
+    assert not deduper.seen(1)
+    assert deduper.seen(3)
@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from bot.ratelimit import BACKGROUND, INTERACTIVE, LONG, PriorityRateLimiter
+
+
+def _limiter():
+    # RPS не ограничивает, один слот конкурентности
+    return PriorityRateLimiter(rps=1000, burst=1000, max_concurrency=1)
+
+
+def test_waiters_released_by_priority_then_fifo():
+    async def main():
+        limiter = _limiter()
+        order = []
+
+        async def take(name, priority):
+            async with limiter.slot(priority):
+                order.append(name)
+
+        await limiter.acquire()
+        tasks = []
+        for name, priority in [("bg", BACKGROUND), ("long1", LONG), ("inter", INTERACTIVE), ("long2", LONG)]:
+            tasks.append(asyncio.create_task(take(name, priority)))
+            await asyncio.sleep(0)
+        assert limiter.queued == 4
+        limiter.release()
+        await asyncio.gather(*tasks)
+        assert order == ["inter", "long1", "long2", "bg"]
+        assert limiter.active == 0
+
+    asyncio.run(main())
+
+
+def test_cancelled_waiter_does_not_hold_slot():
+    async def main():
+        limiter = _limiter()
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        limiter.release()
+        assert limiter.active == 0 and limiter.queued == 0
+
+    asyncio.run(main())
+
+
+def test_slot_granted_to_cancelled_waiter_is_released():
+    async def main():
+        limiter = _limiter()
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        limiter.release()  # слот уже передан ждущему, но он отменён раньше, чем проснулся
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert limiter.active == 0
+        await asyncio.wait_for(limiter.acquire(), 1)
+
+    asyncio.run(main())
@@ -0,0 +1,117 @@
+import asyncio
+
+import httpx
+import pytest
+
+from bot import resilience
+from bot.gigachat import _raise_for_upstream
+from bot.resilience import CircuitBreaker, CircuitOpenError, UpstreamError, call_with_resilience
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    # breaker сразу в half-open: следующий вызов — пробный
+    b = CircuitBreaker(failure_threshold=1, cooldown=0)
+    b.record_failure()
+    monkeypatch.setattr(resilience, "breaker", b)
+    return b
+
+
+def test_probe_success_closes(breaker):
+    async def ok():
+        return "ok"
+
+    assert asyncio.run(call_with_resilience(ok)) == "ok"
+    assert breaker.state == "closed"
+
+
+def test_probe_non_retryable_error_closes(breaker):
+    async def bad_request():
+        _raise_for_upstream(httpx.Response(400, request=httpx.Request("POST", "http://gigachat/chat")))
+
+    with pytest.raises(UpstreamError) as info:
+        asyncio.run(call_with_resilience(bad_request))
+    assert info.value.status == 400
+    assert breaker.state == "closed"
+    breaker.before_call()  # не CircuitOpenError
+
+
+def test_probe_other_error_releases(breaker):
+    async def broken():
+        raise ValueError("bad json")
+
+    with pytest.raises(ValueError):
+        asyncio.run(call_with_resilience(broken))
+    assert breaker.state == "half-open"
+    assert breaker.before_call() is True  # следующий вызов снова может пробовать
+
+
+def test_probe_cancelled_releases(breaker):
+    async def main():
+        started = asyncio.Event()
+
+        async def slow():
+            started.set()
+            await asyncio.sleep(10)
+
+        task = asyncio.create_task(call_with_resilience(slow))
+        await started.wait()
+        # пока проба в полёте, остальные вызовы отсекаются
+        with pytest.raises(CircuitOpenError):
+            breaker.before_call()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert breaker.state == "half-open"
+    assert breaker.before_call() is True
+
+
+def test_hedge_loser_does_not_leak_probe(breaker, monkeypatch):
+    monkeypatch.setattr(resilience, "HEDGE_MODES", {"action"})
+    tracker = resilience._tracker("action")
+    monkeypatch.setattr(tracker, "percentile", lambda q: 0.01)
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.05 if len(calls) == 1 else 0.0)
+        return len(calls)
+
+    assert asyncio.run(call_with_resilience(fn, "action")) == 2
+    assert breaker.state == "closed"
+
+
+def test_release_ignored_outside_half_open(breaker):
+    assert breaker.before_call() is True
+    breaker.record_failure()  # проба провалилась: снова open
+    breaker.release()
+    assert breaker.state == "open"
+    assert breaker.before_call() is True  # cooldown=0: новая проба
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_hedge_cancelled_before_second_cancels_first(monkeypatch):
+    monkeypatch.setattr(resilience, "HEDGE_MODES", {"action"})
+    monkeypatch.setattr(resilience._tracker("action"), "percentile", lambda q: 10)
+
+    async def main():
+        started, cancelled = asyncio.Event(), asyncio.Event()
+
+        async def slow():
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            finally:
+                cancelled.set()
+
+        task = asyncio.create_task(resilience._hedged(slow, "action"))
+        await started.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await asyncio.wait_for(cancelled.wait(), 1)
+
+    asyncio.run(main())
@@ -0,0 +1,190 @@
+"""Нагрузочный драйвер: синтетические Telegram-апдейты через webhook (app.py) или polling-диспетчер.
+
+Сквозная задержка — от отправки апдейта до финального sendMessage, который фиксирует
+tools/mock_gigachat.py. Перед запуском бот должен смотреть на заглушку
+(GIGACHAT_OAUTH_URL, GIGACHAT_API_URL, TELEGRAM_API_URL).
+
+    # webhook: app.py уже запущен с RENDER_EXTERNAL_URL=http://127.0.0.1:5000
+    python tools/loadtest.py webhook --url http://127.0.0.1:5000/webhook --users 50 --requests 5
+
+    # polling: приложение из ai_consulting_bot.py поднимается в этом же процессе
+    python tools/loadtest.py polling --users 50 --requests 5 --mode Структура
+
+    # многоходовой сценарий: --setup без ожидания ответа, затем --texts по очереди (последний повторяется)
+    python tools/loadtest.py polling --users 20 --requests 4 --mode Вопросы --setup "директор по ИТ в банке" \
+        --texts "цифровая трансформация||Ещё вопросы"
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import itertools
+import statistics
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_update_ids = itertools.count(int(time.time()))
+_message_ids = itertools.count(1)
+
+
+def make_update(chat_id: int, text: str) -> dict:
+    return {
+        "update_id": next(_update_ids),
+        "message": {
+            "message_id": next(_message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": f"load{chat_id}"},
+            "text": text,
+        },
+    }
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = (len(values) - 1) * q
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+class WebhookSender:
+    def __init__(self, url: str, client: httpx.AsyncClient):
+        self.url = url
+        self.client = client
+
+    async def start(self):
+        pass
+
+    async def send(self, update: dict):
+        resp = await self.client.post(self.url, content=json.dumps(update), headers={"Content-Type": "application/json"})
+        resp.raise_for_status()
+
+    async def stop(self):
+        pass
+
+
+class PollingSender:
+    # те же обработчики и диспетчер, что в run_polling, но апдейты кладём прямо в update_queue
+    def __init__(self):
+        from ai_consulting_bot import build_application
+        self.app = build_application()
+
+    async def start(self):
+        await self.app.initialize()
+        if self.app.post_init:
+            await self.app.post_init(self.app)
+        await self.app.start()
+
+    async def send(self, update: dict):
+        from telegram import Update
+        await self.app.update_queue.put(Update.de_json(update, self.app.bot))
+
+    async def stop(self):
+        await self.app.stop()
+        if self.app.post_shutdown:
+            await self.app.post_shutdown(self.app)
+        await self.app.shutdown()
+
+
+async def run_user(chat_id, sender, client, args, latencies, failures):
+    replies = 0
+
+    async def wait_reply():
+        nonlocal replies
+        resp = await client.get(f"{args.mock}/_wait", params={"chat_id": chat_id, "after": replies, "timeout": args.timeout},
+                                timeout=args.timeout + 5)
+        if resp.status_code != 200:
+            return False
+        replies = resp.json()["count"]
+        return True
+
+    if args.mode:
+        await sender.send(make_update(chat_id, args.mode))
+    # апдейты одного чата обрабатываются по порядку, поэтому промежуточные шаги можно не ждать
+    for text in args.setup:
+        await sender.send(make_update(chat_id, text))
+    texts = args.texts.split("||") if args.texts else None
+    for i in range(args.requests):
+        if texts:
+            text = texts[min(i, len(texts) - 1)]
+        else:
+            text = args.text if args.repeat else f"{args.text} #{chat_id}-{i}"
+        t0 = time.perf_counter()
+        try:
+            await sender.send(make_update(chat_id, text))
+            ok = await wait_reply()
+        except httpx.HTTPError:
+            ok = False
+        if ok:
+            latencies.append(time.perf_counter() - t0)
+        else:
+            failures.append(chat_id)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="End-to-end load test for the consulting bot")
+    parser.add_argument("transport", choices=["webhook", "polling"])
+    parser.add_argument("--url", default="http://127.0.0.1:5000/webhook", help="webhook URL (app.py)")
+    parser.add_argument("--mock", default="http://127.0.0.1:8081", help="mock_gigachat.py base URL")
+    parser.add_argument("--users", type=int, default=20, help="параллельных синтетических чатов")
+    parser.add_argument("--requests", type=int, default=5, help="запросов на чат, последовательно")
+    parser.add_argument("--mode", default="", help="кнопка режима перед запросами, например 'Структура'")
+    parser.add_argument("--text", default="Рост издержек на логистику замедляет масштабирование бизнеса")
+    parser.add_argument("--repeat", action="store_true", help="одинаковый текст во всех запросах (проверка кэша)")
+    parser.add_argument("--setup", action="append", default=[], help="сообщение до замеров, ответ не ждём")
+    parser.add_argument("--texts", default="", help="тексты замеряемых запросов через '||'")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--chat-base", type=int, default=10_000_000)
+    parser.add_argument("--out", default="", help="сохранить отчёт в JSON")
+    args = parser.parse_args()
+    args.mock = args.mock.rstrip("/")
+
+    async with httpx.AsyncClient(timeout=args.timeout) as client:
+        sender = WebhookSender(args.url, client) if args.transport == "webhook" else PollingSender()
+        await client.delete(f"{args.mock}/_stats")
+        await sender.start()
+        latencies, failures = [], []
+        t0 = time.perf_counter()
+        try:
+            await asyncio.gather(*[
+                run_user(args.chat_base + u, sender, client, args, latencies, failures)
+                for u in range(args.users)
+            ])
+        finally:
+            wall = time.perf_counter() - t0
+            await sender.stop()
+        stats = (await client.get(f"{args.mock}/_stats")).json()
+
+    report = {
+        "transport": args.transport,
+        "users": args.users,
+        "requests": args.users * args.requests,
+        "completed": len(latencies),
+        "failed": len(failures),
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 3) if wall else 0.0,
+        "latency_s": {
+            "mean": round(statistics.fmean(latencies), 3) if latencies else 0.0,
+            "p50": round(percentile(latencies, 0.50), 3),
+            "p95": round(percentile(latencies, 0.95), 3),
+            "p99": round(percentile(latencies, 0.99), 3),
+            "max": round(max(latencies), 3) if latencies else 0.0,
+        },
+        "upstream": stats["upstream"],
+        "telegram_calls": stats["telegram"],
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,281 @@
+"""Локальная заглушка GigaChat и Telegram Bot API для нагрузочного тестирования.
+
+Запуск:
+    python tools/mock_gigachat.py --port 8081 --latency lognormal:1.2:0.5 --error-rate 0.02
+
+Бот направляется на заглушку переменными окружения:
+    GIGACHAT_OAUTH_URL=http://127.0.0.1:8081/api/v2/oauth
+    GIGACHAT_API_URL=http://127.0.0.1:8081/api/v1
+    TELEGRAM_API_URL=http://127.0.0.1:8081
+"""
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import logging
+from collections import defaultdict
+
+import tornado.web
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+logger = logging.getLogger("mock")
+
+MOCK_MARK = "[mock]"
+FINAL_PREFIXES = ("Ошибка", "Error", "⏳")
+
+WORDS = ("рост", "издержки", "логистика", "масштабирование", "выручка", "маржа", "клиенты", "рынок",
+         "сегмент", "драйвер", "инициатива", "эффект", "стратегия", "операционная", "модель")
+
+
+def count_tokens(text) -> int:
+    return len(str(text)) // 3
+
+
+def parse_latency(spec: str):
+    # fixed:0.5 | uniform:0.2:1.5 | lognormal:<медиана>:<sigma>
+    kind, *args = spec.split(":")
+    args = [float(a) for a in args]
+    if kind == "fixed":
+        return lambda: args[0]
+    if kind == "uniform":
+        return lambda: random.uniform(args[0], args[1])
+    if kind == "lognormal":
+        import math
+        mu = math.log(args[0])
+        return lambda: random.lognormvariate(mu, args[1])
+    raise ValueError(f"Unknown latency spec: {spec}")
+
+
+class State:
+    def __init__(self, latency, oauth_latency, error_rate, error_statuses, tokens_per_second,
+                 prefill_tokens_per_second=3000.0):
+        self.latency = latency
+        self.oauth_latency = oauth_latency
+        self.error_rate = error_rate
+        self.error_statuses = error_statuses
+        self.tokens_per_second = tokens_per_second
+        self.prefill_tokens_per_second = prefill_tokens_per_second
+        self.reset()
+
+    def reset(self):
+        self.inflight = 0
+        self.peak_inflight = 0
+        self.requests = 0
+        self.errors = 0
+        self.oauth_requests = 0
+        self.message_id = 0
+        self.replies = defaultdict(list)  # chat_id -> [monotonic ts финальных ответов]
+        self.waiters = defaultdict(list)
+        self.telegram_calls = defaultdict(int)
+        self.sessions = {}  # X-Session-ID -> сообщения последнего хода вместе с ответом
+        self.prompt_tokens = 0
+        self.precached_tokens = 0
+
+    def precached(self, session_id, messages) -> int:
+        # как кэш контекста GigaChat: бесплатен только общий префикс с прошлым ходом сессии
+        previous = self.sessions.get(session_id) if session_id else None
+        cached = 0
+        for old, new in zip(previous or [], messages):
+            if old != new:
+                break
+            cached += count_tokens(new.get("content", ""))
+        return cached
+
+    def record_reply(self, chat_id: int, text: str):
+        if MOCK_MARK not in text and not text.startswith(FINAL_PREFIXES):
+            return
+        self.replies[chat_id].append(time.monotonic())
+        for fut in self.waiters.pop(chat_id, []):
+            if not fut.done():
+                fut.set_result(None)
+
+
+class OAuthHandler(tornado.web.RequestHandler):
+    async def post(self):
+        state = self.settings["state"]
+        state.oauth_requests += 1
+        await asyncio.sleep(state.oauth_latency())
+        self.write({"access_token": uuid.uuid4().hex, "expires_at": int((time.time() + 1800) * 1000)})
+
+
+class CompletionsHandler(tornado.web.RequestHandler):
+    async def post(self):
+        state = self.settings["state"]
+        payload = json.loads(self.request.body)
+        state.requests += 1
+        state.inflight += 1
+        state.peak_inflight = max(state.peak_inflight, state.inflight)
+        try:
+            if random.random() < state.error_rate:
+                state.errors += 1
+                await asyncio.sleep(state.latency() * 0.1)
+                self.set_status(random.choice(state.error_statuses))
+                return self.write({"status": self.get_status(), "message": "mock error"})
+
+            max_tokens = int(payload.get("max_tokens", 120))
+            n_tokens = random.randint(max(1, max_tokens // 3), max_tokens)
+            words = [MOCK_MARK] + [random.choice(WORDS) for _ in range(n_tokens - 1)]
+            finish_reason = "length" if n_tokens == max_tokens else "stop"
+            messages = payload.get("messages", [])
+            session_id = self.request.headers.get("X-Session-ID")
+            usage = {"prompt_tokens": sum(count_tokens(m.get("content", "")) for m in messages),
+                     "completion_tokens": n_tokens, "precached_prompt_tokens": state.precached(session_id, messages)}
+            usage["total_tokens"] = usage["prompt_tokens"] + n_tokens
+            state.prompt_tokens += usage["prompt_tokens"]
+            state.precached_tokens += usage["precached_prompt_tokens"]
+            if session_id:
+                state.sessions[session_id] = messages + [{"role": "assistant", "content": " ".join(words)}]
+            # prefill некэшированной части промпта + генерация, поверх — базовая задержка
+            prefill = (usage["prompt_tokens"] - usage["precached_prompt_tokens"]) / state.prefill_tokens_per_second
+            total = state.latency() + prefill + n_tokens / state.tokens_per_second
+
+            if payload.get("stream"):
+                await self._stream(words, total, finish_reason, usage)
+            else:
+                await asyncio.sleep(total)
+                # n > 1 — дополнительные варианты той же длины, время генерации не растёт
+                contents = [" ".join(words)] + [
+                    " ".join([MOCK_MARK] + [random.choice(WORDS) for _ in range(n_tokens - 1)])
+                    for _ in range(int(payload.get("n", 1)) - 1)
+                ]
+                self.write({
+                    "choices": [{"message": {"role": "assistant", "content": content},
+                                 "index": i, "finish_reason": finish_reason} for i, content in enumerate(contents)],
+                    "created": int(time.time()), "model": payload.get("model", "GigaChat"),
+                    "usage": usage, "object": "chat.completion",
+                })
+        finally:
+            state.inflight -= 1
+
+    async def _stream(self, words, total, finish_reason, usage):
+        self.set_header("Content-Type", "text/event-stream")
+        chunk = 8
+        parts = [" ".join(words[i:i + chunk]) + " " for i in range(0, len(words), chunk)]
+        step = total / max(len(parts), 1)
+        for i, part in enumerate(parts):
+            await asyncio.sleep(step)
+            last = i == len(parts) - 1
+            delta = {"choices": [{"delta": {"content": part}, "index": 0,
+                                  "finish_reason": finish_reason if last else None}]}
+            if last:
+                delta["usage"] = usage
+            self.write(f"data: {json.dumps(delta, ensure_ascii=False)}\n\n")
+            await self.flush()
+        self.write("data: [DONE]\n\n")
+
+
+class TelegramHandler(tornado.web.RequestHandler):
+    def _arg(self, name, default=None):
+        value = self.get_body_argument(name, None)
+        if value is None and self.request.headers.get("Content-Type", "").startswith("application/json"):
+            value = json.loads(self.request.body or b"{}").get(name)
+        return default if value is None else value
+
+    def _message(self, chat_id, text):
+        state = self.settings["state"]
+        state.message_id += 1
+        return {"message_id": state.message_id, "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"}, "text": text}
+
+    async def post(self, token, method):
+        state = self.settings["state"]
+        state.telegram_calls[method] += 1
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Mock", "username": "mock_bot",
+                      "can_join_groups": False, "can_read_all_group_messages": False,
+                      "supports_inline_queries": True}
+        elif method in ("setWebhook", "deleteWebhook", "deleteMessage", "answerInlineQuery",
+                        "sendChatAction", "setMyCommands"):
+            result = True
+        elif method == "getWebhookInfo":
+            result = {"url": "", "has_custom_certificate": False, "pending_update_count": 0}
+        elif method == "getUpdates":
+            await asyncio.sleep(1)
+            result = []
+        elif method in ("sendMessage", "editMessageText", "sendDocument"):
+            chat_id = int(self._arg("chat_id", 0))
+            text = self._arg("text", "") or self._arg("caption", "") or ""
+            if method == "sendMessage":
+                state.record_reply(chat_id, text)
+            result = self._message(chat_id, text)
+        else:
+            result = True
+        self.write({"ok": True, "result": result})
+
+    get = post
+
+
+class StatsHandler(tornado.web.RequestHandler):
+    def get(self):
+        state = self.settings["state"]
+        self.write({
+            "upstream": {"requests": state.requests, "errors": state.errors, "inflight": state.inflight,
+                         "peak_inflight": state.peak_inflight, "oauth_requests": state.oauth_requests,
+                         "prompt_tokens": state.prompt_tokens, "precached_prompt_tokens": state.precached_tokens},
+            "telegram": dict(state.telegram_calls),
+            "replies": sum(len(v) for v in state.replies.values()),
+        })
+
+    def delete(self):
+        self.settings["state"].reset()
+        self.write({"ok": True})
+
+
+class WaitHandler(tornado.web.RequestHandler):
+    # ждём, пока в чате chat_id станет больше `after` финальных ответов
+    async def get(self):
+        state = self.settings["state"]
+        chat_id = int(self.get_query_argument("chat_id"))
+        after = int(self.get_query_argument("after", "0"))
+        timeout = float(self.get_query_argument("timeout", "60"))
+        while len(state.replies[chat_id]) <= after:
+            fut = asyncio.get_running_loop().create_future()
+            state.waiters[chat_id].append(fut)
+            try:
+                await asyncio.wait_for(fut, timeout)
+            except asyncio.TimeoutError:
+                self.set_status(504)
+                return self.write({"ok": False})
+        self.write({"ok": True, "count": len(state.replies[chat_id])})
+
+
+def make_app(state: State):
+    return tornado.web.Application([
+        (r"/api/v2/oauth", OAuthHandler),
+        (r"/api/v1/chat/completions", CompletionsHandler),
+        (r"/bot([^/]+)/(\w+)", TelegramHandler),
+        (r"/_stats", StatsHandler),
+        (r"/_wait", WaitHandler),
+    ], state=state)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Mock GigaChat + Telegram Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", default="lognormal:0.8:0.5", help="fixed:S | uniform:A:B | lognormal:MEDIAN:SIGMA")
+    parser.add_argument("--oauth-latency", default="fixed:0.2")
+    parser.add_argument("--tokens-per-second", type=float, default=60.0)
+    parser.add_argument("--prefill-tokens-per-second", type=float, default=3000.0,
+                        help="скорость обработки некэшированного промпта")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-statuses", default="500,502,503,429")
+    args = parser.parse_args()
+
+    state = State(
+        latency=parse_latency(args.latency),
+        oauth_latency=parse_latency(args.oauth_latency),
+        error_rate=args.error_rate,
+        error_statuses=[int(s) for s in args.error_statuses.split(",")],
+        tokens_per_second=args.tokens_per_second,
+        prefill_tokens_per_second=args.prefill_tokens_per_second,
+    )
+    make_app(state).listen(args.port, address=args.host)
+    logger.info(f"🧪 Mock GigaChat/Telegram слушает http://{args.host}:{args.port}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())